@@ -0,0 +1,316 @@
+import os
+import sys
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+# polars runs scans and group-bys multi-threaded and pushes column selection and row filters into the csv
+# reader; pandas is the fallback. every function hands back pandas objects so callers never branch on backend
+backend_order = ['polars', 'pandas']
+missing_codes = [-9, -8, -7, -6, -5, -4, -3, -2, -1]
+schema_sample_rows = 10000
+
+def _has_polars():
+    try:
+        import polars  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def available_backends():
+    return [name for name in backend_order if name == 'pandas' or _has_polars()]
+
+def get_backend(backend=None):
+    # explicit > ANES_BACKEND env var > first installed in backend_order
+    backend = backend or os.environ.get('ANES_BACKEND') or available_backends()[0]
+    if backend not in backend_order:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {backend_order}")
+    if backend == 'polars' and not _has_polars():
+        raise ImportError("The polars backend needs polars installed (pip install polars)")
+    return backend
+
+def mp_context():
+    # fork is cheapest (workers inherit the frame), but a forked child deadlocks once polars has
+    # started its thread pool in the parent, so spawn as soon as polars is loaded
+    if 'fork' in mp.get_all_start_methods() and 'polars' not in sys.modules:
+        return mp.get_context('fork')
+    return mp.get_context('spawn')
+
+def _polars_scan(path, columns=None, infer_schema_length=schema_sample_rows):
+    # nothing is read until collect, so the select below becomes the reader's column projection
+    import polars as pl
+    lf = pl.scan_csv(path, infer_schema_length=infer_schema_length)
+    if columns is not None:
+        schema = lf.collect_schema()
+        lf = lf.select([col for col in columns if col in schema])
+    return lf
+
+def _polars_collect(build):
+    # schema is inferred from the first rows; if a column changes type further down, infer from the whole file
+    import polars as pl
+    try:
+        return build(schema_sample_rows)
+    except pl.exceptions.ComputeError:
+        return build(None)
+
+def read_csv(path, columns=None, filters=None, backend=None):
+    # columns and filters ({column: allowed values}) run inside the scan on polars;
+    # filter columns don't have to be among the selected columns
+    backend = get_backend(backend)
+    filters = filters or {}
+    if backend == 'polars':
+        import polars as pl
+
+        def build(infer_schema_length):
+            lf = _polars_scan(path, infer_schema_length=infer_schema_length)
+            schema = lf.collect_schema()
+            for col, values in filters.items():
+                # polars wants the allowed values in the column's own dtype
+                lf = lf.filter(pl.col(col).is_in(pl.Series(list(values)).cast(schema[col], strict=False).implode()))
+            if columns is not None:
+                lf = lf.select([col for col in columns if col in schema])
+            return lf.collect()
+        return _polars_collect(build).to_pandas()
+
+    usecols = None
+    if columns is not None:
+        header = read_header(path)
+        usecols = [col for col in columns if col in header]
+    # round_trip parses floats exactly like polars, the default parser can be 1 ulp off
+    df = pd.read_csv(path, usecols=None if usecols is None else usecols + [col for col in filters if col not in usecols],
+                     float_precision='round_trip')
+    for col, values in filters.items():
+        df = df[df[col].isin(list(values))]
+    if usecols is not None:
+        df = df[usecols]
+    return df.reset_index(drop=True)
+
+def read_csv_chunks(path, columns=None, filters=None, chunk_rows=100_000):
+    # pandas reader in row chunks for memory-budgeted runs; same columns/filters semantics as read_csv
+    filters = filters or {}
+    usecols = None
+    if columns is not None:
+        header = read_header(path)
+        usecols = [col for col in columns if col in header]
+    reader = pd.read_csv(path, usecols=None if usecols is None else usecols + [col for col in filters if col not in usecols],
+                         float_precision='round_trip', chunksize=chunk_rows)
+    for chunk in reader:
+        for col, values in filters.items():
+            chunk = chunk[chunk[col].isin(list(values))]
+        yield chunk if usecols is None else chunk[usecols]
+
+def read_header(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def _polars_design(path, var_cols, designs, priority):
+    import polars as pl
+    design_cols = [col for name in priority for col in designs[name].values()]
+
+    def clean_code(col):
+        # keeps int columns int unless a missing code turns up, same as pandas replace
+        is_missing = pl.col(col).cast(pl.Float64, strict=False).is_in([float(code) for code in missing_codes])
+        return pl.when(is_missing).then(None).otherwise(pl.col(col)).alias(var_cols[col])
+
+    def clean_design(col):
+        values = pl.col(col)
+        if schema[col] == pl.String:
+            values = values.str.strip_chars().cast(pl.Float64, strict=False)
+        values = values.cast(pl.Float64)
+        return pl.when(values.is_in([float(code) for code in missing_codes])).then(None).otherwise(values).alias(col)
+
+    usable = {name: pl.col(cols['weight']).is_not_null() & pl.col(cols['psu']).is_not_null()
+              & pl.col(cols['stratum']).is_not_null() & (pl.col(cols['weight']) > 0)
+              for name, cols in designs.items()}
+    if priority:
+        assigned = [pl.coalesce([pl.when(usable[name]).then(pl.col(designs[name][part])) for name in priority]).alias(part)
+                    for part in ('weight', 'psu', 'stratum')]
+        source = pl.coalesce([pl.when(usable[name]).then(pl.lit(name)) for name in priority]).alias('_source')
+    else:
+        assigned = [pl.lit(None, dtype=pl.Float64).alias(part) for part in ('weight', 'psu', 'stratum')]
+        source = pl.lit(None, dtype=pl.String).alias('_source')
+
+    def build(infer_schema_length):
+        nonlocal schema
+        lf = _polars_scan(path, list(var_cols) + design_cols, infer_schema_length)
+        schema = lf.collect_schema()
+        lf = lf.with_columns([clean_design(col) for col in design_cols])
+        return lf.select([clean_code(col) for col in var_cols] + assigned + [source]).collect()
+
+    schema = None
+    frame = _polars_collect(build).to_pandas()
+    return frame.drop(columns='_source'), frame['_source']
+
+def _clean_items(raw, var_cols):
+    frame = raw[list(var_cols)].rename(columns=var_cols)
+    for col in frame.columns:
+        frame[col] = frame[col].replace(missing_codes, np.nan)
+    return frame
+
+def _clean_design_column(values):
+    # blank strings and missing codes -> nan, the rest numeric
+    if values.dtype == object:
+        values = values.str.strip().replace('', np.nan)
+    return pd.to_numeric(values, errors='coerce').replace(missing_codes, np.nan)
+
+def _pandas_design(path, var_cols, designs, priority):
+    design_cols = [col for name in priority for col in designs[name].values()]
+    raw = read_csv(path, list(var_cols) + design_cols, backend='pandas')
+    return _assign_design(raw, var_cols, designs, priority)
+
+def stream_with_design(path, var_cols, designs, priority, chunk_rows):
+    # load_with_design one row chunk at a time (pandas reader), for ingest under a memory budget
+    design_cols = [col for name in priority for col in designs[name].values()]
+    for raw in read_csv_chunks(path, list(var_cols) + design_cols, chunk_rows=chunk_rows):
+        yield _assign_design(raw.reset_index(drop=True), var_cols, designs, priority)
+
+def _assign_design(raw, var_cols, designs, priority):
+    design_cols = [col for name in priority for col in designs[name].values()]
+    frame = _clean_items(raw, var_cols)
+
+    for col in design_cols:
+        raw[col] = _clean_design_column(raw[col])
+
+    n = len(raw)
+    weight, psu, stratum = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    source = np.full(n, None, dtype=object)
+    # first usable design in priority order wins, one vectorized pass per design instead of per row
+    for name in priority:
+        cols = designs[name]
+        w, p, s = raw[cols['weight']].values, raw[cols['psu']].values, raw[cols['stratum']].values
+        take = np.isnan(weight) & ~np.isnan(w) & ~np.isnan(p) & ~np.isnan(s) & (np.nan_to_num(w) > 0)
+        weight[take], psu[take], stratum[take], source[take] = w[take], p[take], s[take], name
+    frame['weight'], frame['psu'], frame['stratum'] = weight, psu, stratum
+    return frame, pd.Series(source, name='_source')
+
+def load_with_design(path, var_cols, designs, priority, backend=None):
+    # raw file -> renamed codebook columns with missing codes as nan, plus weight/psu/stratum from the
+    # first usable design; also returns which design each row took (None when none applied)
+    backend = get_backend(backend)
+    if backend == 'polars':
+        return _polars_design(path, var_cols, designs, priority)
+    return _pandas_design(path, var_cols, designs, priority)
+
+def load_designs(path, var_cols, designs, backend=None):
+    # every design kept side by side instead of picking one per row: the cleaned items plus
+    # {design: frame of weight, psu, stratum}, nan wherever that design doesn't cover the respondent
+    design_cols = [col for cols in designs.values() for col in cols.values()]
+    raw = read_csv(path, list(var_cols) + design_cols, backend=backend)
+    per_design = {}
+    for name, cols in designs.items():
+        parts = pd.DataFrame({part: _clean_design_column(raw[col]) for part, col in cols.items()})
+        usable = parts.notna().all(axis=1) & (parts['weight'] > 0)
+        per_design[name] = parts.where(usable)
+    return _clean_items(raw, var_cols), per_design
+
+def _frequency_table(df, columns, weight_col, has_weight, backend):
+    if backend == 'polars':
+        import polars as pl
+        frame = pl.from_pandas(df[columns + ([weight_col] if has_weight else [])].astype(
+            {col: float for col in columns}))
+        weight = pl.col(weight_col) if has_weight else pl.lit(1.0)
+        long = frame.unpivot(index=[weight_col] if has_weight else [], on=columns,
+                             variable_name='question', value_name='value').drop_nulls('value').filter(
+            pl.col('value').is_not_nan())
+        return long.group_by(['question', 'value']).agg(
+            pl.len().alias('n'), weight.filter(weight.is_not_null()).sum().alias('weighted_n'),
+            weight.is_not_null().sum().alias('n_weighted')).to_pandas()
+    base = df[columns].astype(float)
+    base['_weight'] = df[weight_col] if has_weight else 1.0
+    long = base.melt(id_vars='_weight', value_vars=columns, var_name='question', value_name='value')
+    long = long[long['value'].notna()]
+    table = long.groupby(['question', 'value'], sort=False)['_weight'].agg(['size', 'sum', 'count'])
+    return table.reset_index().rename(columns={'size': 'n', 'sum': 'weighted_n', 'count': 'n_weighted'})
+
+def weighted_frequencies(df, columns, weight_col='weight', backend=None):
+    # one grouped pass over every item: rows of question, value, n (all valid rows) and weighted_n
+    # (rows that also have a weight); keeps the question order and sorts values within each.
+    # the long format costs ~5 floats per cell, so over the memory budget it runs on row chunks
+    from anes_memory import plan, chunk_slices, float_bytes
+    backend = get_backend(backend)
+    columns = [col for col in columns if col in df.columns]
+    has_weight = weight_col in df.columns
+    decision = plan('weighted_frequencies', len(df), 5 * float_bytes * max(len(columns), 1))
+    if decision['strategy'] == 'chunked':
+        parts = [_frequency_table(df.iloc[part], columns, weight_col, has_weight, backend)
+                 for part in chunk_slices(len(df), decision['chunk_rows'])]
+        table = pd.concat(parts, ignore_index=True).groupby(['question', 'value'], sort=False)[
+            ['n', 'weighted_n', 'n_weighted']].sum().reset_index()
+    else:
+        table = _frequency_table(df, columns, weight_col, has_weight, backend)
+
+    order = {col: idx for idx, col in enumerate(columns)}
+    table['n'] = table['n'].astype(np.int64)
+    table['n_weighted'] = table['n_weighted'].astype(np.int64)
+    table = table.sort_values(['question', 'value'], key=lambda s: s.map(order) if s.name == 'question' else s)
+    return table[['question', 'value', 'n', 'weighted_n', 'n_weighted']].reset_index(drop=True)
+
+def _json_diff(a, b, path='', rtol=1e-9):
+    # exact for keys, counts and strings; floats may differ by summation order only
+    if isinstance(a, dict) and isinstance(b, dict):
+        if list(a) != list(b):
+            return [f"{path}: keys {list(a)} != {list(b)}"]
+        return [d for key in a for d in _json_diff(a[key], b[key], f"{path}/{key}", rtol)]
+    if isinstance(a, float) and isinstance(b, float):
+        if np.isnan(a) and np.isnan(b):
+            return []
+        return [] if abs(a - b) <= rtol * max(abs(a), abs(b), 1e-300) else [f"{path}: {a!r} != {b!r}"]
+    if type(a) is not type(b) or a != b:
+        return [f"{path}: {a!r} != {b!r}"]
+    return []
+
+def check_parity(csv_file_path='lgbt_anes.csv', backends=None, raw_rows=20000):
+    # every backend against pandas on the bundled data: file scan, frequencies, descriptives json,
+    # and weight assignment on a synthetic raw file (the raw anes release is not bundled)
+    import tempfile
+    from data.dicts import var_dict
+    from data.weights import weights_dict, priority_order
+    from anes_descriptives import generate_descriptive_json
+    from anes_synthetic import write_synthetic
+
+    backends = [b for b in (backends or available_backends()) if b != 'pandas']
+    problems = {}
+    reference = read_csv(csv_file_path, backend='pandas').rename(columns=var_dict)
+    ref_json = generate_descriptive_json(reference, backend='pandas')
+    question_cols = [col for col in reference.columns if col not in ('weight', 'psu', 'stratum', 'sample_mode')]
+    ref_freq = weighted_frequencies(reference, question_cols, backend='pandas')
+
+    with tempfile.TemporaryDirectory(prefix='anes_parity_') as workdir:
+        raw_path = write_synthetic(os.path.join(workdir, 'raw.csv'), raw_rows, layout='raw')
+        designs = {name: weights_dict[name] for name in priority_order}
+        ref_design, ref_source = load_with_design(raw_path, var_dict, designs, priority_order, backend='pandas')
+
+        for backend in backends:
+            found = []
+            frame = read_csv(csv_file_path, backend=backend).rename(columns=var_dict)
+            try:
+                pd.testing.assert_frame_equal(reference, frame, check_exact=True)
+            except AssertionError as e:
+                found.append(f"read_csv: {e}")
+
+            subset = read_csv(csv_file_path, columns=['trans_therm', 'gay_therm'], filters={'resp_partyid': [1, 2, 3]},
+                              backend=backend)
+            expected = read_csv(csv_file_path, columns=['trans_therm', 'gay_therm'], filters={'resp_partyid': [1, 2, 3]},
+                                backend='pandas')
+            try:
+                pd.testing.assert_frame_equal(expected, subset, check_exact=True)
+            except AssertionError as e:
+                found.append(f"read_csv pushdown: {e}")
+
+            freq = weighted_frequencies(frame, question_cols, backend=backend)
+            try:
+                pd.testing.assert_frame_equal(ref_freq, freq, check_exact=False, rtol=1e-12)
+            except AssertionError as e:
+                found.append(f"weighted_frequencies: {e}")
+
+            found += [f"descriptives {d}" for d in _json_diff(
+                {k: v for k, v in ref_json.items() if k != 'metadata'},
+                {k: v for k, v in generate_descriptive_json(frame, backend=backend).items() if k != 'metadata'})]
+
+            design, source = load_with_design(raw_path, var_dict, designs, priority_order, backend=backend)
+            try:
+                pd.testing.assert_frame_equal(ref_design, design, check_exact=True)
+                pd.testing.assert_series_equal(ref_source.fillna('none'), source.fillna('none'), check_dtype=False)
+            except AssertionError as e:
+                found.append(f"load_with_design: {e}")
+            problems[backend] = found
+    return problems
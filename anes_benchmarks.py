@@ -0,0 +1,255 @@
+import os
+import sys
+import gc
+import json
+import time
+import tempfile
+import argparse
+import contextlib
+import multiprocessing as mp
+from datetime import datetime
+import pandas as pd
+from data.dicts import theme_dict
+from data.schema import theme_columns
+from anes_synthetic import synthetic_frame, write_synthetic
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+scale_dict = {
+    '5k': 5_000,
+    '50k': 50_000,
+    '500k': 500_000,
+    '5M': 5_000_000
+}
+
+default_threshold = 0.25  # fail when a case gets more than 25% slower than its baseline
+default_memory_threshold = 0.25  # ... or its peak rss grows more than 25%
+
+def _question_cols(df):
+    trans_cols = [col for col in theme_dict['trans_qs'] if col in df.columns]
+    gay_cols = [col for col in theme_dict['gay_qs'] if col in df.columns]
+    demo_cols = theme_columns(df.columns, 'demographics')
+    return trans_cols, gay_cols, demo_cols
+
+def _bench_lgbt_fixed(inputs, workdir):
+    from data.formatanes import anes_lgbt_fixed
+    return lambda: anes_lgbt_fixed(input_file=inputs['raw_csv'], output_file=os.path.join(workdir, 'lgbt_out.csv'))
+
+def _bench_question_group(inputs, workdir):
+    from anes_descriptives import _analyze_question_group
+    df = pd.read_pickle(inputs['processed_pkl'])
+    trans_cols, gay_cols, demo_cols = _question_cols(df)
+    return lambda: _analyze_question_group(df, trans_cols + gay_cols, "Benchmark")
+
+def _bench_summary_stats(inputs, workdir):
+    from anes_descriptives import _generate_summary_stats
+    df = pd.read_pickle(inputs['processed_pkl'])
+    trans_cols, gay_cols, demo_cols = _question_cols(df)
+    return lambda: _generate_summary_stats(df, trans_cols, gay_cols, demo_cols)
+
+def _bench_samplics(inputs, workdir):
+    from anes_statistics import samplics_analysis
+    df = pd.read_pickle(inputs['processed_pkl'])
+    return lambda: samplics_analysis(df)
+
+def _bench_weighted_mean(inputs, workdir):
+    from anes_statistics import calculate_weighted_mean
+    df = pd.read_pickle(inputs['processed_pkl'])
+    return lambda: calculate_weighted_mean(df['trans_therm'], df['weight'])
+
+def _bench_weighted_std(inputs, workdir):
+    from anes_statistics import calculate_weighted_std
+    df = pd.read_pickle(inputs['processed_pkl'])
+    return lambda: calculate_weighted_std(df['trans_therm'], df['weight'])
+
+def _bench_distribution_plot(inputs, workdir):
+    import matplotlib
+    matplotlib.use('Agg')
+    from anes_visualizations import create_single_distribution_plot
+    df = pd.read_pickle(inputs['processed_pkl'])
+    trans_cols, gay_cols, demo_cols = _question_cols(df)
+    return lambda: create_single_distribution_plot(df, trans_cols, 'Benchmark', os.path.join(workdir, 'bench.png'))
+
+def _bench_calibrate(inputs, workdir):
+    from anes_calibration import calibrate, margins_from_weights
+    df = pd.read_pickle(inputs['processed_pkl'])
+    targets = margins_from_weights(df)
+    df['weight'] = 1.0
+    return lambda: calibrate(df, targets)
+
+# the same repeated subgroup counts through fresh float masks and through a prebuilt bitmap index
+subgroup_queries = [('gay_id', (2, 3, 4)), ('int_mode', (2,)), ('resp_partyid', (1, 2, 3)), ('resp_race', (1,)),
+                    ('trans_military', (1, 2, 3)), ('resp_edu', (4, 5))]
+
+def _bench_subgroup_masks(inputs, workdir):
+    df = pd.read_pickle(inputs['processed_pkl'])
+    return lambda: [int((df[a].isin(va) & df[b].isin(vb)).sum()) for a, va in subgroup_queries for b, vb in subgroup_queries]
+
+def _bench_subgroup_bitmaps(inputs, workdir):
+    from anes_bitmaps import BitmapIndex
+    df = pd.read_pickle(inputs['processed_pkl'])
+    index = BitmapIndex(df)
+    return lambda: [(index.isin(a, va) & index.isin(b, vb)).count() for a, va in subgroup_queries for b, vb in subgroup_queries]
+
+# each entry returns a zero-argument callable; setup (imports, loading data) is not timed
+benchmark_dict = {
+    'anes_lgbt_fixed': {'setup': _bench_lgbt_fixed, 'needs': 'raw'},
+    '_analyze_question_group': {'setup': _bench_question_group, 'needs': 'processed'},
+    '_generate_summary_stats': {'setup': _bench_summary_stats, 'needs': 'processed'},
+    'samplics_analysis': {'setup': _bench_samplics, 'needs': 'processed'},
+    'calculate_weighted_mean': {'setup': _bench_weighted_mean, 'needs': 'processed'},
+    'calculate_weighted_std': {'setup': _bench_weighted_std, 'needs': 'processed'},
+    'calibrate': {'setup': _bench_calibrate, 'needs': 'processed'},
+    'subgroup_masks': {'setup': _bench_subgroup_masks, 'needs': 'processed'},
+    'subgroup_bitmaps': {'setup': _bench_subgroup_bitmaps, 'needs': 'processed'},
+    'create_single_distribution_plot': {'setup': _bench_distribution_plot, 'needs': 'processed'}
+}
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_case(name, inputs, workdir, repeat, queue):
+    # runs in a fresh child so peak rss belongs to this case alone
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            func = benchmark_dict[name]['setup'](inputs, workdir)
+            gc.collect()
+            rss_before = _max_rss_mb()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - start)
+        rss_after = _max_rss_mb()
+        queue.put({
+            'status': 'ok',
+            'seconds': min(timings),
+            'seconds_all': timings,
+            'peak_rss_mb': rss_after,
+            'peak_rss_growth_mb': None if rss_after is None else rss_after - rss_before
+        })
+    except Exception as e:
+        queue.put({'status': f'error: {type(e).__name__}: {e}'})
+
+def _prepare_inputs(n, needs, workdir, seed):
+    inputs = {}
+    if 'raw' in needs:
+        inputs['raw_csv'] = write_synthetic(os.path.join(workdir, f'raw_{n}.csv'), n, layout='raw', seed=seed)
+    if 'processed' in needs:
+        inputs['processed_pkl'] = os.path.join(workdir, f'processed_{n}.pkl')
+        synthetic_frame(n, layout='processed', seed=seed).to_pickle(inputs['processed_pkl'])
+    return inputs
+
+def run_benchmarks(functions=None, scales=None, repeat=1, seed=0, timeout=None):
+    functions = list(benchmark_dict) if functions is None else functions
+    scales = list(scale_dict) if scales is None else scales
+    ctx = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix='anes_bench_') as workdir:
+        for scale in scales:
+            n = scale_dict[scale]
+            needs = {benchmark_dict[name]['needs'] for name in functions}
+            inputs = _prepare_inputs(n, needs, workdir, seed)
+            for name in functions:
+                queue = ctx.Queue()
+                proc = ctx.Process(target=_run_case, args=(name, inputs, workdir, repeat, queue))
+                proc.start()
+                proc.join(timeout)
+                if proc.is_alive():
+                    proc.terminate()
+                    proc.join()
+                    result = {'status': 'timeout'}
+                else:
+                    try:
+                        result = queue.get(timeout=5)
+                    except Exception:
+                        result = {'status': f'crashed (exit code {proc.exitcode})'}
+                results.append({'function': name, 'scale': scale, 'n': n, **result})
+    return results
+
+def check_regressions(results, baseline, threshold=default_threshold, memory_threshold=default_memory_threshold):
+    # wall time and peak memory are gated separately, each against its own threshold
+    regressions = []
+    for result in results:
+        key = f"{result['function']}@{result['scale']}"
+        if result.get('status') != 'ok' or key not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[key]['seconds']
+        result['baseline_ratio'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append({'case': key, 'metric': 'seconds', 'ratio': ratio, 'value': result['seconds'],
+                                'baseline': baseline[key]['seconds']})
+        base_peak, peak = baseline[key].get('peak_rss_mb'), result.get('peak_rss_mb')
+        if base_peak and peak is not None:
+            result['baseline_memory_ratio'] = peak / base_peak
+            if peak / base_peak > 1 + memory_threshold:
+                regressions.append({'case': key, 'metric': 'peak_rss_mb', 'ratio': peak / base_peak, 'value': peak,
+                                    'baseline': base_peak})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot analysis functions on synthetic data')
+    parser.add_argument('--functions', default=','.join(benchmark_dict))
+    parser.add_argument('--scales', default=','.join(scale_dict))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=None, help='seconds per case')
+    parser.add_argument('--threshold', type=float, default=default_threshold, help='allowed wall-time growth')
+    parser.add_argument('--memory-threshold', type=float, default=default_memory_threshold,
+                        help='allowed peak memory growth')
+    parser.add_argument('--baseline', default='anes_bench_baseline.json')
+    parser.add_argument('--history', default='anes_bench_history.jsonl')
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.functions.split(','), args.scales.split(','), args.repeat, args.seed, args.timeout)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = check_regressions(results, baseline, args.threshold, args.memory_threshold)
+
+    run_time = datetime.now().isoformat()
+    with open(args.history, 'a') as f:
+        for result in results:
+            f.write(json.dumps({'time': run_time, **result}) + "\n")
+
+    print(f"{'function':<34}{'scale':>6}{'seconds':>11}{'peak MB':>10}{'vs base':>9}{'mem vs base':>13}")
+    for result in results:
+        if result.get('status') != 'ok':
+            print(f"{result['function']:<34}{result['scale']:>6}  {result['status']}")
+            continue
+        ratio = f"x{result['baseline_ratio']:.2f}" if 'baseline_ratio' in result else '-'
+        peak = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+        memory = f"x{result['baseline_memory_ratio']:.2f}" if 'baseline_memory_ratio' in result else '-'
+        print(f"{result['function']:<34}{result['scale']:>6}{result['seconds']:>11.3f}{peak:>10}{ratio:>9}{memory:>13}")
+
+    if args.update_baseline:
+        for result in results:
+            if result.get('status') == 'ok':
+                baseline[f"{result['function']}@{result['scale']}"] = {
+                    'seconds': result['seconds'], 'peak_rss_mb': result['peak_rss_mb'], 'updated': run_time}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%} wall time / {args.memory_threshold:.0%} memory:")
+        for regression in regressions:
+            unit = 's' if regression['metric'] == 'seconds' else ' MB'
+            print(f"  {regression['case']} {regression['metric']}: {regression['baseline']:.3f}{unit} -> "
+                  f"{regression['value']:.3f}{unit} (x{regression['ratio']:.2f})")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
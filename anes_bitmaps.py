@@ -0,0 +1,302 @@
+import re
+import numpy as np
+import pandas as pd
+from anes_profiling import profiled
+from data.schema import kind_of
+
+# bitmap indexes over the coded columns: one packed bitmap (uint64 words, bit i of word i // 64 is row i)
+# per distinct value, plus one for missing. subgroup filters become and/or/not over words instead of
+# fresh float comparisons over the frame, e.g. "gay_id in (2, 3, 4) and int_mode == 2 and not resp_race == 1"
+
+unindexed_kinds = ('thermometer', 'design', 'unknown')
+unindexed_cols = ('case_id',)
+_popcount = getattr(np, 'bitwise_count', None)
+
+def index_columns(columns):
+    # coded columns worth indexing up front: admin, demographics and categorical items (not thermometers)
+    return [col for col in columns if kind_of(col) not in unindexed_kinds and col not in unindexed_cols]
+
+def _pack(mask):
+    # bool rows -> uint64 words, zero padded past the last row
+    packed = np.packbits(mask, bitorder='little')
+    padded = np.zeros(-(-len(packed) // 8) * 8, dtype=np.uint8)
+    padded[:len(packed)] = packed
+    return padded.view(np.uint64)
+
+class Selection:
+    # a packed set of rows of one frame; combine with & | ~ and - (and not)
+    __slots__ = ('words', 'n', 'label')
+
+    def __init__(self, words, n, label=None):
+        self.words, self.n, self.label = words, n, label
+
+    @classmethod
+    def from_mask(cls, mask, label=None):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(_pack(mask), len(mask), label)
+
+    @classmethod
+    def everything(cls, n):
+        selection = ~cls(np.zeros(-(-n // 64), dtype=np.uint64), n)
+        selection.label = 'all'
+        return selection
+
+    def _check(self, other):
+        if not isinstance(other, Selection) or other.n != self.n:
+            raise ValueError("Selections can only be combined with selections over the same rows")
+
+    def _join(self, other, word):
+        return f"({self.label}) {word} ({other.label})" if self.label and other.label else None
+
+    def __and__(self, other):
+        self._check(other)
+        return Selection(self.words & other.words, self.n, self._join(other, 'and'))
+
+    def __or__(self, other):
+        self._check(other)
+        return Selection(self.words | other.words, self.n, self._join(other, 'or'))
+
+    def __sub__(self, other):
+        self._check(other)
+        return Selection(self.words & ~other.words, self.n, self._join(other, 'and not'))
+
+    def __invert__(self):
+        words = ~self.words
+        if self.n % 64:
+            # keep the padding bits clear so counts stay exact
+            words[-1] &= np.uint64((1 << (self.n % 64)) - 1)
+        return Selection(words, self.n, f"not ({self.label})" if self.label else None)
+
+    def count(self):
+        if _popcount is not None:
+            return int(_popcount(self.words).sum())
+        return int(np.unpackbits(self.words.view(np.uint8)).sum())
+
+    __len__ = count
+
+    def mask(self):
+        return np.unpackbits(self.words.view(np.uint8), count=self.n, bitorder='little').view(bool)
+
+    def rows(self):
+        return np.flatnonzero(self.mask())
+
+    def series(self, index):
+        return pd.Series(self.mask(), index=index)
+
+    def take(self, df):
+        if len(df) != self.n:
+            raise ValueError(f"Selection covers {self.n:,} rows but the frame has {len(df):,}")
+        return df.iloc[self.rows()]
+
+    def __repr__(self):
+        return f"Selection({self.count():,} of {self.n:,} rows{f': {self.label}' if self.label else ''})"
+
+# where-expression tokens: parentheses, commas, comparison operators, names/keywords, numbers, quoted strings
+_token = re.compile(r"\s*(?:(?P<punct>[(),])|(?P<op>==|!=|<=|>=|<|>|=)|(?P<name>[A-Za-z_]\w*)"
+                    r"|(?P<number>-?\d+(?:\.\d*)?)|(?P<string>'[^']*'|\"[^\"]*\"))")
+_comparisons = {
+    '==': lambda values, v: values == v, '=': lambda values, v: values == v, '!=': lambda values, v: values != v,
+    '<': lambda values, v: values < v, '<=': lambda values, v: values <= v,
+    '>': lambda values, v: values > v, '>=': lambda values, v: values >= v
+}
+
+def _tokenize(text):
+    tokens, pos = [], 0
+    text = text.strip()
+    while pos < len(text):
+        match = _token.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Cannot parse filter at '{text[pos:]}'")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'number':
+            value = float(value)
+        elif kind == 'string':
+            value = value[1:-1]
+        elif kind == 'name' and value.lower() in ('and', 'or', 'not', 'in', 'is', 'missing'):
+            kind, value = 'keyword', value.lower()
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+class BitmapIndex:
+    """
+    per value bitmaps for the coded columns of one frame, built once (other columns on first use).
+    rebuild after changing the frame. a comparison matches answered rows only, so "x != 2" leaves out
+    missing rows while "not x == 2" keeps them
+    """
+    def __init__(self, df, columns=None):
+        self.df = df
+        self.n = len(df)
+        self._bitmaps = {}
+        for col in (index_columns(df.columns) if columns is None else columns):
+            self._build(col)
+
+    def _build(self, col):
+        if col not in self.df.columns:
+            raise KeyError(f"Unknown filter column '{col}'")
+        codes, values = pd.factorize(self.df[col], sort=True)
+        bitmaps = np.empty((len(values) + 1, -(-self.n // 64)), dtype=np.uint64)
+        for position in range(len(values)):
+            bitmaps[position] = _pack(codes == position)
+        bitmaps[-1] = _pack(codes < 0)
+        self._bitmaps[col] = (np.asarray(values), {value: i for i, value in enumerate(values.tolist())}, bitmaps)
+
+    def _column(self, col):
+        if col not in self._bitmaps:
+            self._build(col)
+        return self._bitmaps[col]
+
+    def columns(self):
+        return list(self._bitmaps)
+
+    def values(self, col):
+        return self._column(col)[0]
+
+    def nbytes(self):
+        return sum(bitmaps.nbytes for _, _, bitmaps in self._bitmaps.values())
+
+    def _union(self, col, positions, label):
+        bitmaps = self._column(col)[2]
+        if len(positions) == 0:
+            return Selection(np.zeros(bitmaps.shape[1], dtype=np.uint64), self.n, label)
+        return Selection(np.bitwise_or.reduce(bitmaps[positions], axis=0), self.n, label)
+
+    def isin(self, col, values):
+        _, lookup, _ = self._column(col)
+        positions = [lookup[v] for v in values if v in lookup]
+        shown = ', '.join(f'{v:g}' if isinstance(v, float) else repr(v) for v in values)
+        return self._union(col, positions, f"{col} in ({shown})")
+
+    def eq(self, col, value):
+        selection = self.isin(col, [value])
+        selection.label = f"{col} == {value:g}" if isinstance(value, float) else f"{col} == {value!r}"
+        return selection
+
+    def compare(self, col, op, value):
+        values = self._column(col)[0]
+        try:
+            hits = np.flatnonzero(_comparisons[op](values, value))
+        except TypeError:
+            raise ValueError(f"Cannot compare '{col}' with {value!r}") from None
+        return self._union(col, hits, f"{col} {op} {value:g}" if isinstance(value, float) else f"{col} {op} {value!r}")
+
+    def missing(self, col):
+        bitmaps = self._column(col)[2]
+        return Selection(bitmaps[-1].copy(), self.n, f"{col} is missing")
+
+    def everything(self):
+        return Selection.everything(self.n)
+
+    @profiled
+    def select(self, text):
+        """
+        parse a where-expression into a Selection. comparisons: col == v, != , <, <=, >, >=,
+        col in (v, ...), col not in (...), col is missing, col is not missing; joined by and/or/not
+        and parentheses ('and' binds tighter than 'or')
+        """
+        tokens = _tokenize(text)
+        if not tokens:
+            return self.everything()
+        selection, pos = self._or(tokens, 0)
+        if pos != len(tokens):
+            raise ValueError(f"Unexpected '{tokens[pos][1]}' in filter '{text}'")
+        selection.label = text.strip()
+        return selection
+
+    def _or(self, tokens, pos):
+        left, pos = self._and(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == ('keyword', 'or'):
+            right, pos = self._and(tokens, pos + 1)
+            left = left | right
+        return left, pos
+
+    def _and(self, tokens, pos):
+        left, pos = self._not(tokens, pos)
+        while pos < len(tokens) and tokens[pos] == ('keyword', 'and'):
+            right, pos = self._not(tokens, pos + 1)
+            left = left & right
+        return left, pos
+
+    def _not(self, tokens, pos):
+        if pos < len(tokens) and tokens[pos] == ('keyword', 'not'):
+            inner, pos = self._not(tokens, pos + 1)
+            return ~inner, pos
+        if pos < len(tokens) and tokens[pos] == ('punct', '('):
+            inner, pos = self._or(tokens, pos + 1)
+            if pos >= len(tokens) or tokens[pos] != ('punct', ')'):
+                raise ValueError("Missing ')' in filter")
+            return inner, pos + 1
+        return self._comparison(tokens, pos)
+
+    def _expect(self, tokens, pos, what):
+        if pos >= len(tokens):
+            raise ValueError(f"Filter ends early, expected {what}")
+        return tokens[pos]
+
+    def _comparison(self, tokens, pos):
+        kind, col = self._expect(tokens, pos, 'a column name')
+        if kind != 'name':
+            raise ValueError(f"Expected a column name, got '{col}'")
+        kind, word = self._expect(tokens, pos + 1, f"an operator after '{col}'")
+        if kind == 'op':
+            kind, value = self._expect(tokens, pos + 2, f"a value after '{col} {word}'")
+            if kind not in ('number', 'string'):
+                raise ValueError(f"Expected a value after '{col} {word}', got '{value}'")
+            if word in ('==', '='):
+                return self.eq(col, value), pos + 3
+            return self.compare(col, word, value), pos + 3
+        if (kind, word) == ('keyword', 'is'):
+            negate = self._expect(tokens, pos + 2, "'missing'") == ('keyword', 'not')
+            if self._expect(tokens, pos + 2 + negate, "'missing'") != ('keyword', 'missing'):
+                raise ValueError(f"Expected '{col} is missing' or '{col} is not missing'")
+            selection = self.missing(col)
+            return (~selection if negate else selection), pos + 3 + negate
+        negate = (kind, word) == ('keyword', 'not')
+        if self._expect(tokens, pos + 1 + negate, "'in'") != ('keyword', 'in'):
+            raise ValueError(f"Expected an operator after '{col}', got '{word}'")
+        pos += 2 + negate
+        if self._expect(tokens, pos, "'('") != ('punct', '('):
+            raise ValueError(f"Expected '(' after '{col} in'")
+        values, pos = [], pos + 1
+        while True:
+            kind, value = self._expect(tokens, pos, "a value or ')'")
+            if kind in ('number', 'string'):
+                values.append(value)
+            elif (kind, value) == ('punct', ')'):
+                break
+            elif (kind, value) != ('punct', ','):
+                raise ValueError(f"Unexpected '{value}' in '{col} in (...)'")
+            pos += 1
+        selection = self.isin(col, values)
+        if negate:
+            # answered rows outside the listed values, like !=
+            selection = ~selection - self.missing(col)
+            selection.label = f"{col} not in ({', '.join(f'{v:g}' if isinstance(v, float) else repr(v) for v in values)})"
+        return selection, pos + 1
+
+def as_mask(selection, df):
+    # None, a Selection, a bool mask or a where-expression -> bool Series over df (None stays None)
+    if selection is None:
+        return None
+    if isinstance(selection, str):
+        selection = BitmapIndex(df, columns=[]).select(selection)
+    if isinstance(selection, Selection):
+        if selection.n != len(df):
+            raise ValueError(f"Selection covers {selection.n:,} rows but the frame has {len(df):,}")
+        return selection.series(df.index)
+    if isinstance(selection, pd.Series):
+        return selection.reindex(df.index, fill_value=False).astype(bool)
+    return pd.Series(np.asarray(selection, dtype=bool), index=df.index)
+
+def select_rows(df, selection):
+    # the frame restricted to a selection (any form as_mask takes); no selection returns df itself
+    mask = as_mask(selection, df)
+    return df if mask is None else df[mask.to_numpy()]
+
+def selection_label(selection):
+    if selection is None:
+        return None
+    if isinstance(selection, str):
+        return selection
+    return getattr(selection, 'label', None) or 'custom selection'
@@ -0,0 +1,269 @@
+import time
+import itertools
+import numpy as np
+import pandas as pd
+from data.weights import calibration_dict, default_margins
+from anes_profiling import profiled
+
+# calibration works on integer cell codes: every margin becomes one int array over respondents, so an
+# iteration is a bincount per margin and a gather back to rows, never a groupby.
+# rows missing a margin variable fall in an extra 'missing' cell that keeps its base share
+
+missing_cell = 'Missing'
+default_bounds = (0.3, 3.0)  # calibrated / base weight for logit calibration
+default_tol = 1e-6  # largest relative margin error accepted as converged
+
+def dimension_codes(df, dim):
+    # one calibration dimension -> (codes with -1 for missing, cell labels)
+    spec = calibration_dict[dim]
+    values = df[spec['column']].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    if 'bins' in spec:
+        bins = np.asarray(spec['bins'], dtype=float)
+        codes = np.digitize(values, bins) - 1
+        valid &= (values >= bins[0]) & (values < bins[-1])
+        return np.where(valid, codes, -1), list(spec['labels'])
+    labels = list(spec['groups'])
+    top = max(code for codes in spec['groups'].values() for code in codes)
+    lookup = np.full(top + 1, -1)
+    for idx, codes in enumerate(spec['groups'].values()):
+        lookup[codes] = idx
+    valid &= (values >= 0) & (values <= top)
+    return np.where(valid, lookup[np.where(valid, values, 0).astype(int)], -1), labels
+
+def margin_codes(df, margin):
+    # 'age*race' -> joint cell codes (mixed radix) and 'label|label' cell names
+    parts = [dimension_codes(df, dim) for dim in margin.split('*')]
+    codes = np.zeros(len(df), dtype=np.intp)
+    missing = np.zeros(len(df), dtype=bool)
+    for part_codes, labels in parts:
+        codes = codes * len(labels) + np.maximum(part_codes, 0)
+        missing |= part_codes < 0
+    labels = ['|'.join(cell) for cell in itertools.product(*[labels for _, labels in parts])]
+    return np.where(missing, -1, codes), labels
+
+def margins_from_weights(df, margins=None, weight_col='weight'):
+    # weighted shares of every margin cell, e.g. to carry the official weights' margins to another weight
+    margins = margins or default_margins
+    weights = df[weight_col].to_numpy(dtype=float) if weight_col in df.columns else np.ones(len(df))
+    usable = ~np.isnan(weights)
+    targets = {}
+    for margin in margins:
+        codes, labels = margin_codes(df, margin)
+        keep = usable & (codes >= 0)
+        totals = np.bincount(codes[keep], weights=weights[keep], minlength=len(labels))
+        targets[margin] = {label: float(total / totals.sum()) for label, total in zip(labels, totals)}
+    return targets
+
+def _setup(df, targets, base, population_total):
+    # targets (shares or totals per cell) -> [(margin, codes, target totals, labels)], the missing cell last
+    total = population_total or base.sum()
+    scale = total / base.sum()
+    setup = []
+    for margin, cells in targets.items():
+        codes, labels = margin_codes(df, margin)
+        unknown = [cell for cell in cells if cell not in labels]
+        if unknown:
+            raise KeyError(f"Margin '{margin}' has no cell(s) {', '.join(unknown)}; cells are {', '.join(labels)}")
+        codes = np.where(codes < 0, len(labels), codes)
+        observed = np.bincount(codes, weights=base, minlength=len(labels) + 1)
+        wanted = np.array([cells.get(label, 0.0) for label in labels], dtype=float)
+        empty = [label for label, want, seen in zip(labels, wanted, observed) if want > 0 and seen == 0]
+        if empty:
+            raise ValueError(f"Margin '{margin}' has targets for cell(s) with no respondents: {', '.join(empty)}")
+        missing_total = observed[-1] * scale
+        target = np.append(wanted / wanted.sum() * (total - missing_total), missing_total)
+        setup.append((margin, codes, target, labels + [missing_cell]))
+    return setup
+
+def _max_error(setup, weights):
+    errors = [np.abs(np.bincount(codes, weights=weights, minlength=len(target)) - target) / np.maximum(target, 1e-12)
+              for _, codes, target, _ in setup]
+    return float(max(np.max(np.where(target > 0, error, 0.0)) for error, (_, _, target, _) in zip(errors, setup)))
+
+def trim_limits(total, n, bounds):
+    # (low, high) multiples of the mean weight -> absolute limits; the mean is fixed by the population total
+    low, high = bounds
+    mean = total / n
+    return (low * mean if low else 0.0), (high * mean if high else np.inf)
+
+def infeasible_cells(setup, n_rows, limits):
+    # cells whose target can't be met with every weight inside the limits: count * low > target or
+    # count * high < target. necessary, not sufficient: crossing margins can still clash
+    low, high = limits
+    cells = []
+    for margin, codes, target, labels in setup:
+        counts = np.bincount(codes, minlength=len(target))
+        for label, count, want in zip(labels, counts, target):
+            if want > 0 and (count * low > want * (1 + 1e-12) or count * high < want * (1 - 1e-12)):
+                cells.append(f"{margin}={label}")
+    return cells
+
+def _bounded_scale(weights, codes, target, limits, inner_iter=25):
+    # one raking step with limits: per cell, the factor r with sum(clip(w * r, low, high)) = target,
+    # found by rescaling only the weights not at a limit until the clipped set stops changing
+    low, high = limits
+    ratio = np.ones(len(target))
+    for _ in range(inner_iter):
+        scaled = weights * ratio[codes]
+        free = (scaled > low) & (scaled < high)
+        fixed_total = np.bincount(codes, weights=np.where(free, 0.0, np.clip(scaled, low, high)), minlength=len(target))
+        free_total = np.bincount(codes, weights=np.where(free, weights, 0.0), minlength=len(target))
+        wanted = np.divide(target - fixed_total, free_total, out=ratio.copy(), where=free_total > 0)
+        wanted = np.where(target > 0, np.maximum(wanted, 0.0), 0.0)
+        if np.allclose(wanted, ratio, rtol=1e-12, atol=0):
+            break
+        ratio = wanted
+    return np.clip(weights * ratio[codes], low, high)
+
+def _rake(setup, base, max_iter, tol, trim):
+    # iterative proportional fitting, one bincount and one gather per margin per pass. with trim, each
+    # step keeps every weight inside the limits and rescales the rest of its cell (bounded raking), so
+    # the error is always that of weights that respect the limits
+    limits = trim_limits(setup[0][2].sum(), len(base), trim) if trim else None
+    weights = base.copy() if limits is None else np.clip(base * setup[0][2].sum() / base.sum(), *limits)
+    history = []
+    for iteration in range(1, max_iter + 1):
+        for _, codes, target, _ in setup:
+            if limits is None:
+                totals = np.bincount(codes, weights=weights, minlength=len(target))
+                ratio = np.divide(target, totals, out=np.zeros_like(target), where=totals > 0)
+                weights *= ratio[codes]
+            else:
+                weights = _bounded_scale(weights, codes, target, limits)
+        history.append(_max_error(setup, weights))
+        if history[-1] < tol:
+            return weights, iteration, True, history
+        if len(history) > 10 and history[-1] > (1 - 1e-9) * history[-11]:
+            # no progress in ten passes: the limits leave no solution, more passes won't find one
+            break
+    return weights, len(history), False, history
+
+def _distance(method, bounds):
+    # F(u) and F'(u) with w = d * F(x'lambda); linear is the chi-square distance (greg), logit keeps w/d in bounds
+    if method == 'linear':
+        return lambda u: 1.0 + u, lambda u: np.ones_like(u)
+    low, high = bounds
+    if not low < 1 < high:
+        raise ValueError(f"Logit calibration needs bounds around 1, got {bounds}")
+    a = (high - low) / ((1 - low) * (high - 1))
+
+    def f(u):
+        e = np.exp(np.clip(a * u, -500, 500))
+        return (low * (high - 1) + high * (1 - low) * e) / ((high - 1) + (1 - low) * e)
+
+    def df(u):
+        e = np.exp(np.clip(a * u, -500, 500))
+        return a * e * (1 - low) * (high - 1) * (high - low) / ((high - 1) + (1 - low) * e) ** 2
+    return f, df
+
+def _newton(setup, base, method, bounds, max_iter, tol):
+    # lagrange multipliers, one per cell; gradient and hessian blocks are bincounts over (cell, cell) pairs.
+    # margins share the grand total so the hessian is singular, lstsq picks the minimum norm step
+    f, df = _distance(method, bounds)
+    sizes = [len(target) for _, _, target, _ in setup]
+    offsets = np.cumsum([0] + sizes)
+    target = np.concatenate([t for _, _, t, _ in setup])
+    lam = np.zeros(offsets[-1])
+    history = []
+    for iteration in range(1, max_iter + 1):
+        eta = sum(lam[offsets[j] + codes] for j, (_, codes, _, _) in enumerate(setup))
+        weights = base * f(eta)
+        history.append(_max_error(setup, weights))
+        if history[-1] < tol:
+            return weights, iteration, True, history
+        slope = base * df(eta)
+        grad = np.concatenate([np.bincount(codes, weights=weights, minlength=size)
+                               for (_, codes, _, _), size in zip(setup, sizes)]) - target
+        hess = np.zeros((offsets[-1], offsets[-1]))
+        for j, (_, codes_j, _, _) in enumerate(setup):
+            for k, (_, codes_k, _, _) in enumerate(setup[j:], start=j):
+                block = np.bincount(codes_j * sizes[k] + codes_k, weights=slope,
+                                    minlength=sizes[j] * sizes[k]).reshape(sizes[j], sizes[k])
+                hess[offsets[j]:offsets[j + 1], offsets[k]:offsets[k + 1]] = block
+                hess[offsets[k]:offsets[k + 1], offsets[j]:offsets[j + 1]] = block.T
+        lam -= np.linalg.lstsq(hess, grad, rcond=None)[0]
+    eta = sum(lam[offsets[j] + codes] for j, (_, codes, _, _) in enumerate(setup))
+    weights = base * f(eta)
+    history.append(_max_error(setup, weights))
+    return weights, max_iter, history[-1] < tol, history
+
+def weight_diagnostics(weights, base=None, reference=None):
+    # spread and efficiency of a weight vector: kish design effect from weighting, effective n,
+    # ratios to the base weights, and agreement with a reference weight (e.g. the official one)
+    w = pd.Series(weights).dropna().to_numpy(dtype=float)
+    mean = w.mean()
+    deff = float(1 + w.var() / mean ** 2) if mean else None
+    summary = {
+        'n': int(len(w)), 'sum': float(w.sum()), 'min': float(w.min()), 'max': float(w.max()),
+        'mean': float(mean), 'cv': float(w.std() / mean) if mean else None,
+        'max_to_min': float(w.max() / w.min()) if w.min() > 0 else None,
+        'negative': int((w < 0).sum()), 'deff_weighting': deff,
+        'effective_n': float(w.sum() ** 2 / np.sum(w ** 2)) if len(w) else 0.0
+    }
+    pairs = {'ratio_to_base': base, 'reference': reference}
+    for name, other in pairs.items():
+        if other is None:
+            continue
+        joined = pd.concat([pd.Series(weights), pd.Series(other)], axis=1).dropna().to_numpy(dtype=float)
+        if name == 'ratio_to_base':
+            ratio = joined[:, 0] / joined[:, 1]
+            summary[name] = {q: float(np.quantile(ratio, p)) for q, p in
+                             [('min', 0), ('p01', .01), ('p50', .5), ('p99', .99), ('max', 1)]}
+        else:
+            summary['correlation_with_reference'] = float(np.corrcoef(joined[:, 0], joined[:, 1])[0, 1])
+    return summary
+
+@profiled
+def calibrate(df, targets=None, base_col='weight', method='raking', bounds=default_bounds, trim=None,
+              population_total=None, max_iter=100, tol=default_tol):
+    """
+    calibrate base weights to margin targets ({margin: {cell: share or total}}; shares within a margin are
+    rescaled to the population total). methods: 'raking' (ipf, optional trim=(low, high) multiples of the
+    mean weight, held during raking), 'linear' (greg) and 'logit' (w / base kept inside bounds).
+    returns the calibrated weights (nan where the base weight is missing) and a diagnostics dict
+    """
+    start = time.perf_counter()
+    targets = targets or margins_from_weights(df)
+    if method not in ('raking', 'linear', 'logit'):
+        raise ValueError(f"Unknown calibration method '{method}', expected raking, linear or logit")
+    base_all = df[base_col].to_numpy(dtype=float) if base_col in df.columns else np.ones(len(df))
+    eligible = ~np.isnan(base_all) & (base_all > 0)
+    frame, base = df[eligible], base_all[eligible]
+    setup = _setup(frame, targets, base, population_total)
+
+    if method == 'raking':
+        weights, iterations, converged, history = _rake(setup, base, max_iter, tol, trim)
+    else:
+        weights, iterations, converged, history = _newton(setup, base, method, bounds, max_iter, tol)
+
+    calibrated = np.full(len(df), np.nan)
+    calibrated[eligible] = weights
+    calibrated = pd.Series(calibrated, index=df.index, name='weight')
+    diagnostics = {
+        'method': method, 'converged': bool(converged), 'iterations': iterations,
+        'max_margin_error': history[-1], 'error_history': history, 'seconds': time.perf_counter() - start,
+        'margins': {margin: labels for margin, _, _, labels in setup},
+        'weights': weight_diagnostics(calibrated, base=df[base_col] if base_col in df.columns else None)
+    }
+    if method == 'raking' and trim:
+        diagnostics['trim'] = list(trim)
+        diagnostics['infeasible_cells'] = infeasible_cells(setup, len(base), trim_limits(setup[0][2].sum(), len(base), trim))
+    if method == 'logit':
+        diagnostics['bounds'] = list(bounds)
+    return calibrated, diagnostics
+
+def compare_margins(df, targets, weights):
+    # long table of every margin cell: target share and the share each named weight achieves
+    rows = []
+    for margin, cells in targets.items():
+        codes, labels = margin_codes(df, margin)
+        wanted = pd.Series(cells, dtype=float).reindex(labels, fill_value=0.0)
+        row = pd.DataFrame({'margin': margin, 'cell': labels, 'target': (wanted / wanted.sum()).to_numpy()})
+        for name, w in weights.items():
+            w = pd.Series(w, index=df.index).to_numpy(dtype=float)
+            keep = ~np.isnan(w) & (codes >= 0)
+            totals = np.bincount(codes[keep], weights=w[keep], minlength=len(labels))
+            row[name] = totals / totals.sum()
+        rows.append(row)
+    return pd.concat(rows, ignore_index=True)
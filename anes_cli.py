@@ -0,0 +1,495 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# only stdlib at module level; each subcommand imports what it needs
+
+heavy_modules = ['pandas', 'numpy', 'matplotlib', 'seaborn', 'scipy', 'samplics']
+
+where_help = "respondent filter, e.g. 'gay_id in (2, 3, 4) and int_mode == 2'"
+
+# subcommands whose options go straight to the module's own main(argv): name, module, help
+passthrough_commands = [
+    ('benchmark', 'anes_benchmarks', 'time the hot functions on synthetic data'),
+    ('equivalence', 'anes_equivalence', 'fast paths against their reference outputs and golden files, with speedups'),
+    ('synthesize', 'anes_synthetic', 'write a synthetic ANES-like file'),
+    ('sensitivity', 'anes_sensitivity', 'estimates under every weights_dict design'),
+    ('correlations', 'anes_correlations', 'weighted pearson/spearman/polychoric matrix with jackknife ses'),
+    ('scales', 'anes_scales', 'attitude scales with factor analysis, alpha/omega and bootstrap cis'),
+    ('segments', 'anes_segments', 'weighted latent class and k-modes respondent segments'),
+    ('design-effects', 'anes_design_effects', 'design effects and effective n per estimate and domain'),
+    ('ordinal', 'anes_ordinal', 'survey-weighted proportional-odds models for the ordered items'),
+]
+
+# seconds from process start to exit for the commands our cron wrappers call
+startup_budget = {
+    '--help': 0.25,
+    'summary --help': 0.25,
+    'summary': 0.25
+}
+
+# smallest descriptives json 'summary' can print, timed when no real one exists yet (fresh checkout)
+summary_fixture = {
+    'metadata': {'analysis_date': '-', 'total_respondents': 1, 'total_variables': 0},
+    'summary_statistics': {
+        'data_quality': {'complete_cases': 1, 'partially_complete_cases': 0, 'completely_missing_cases': 0},
+        'question_group_summary': {},
+        'weights_info': {'has_weights': False}
+    }
+}
+
+def _record_run(args, df, estimates=None, descriptives=None, files=(), domain=''):
+    # every estimate of the run into the results store (--no-store skips it)
+    if args.no_store:
+        return None
+    from anes_results import ResultsStore, design_spec
+    params = {key: value for key, value in vars(args).items() if key not in ('func', 'store', 'no_store')}
+    with ResultsStore(args.store) as store:
+        run_id = store.start_run(args.command, getattr(args, 'csv', None), params, rows=len(df))
+        design = design_spec(df.columns)
+        count = store.add_results(run_id, estimates, domain, design) if estimates else 0
+        count += store.add_descriptives(run_id, descriptives, domain, design) if descriptives else 0
+        store.add_artifacts(run_id, files)
+    print(f"Run {run_id}: {count} estimates recorded in {args.store}")
+    return run_id
+
+def cmd_ingest(args):
+    from data.formatanes import anes_lgbt_fixed
+    anes_lgbt_fixed(input_file=args.input, output_file=args.output, backend=args.backend)
+
+def cmd_describe(args):
+    from data.dicts import var_dict, theme_dict
+    from anes_statistics import load_and_prepare_data, basic_descriptive_stats
+    from anes_descriptives import generate_descriptive_json, print_summary_report
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    trans_cols, gay_cols, demo_cols = basic_descriptive_stats(df, theme_dict)
+    descriptive_stats = generate_descriptive_json(df, trans_cols=trans_cols, gay_cols=gay_cols, output_file=args.json,
+                                                  selection=args.where)
+    print_summary_report(descriptive_stats)
+    _record_run(args, df, descriptives=descriptive_stats, files=[args.json], domain=args.where or '')
+
+def cmd_summary(args):
+    from anes_summary import format_results_summary, print_summary_report
+    with open(args.json) as f:
+        descriptive_stats = json.load(f)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(format_results_summary(descriptive_stats))
+    else:
+        print_summary_report(descriptive_stats)
+
+def cmd_estimate(args):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data, samplics_analysis
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    # a where-expression is a domain: the ses still use every psu
+    results = samplics_analysis(df, domain=args.where)
+    with open(args.json, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Estimates for {len(results)} variables saved to {args.json}")
+    _record_run(args, df, estimates=results, files=[args.json], domain=args.where or '')
+
+def cmd_impute(args):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    from anes_imputation import impute_chained, estimate_imputed
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    targets = args.targets.split(',') if args.targets else None
+    imputations = impute_chained(df, targets=targets, m=args.m, iterations=args.iterations, seed=args.seed)
+    results = estimate_imputed(df, imputations, processes=args.processes)
+    with open(args.json, 'w') as f:
+        json.dump({'m': imputations['m'], 'iterations': imputations['iterations'],
+                   'predictors': imputations['predictors'],
+                   'imputed_rows': {col: len(rows) for col, rows in imputations['positions'].items()},
+                   'unweighted_rows_not_imputed': imputations['unweighted_rows'],
+                   'estimates': results}, f, indent=2, default=str)
+    print(f"Pooled estimates for {len(results)} variables over {imputations['m']} imputations saved to {args.json}")
+    print(f"Only item nonresponse among weighted respondents was imputed; {imputations['unweighted_rows']:,} "
+          f"respondents without a post weight (no post interview) are unit nonresponse the weights already cover")
+
+def cmd_calibrate(args):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    from data.weights import margin_sets
+    from anes_calibration import calibrate, margins_from_weights, compare_margins, weight_diagnostics
+    if not args.margins and args.base == 'weight':
+        # the official weights already hit their own margins, so that run would be a silent no-op
+        print("Calibrating the official weights needs external targets: pass --margins, or use "
+              "--base none to rake equal weights to the official weights' margins")
+        return 2
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    if args.margins:
+        with open(args.margins) as f:
+            targets = json.load(f)
+    else:
+        # no external margins: carry the official weights' margins over to the base weights
+        targets = margins_from_weights(df, margin_sets[args.margin_set])
+    if args.base == 'none':
+        # equal weights for the respondents the official weights cover
+        df['_base'] = df['weight'].notna().astype(float).where(df['weight'].notna())
+    base_col = '_base' if args.base == 'none' else args.base
+    bounds = tuple(float(v) for v in args.bounds.split(','))
+    trim = tuple(float(v) for v in args.trim.split(',')) if args.trim else None
+    weights, diagnostics = calibrate(df, targets, base_col=base_col, method=args.method, bounds=bounds, trim=trim)
+    diagnostics['weights'] = weight_diagnostics(weights, base=df[base_col], reference=df['weight'])
+    diagnostics['official_weights'] = weight_diagnostics(df['weight'])
+    comparison = compare_margins(df, targets, {'official': df['weight'], 'calibrated': weights})
+    diagnostics['margin_comparison'] = comparison.to_dict(orient='records')
+    with open(args.json, 'w') as f:
+        json.dump(diagnostics, f, indent=2, default=str)
+    if args.output:
+        frame = df[['case_id']].assign(weight=weights) if 'case_id' in df.columns else weights.to_frame()
+        frame.to_csv(args.output, index=False)
+    status = 'converged' if diagnostics['converged'] else 'did NOT converge'
+    print(f"{args.method} calibration {status} after {diagnostics['iterations']} iterations "
+          f"(max margin error {diagnostics['max_margin_error']:.2e}), diagnostics saved to {args.json}")
+    if diagnostics.get('infeasible_cells'):
+        cells = diagnostics['infeasible_cells']
+        print(f"  {len(cells)} cell(s) cannot reach their target with every weight inside --trim {args.trim}: "
+              f"{', '.join(cells[:10])}{' ...' if len(cells) > 10 else ''}")
+    elif not diagnostics['converged'] and diagnostics.get('trim'):
+        print(f"  the margins clash inside --trim {args.trim}; widen the limits or use fewer margins")
+    return 0 if diagnostics['converged'] else 1
+
+def cmd_compare(args):
+    if args.col1 or args.col2:
+        from data.dicts import var_dict
+        from anes_statistics import load_and_prepare_data
+        from anes_visualizations import create_comparison_plot
+        df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+        saved = create_comparison_plot(df, args.col1, args.col2, title=args.title, filename=args.output,
+                                       exports=args.exports, kde=args.kde, selection=args.where)
+        print(f"Saved: {', '.join(saved)}")
+    else:
+        from sports_crosssect import main as sports_main
+        sports_main(args.csv)
+
+def cmd_plot(args):
+    from data.dicts import var_dict, theme_dict
+    from anes_statistics import load_and_prepare_data, basic_descriptive_stats
+    from anes_visualizations import order_visualizations, create_faceted_distribution_plot
+    from anes_bitmaps import BitmapIndex
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    trans_cols, gay_cols, demo_cols = basic_descriptive_stats(df, theme_dict)
+    # parsed once, every figure reuses the same selection
+    selection = BitmapIndex(df, columns=[]).select(args.where) if args.where else None
+    if args.facet:
+        create_faceted_distribution_plot(df, trans_cols, args.facet, 'Transgender Questions',
+                                         f'transgender_questions_by_{args.facet}.png', exports=args.exports,
+                                         selection=selection)
+        create_faceted_distribution_plot(df, gay_cols, args.facet, 'Gay/LGB Questions',
+                                         f'gay_lgb_questions_by_{args.facet}.png', exports=args.exports,
+                                         selection=selection)
+    else:
+        order_visualizations(df, trans_cols, gay_cols, exports=args.exports, kde=args.kde, selection=selection)
+
+def cmd_tables(args):
+    from data.dicts import var_dict, theme_dict
+    from anes_statistics import load_and_prepare_data, basic_descriptive_stats
+    from anes_labels import export_frequency_tables
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    trans_cols, gay_cols, demo_cols = basic_descriptive_stats(df, theme_dict)
+    saved = export_frequency_tables(df, trans_cols + gay_cols + demo_cols, args.output, args.formats.split(','))
+    print(f"Saved: {', '.join(saved)}")
+
+def cmd_report(args):
+    from anes_pipeline import run_pipeline
+    from anes_report import generate_html_report
+    from anes_summary import format_results_summary
+    results = run_pipeline({
+        "csv_file_path": args.csv,
+        "json_file": args.json,
+        "exports": args.exports
+    }, use_cache=not args.no_cache)
+    with open(args.summary, 'w') as f:
+        f.write(format_results_summary(results["descriptive_stats"]))
+    generate_html_report(results["df"], results["descriptive_stats"], results["samplics_results"],
+                         results["trans_cols"], results["gay_cols"], output_file=args.html)
+    print(f"Stages: {results['stage_status']}")
+    print(f"Report saved to {args.html}")
+    _record_run(args, results["df"], estimates=results["samplics_results"], descriptives=results["descriptive_stats"],
+                files=[args.json, args.summary, args.html] + results.get("figure_files", []))
+
+def cmd_startup(args):
+    # time each budgeted command in a fresh interpreter, best of n to skip cold-cache noise
+    import shutil
+    import tempfile
+    failed = False
+    workdir = tempfile.mkdtemp(prefix='anes_startup_')
+    summary_json = args.json
+    if not os.path.exists(summary_json):
+        summary_json = os.path.join(workdir, 'descriptives.json')
+        with open(summary_json, 'w') as f:
+            json.dump(summary_fixture, f)
+        print(f"  (no {args.json} yet, timing summary on a minimal fixture)")
+    for command, budget in startup_budget.items():
+        argv = [sys.executable, os.path.abspath(__file__)] + command.split()
+        if command == 'summary':
+            argv += ['--json', summary_json]
+        timings, returncode = [], 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            returncode = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode or returncode
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        status = 'FAILED' if returncode else ('ok' if best <= budget else 'OVER BUDGET')
+        failed = failed or returncode or best > budget
+        print(f"  {command:<16} {best * 1000:7.1f} ms (budget {budget * 1000:.0f} ms) {status}")
+
+    probe = ("import sys, anes_cli; anes_cli.build_parser(); "
+             "print(','.join(m for m in anes_cli.heavy_modules if m in sys.modules))")
+    loaded = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    if loaded:
+        print(f"  heavy modules imported at startup: {loaded}")
+        failed = True
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+def cmd_profile_compare(args):
+    from anes_profiling import compare_runs
+    comparison = compare_runs(args.log, args.run_a, args.run_b)
+    print(f"{comparison['run_a']} -> {comparison['run_b']}")
+    for name, entry in comparison['stages'].items():
+        wall_a = '-' if entry['wall_s_a'] is None else f"{entry['wall_s_a']:.3f}s"
+        wall_b = '-' if entry['wall_s_b'] is None else f"{entry['wall_s_b']:.3f}s"
+        ratio = '' if entry['ratio'] is None else f"x{entry['ratio']:.2f}"
+        print(f"  {name:<60} {wall_a:>10} {wall_b:>10} {ratio}")
+
+def cmd_results(args):
+    from anes_results import ResultsStore
+    if not os.path.exists(args.store):
+        print(f"No results store at {args.store}")
+        return 1
+    with ResultsStore(args.store) as store:
+        if args.action == 'runs':
+            for run in store.runs(limit=args.limit):
+                print(f"{run['run_id']:<26} {run['started'][:19]}  {run['command'] or '-':<10} {run['code_version'] or '-':<16} "
+                      f"{(run['input_fingerprint'] or '-')[:12]:<12} {run['estimates']:>6} estimates")
+        elif args.action == 'show':
+            latest = store.runs(limit=1)
+            if not args.run_a and not latest:
+                print(f"No runs in {args.store}")
+                return 1
+            rows = store.estimates(args.run_a or latest[0]['run_id'], args.var, args.domain, args.source)
+            for row in rows:
+                se = '' if row['se'] is None else f" ({row['se']:.4f})"
+                domain = f"  [{row['domain']}]" if row['domain'] else ''
+                print(f"{row['source']:<13}{row['variable']:<22}{row['category']:<6}{row['statistic']:<15}"
+                      f"{row['estimate']:>10.4f}{se}  n={row['n']}{domain}")
+        elif args.action == 'trend':
+            if not args.var:
+                print("trend needs --var")
+                return 1
+            for row in store.trend(args.var, args.category, args.domain or '', args.source or 'samplics'):
+                se = '' if row['se'] is None else f" ({row['se']:.4f})"
+                print(f"{row['started'][:19]}  {row['run_id']:<26} {row['code_version'] or '-':<16} {row['category']:<6}"
+                      f"{row['estimate']:>10.4f}{se}")
+        else:
+            try:
+                diff = store.diff_runs(args.run_a, args.run_b, source=args.source, tolerance=args.tolerance)
+            except ValueError as e:
+                print(e)
+                return 1
+            counts = {}
+            for row in diff['rows']:
+                counts[row['status']] = counts.get(row['status'], 0) + 1
+            print(f"{diff['run_a']} -> {diff['run_b']}: " + ', '.join(f"{n} {status}" for status, n in counts.items()))
+            for row in [r for r in diff['rows'] if r['status'] != 'same'][:args.limit]:
+                values = (f"{row['estimate_a']:.4f} -> {row['estimate_b']:.4f}" if row['difference'] is not None
+                          else f"{row['estimate_a'] if row['estimate_b'] is None else row['estimate_b']:.4f}")
+                z = '' if row['z'] is None else f"  z={row['z']:.2f}"
+                print(f"  {row['status']:<8}{row['source']:<13}{row['variable']:<22}{row['category']:<6}{values}{z}")
+            if args.json:
+                with open(args.json, 'w') as f:
+                    json.dump(diff, f, indent=2)
+            # an estimate that disappears or appears is as much a regression as one that moves
+            failing = ['changed', 'removed'] + ([] if args.allow_added else ['added'])
+            return 1 if args.fail_on_change and any(counts.get(status) for status in failing) else 0
+    return 0
+
+def cmd_passthrough(args):
+    # subcommands that hand their options (and -h) to a module's own main(argv)
+    from importlib import import_module
+    return import_module(args.passthrough).main(args.extra)
+
+def cmd_backend_check(args):
+    from anes_backend import available_backends, check_parity
+    print(f"Available backends: {', '.join(available_backends())}")
+    problems = check_parity(args.csv)
+    if not problems:
+        print("Only pandas is installed, nothing to compare")
+    for backend, found in problems.items():
+        print(f"  {backend}: {'matches pandas' if not found else f'{len(found)} difference(s)'}")
+        for line in found[:20]:
+            print(f"    {line}")
+    return 1 if any(problems.values()) else 0
+
+def cmd_serve(args):
+    from anes_server import serve
+    return serve(args.csv, args.host, args.port, args.cache_size, args.quiet)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='anes', description='ANES 2024 LGBTQ+ analysis')
+    parser.add_argument('--profile', action='store_true',
+                        help='append per-stage timing and memory records to a json lines run log')
+    parser.add_argument('--run-log', default='anes_run_log.jsonl')
+    parser.add_argument('--store', default='anes_results.db', help='sqlite results store every describe/estimate/report run is recorded in')
+    parser.add_argument('--no-store', action='store_true', help='do not record this run in the results store')
+    parser.add_argument('--memory-budget', default=None,
+                        help="e.g. 2G: stages over it switch to chunked variants (default: ANES_MEMORY_BUDGET or none)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('ingest', help='reduce the raw ANES file to the LGBTQ+ columns and assign weights')
+    p.add_argument('--input', default='anes_2024.csv')
+    p.add_argument('--output', default='lgbt_anes.csv')
+    p.add_argument('--backend', default=None, help='polars or pandas (default: polars when installed)')
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('describe', help='descriptive statistics json and summary report')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--json', default='anes_descriptive_stats.json')
+    p.add_argument('--where', default=None, help=where_help)
+    p.set_defaults(func=cmd_describe)
+
+    p = sub.add_parser('summary', help='print or write the summary of an existing descriptives json')
+    p.add_argument('--json', default='anes_descriptive_stats.json')
+    p.add_argument('--output', default=None)
+    p.set_defaults(func=cmd_summary)
+
+    p = sub.add_parser('estimate', help='design-based estimates with samplics')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--json', default='anes_estimates.json')
+    p.add_argument('--where', default=None, help=f'{where_help}; estimated as a domain')
+    p.set_defaults(func=cmd_estimate)
+
+    p = sub.add_parser('impute', help='multiple imputation of post-wave item nonresponse, estimates pooled with rubin\'s rules')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--json', default='anes_imputed_estimates.json')
+    p.add_argument('--targets', default=None, help='comma separated columns to impute (default: post-wave items with nonresponse)')
+    p.add_argument('-m', type=int, default=5, help='number of imputations')
+    p.add_argument('--iterations', type=int, default=5)
+    p.add_argument('--processes', type=int, default=None)
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=cmd_impute)
+
+    p = sub.add_parser('calibrate', help='rake or calibrate weights to demographic margins and compare with the official weights')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--margins', default=None, help='json {margin: {cell: share}} (default: margins of the official weights)')
+    p.add_argument('--margin-set', default='oneway', choices=['oneway', 'joint'],
+                   help="without --margins: one-way age, race and edu margins, or their age*race*edu crossing")
+    p.add_argument('--base', default='none',
+                   help="base weight column (needs --margins for the official 'weight'), or 'none' for equal base weights")
+    p.add_argument('--method', default='raking', choices=['raking', 'linear', 'logit'])
+    p.add_argument('--bounds', default='0.3,3', help='low,high limits of calibrated/base weight for logit')
+    p.add_argument('--trim', default=None, help='low,high limits as multiples of the mean weight for raking')
+    p.add_argument('--json', default='anes_calibration.json')
+    p.add_argument('--output', default=None, help='csv of case_id and the calibrated weight')
+    p.set_defaults(func=cmd_calibrate)
+
+    p = sub.add_parser('compare', help='pre/post sports comparison, or a side by side plot of two columns')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--col1', default=None)
+    p.add_argument('--col2', default=None)
+    p.add_argument('--title', default='Comparison Plot')
+    p.add_argument('--output', default='comparison.png')
+    p.add_argument('--exports', default=None)
+    p.add_argument('--kde', action='store_true')
+    p.add_argument('--where', default=None, help=where_help)
+    p.set_defaults(func=cmd_compare)
+
+    p = sub.add_parser('plot', help='distribution figures')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--exports', default=None, help="comma separated, e.g. 'preview,svg' or 'png@150'")
+    p.add_argument('--facet', default=None, help='facet column, e.g. resp_partyid')
+    p.add_argument('--kde', action='store_true')
+    p.add_argument('--where', default=None, help=where_help)
+    p.set_defaults(func=cmd_plot)
+
+    p = sub.add_parser('tables', help='labelled weighted frequency tables for every item as csv, markdown and xlsx')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--output', default='anes_frequencies', help='file name without extension')
+    p.add_argument('--formats', default='csv,md,xlsx')
+    p.set_defaults(func=cmd_tables)
+
+    p = sub.add_parser('report', help='full cached pipeline plus summary text and html report')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--json', default='anes_descriptive_stats.json')
+    p.add_argument('--summary', default='analysis_summary.txt')
+    p.add_argument('--html', default='anes_report.html')
+    p.add_argument('--exports', default=None)
+    p.add_argument('--no-cache', action='store_true')
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser('profile-compare', help='compare two runs in a profiling run log')
+    p.add_argument('--log', default='anes_run_log.jsonl')
+    p.add_argument('--run-a', default=None)
+    p.add_argument('--run-b', default=None)
+    p.set_defaults(func=cmd_profile_compare)
+
+    p = sub.add_parser('results', help='list, show, diff or trend runs recorded in the results store')
+    p.add_argument('action', nargs='?', default='runs', choices=['runs', 'show', 'diff', 'trend'])
+    p.add_argument('--run-a', default=None, help='diff: older run (default: second newest); show: the run (default: newest)')
+    p.add_argument('--run-b', default=None, help='diff: newer run (default: newest)')
+    p.add_argument('--var', default=None)
+    p.add_argument('--category', default=None)
+    p.add_argument('--domain', default=None)
+    p.add_argument('--source', default=None, help='samplics or descriptives')
+    p.add_argument('--tolerance', type=float, default=1e-9, help='diff: smallest change reported as changed')
+    p.add_argument('--limit', type=int, default=25)
+    p.add_argument('--json', default=None, help='diff: write the full diff here')
+    p.add_argument('--fail-on-change', action='store_true',
+                   help='diff: exit 1 when any estimate changed, was removed or was added')
+    p.add_argument('--allow-added', action='store_true', help='diff: with --fail-on-change, new estimates pass')
+    p.set_defaults(func=cmd_results)
+
+    # passthrough subcommands: everything after the name, -h included, goes to the module's parser
+    for name, module, help_text in passthrough_commands:
+        p = sub.add_parser(name, help=f'{help_text} (options go to {module}.py)', add_help=False)
+        p.set_defaults(func=cmd_passthrough, passthrough=module)
+
+    p = sub.add_parser('serve', help='local http/json service for weighted frequencies, estimates and crosstabs')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--cache-size', type=int, default=512)
+    p.add_argument('--quiet', action='store_true')
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser('backend-check', help='check that every installed dataframe backend matches pandas')
+    p.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    p.set_defaults(func=cmd_backend_check)
+
+    p = sub.add_parser('startup', help='check startup time of the quick commands against their budget')
+    p.add_argument('--json', default='anes_descriptive_stats.json')
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=cmd_startup)
+
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == 'compare' and bool(args.col1) != bool(args.col2):
+        parser.error("compare: --col1 and --col2 go together (or leave both out for the sports comparison)")
+    if hasattr(args, 'passthrough'):
+        args.extra = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if args.memory_budget:
+        from anes_memory import set_memory_budget
+        set_memory_budget(args.memory_budget)
+    if args.profile:
+        from anes_profiling import start_run_log, stop_run_log
+        start_run_log(args.run_log, command=args.command, memory_budget=args.memory_budget)
+        try:
+            return args.func(args) or 0
+        finally:
+            stop_run_log()
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from data.schema import kind_of, valid_mask, theme_columns
+from anes_backend import mp_context
+from anes_profiling import profiled
+
+# every pair is reduced to weighted contingency tables, one per psu. pearson, spearman (mid-ranks of the
+# weighted margins), polychoric and polyserial are all functions of the summed table, and a delete-one-psu
+# jackknife replicate is the same sum with one psu dropped and its stratum reweighted, so replicate
+# estimates cost a matrix product instead of another pass over respondents
+
+methods = ['pearson', 'spearman', 'polychoric']
+min_pair_n = 30
+max_abs_rho = 0.995
+min_cell_p = 1e-12
+gauss_nodes = 20
+
+def default_items(df):
+    # transgender and gay items that have an order (nominal gay_id has no correlation to give)
+    # in file order, theme_dict holds sets. combined items that repeat an earlier one (trans_sports_prepost)
+    # go, split-ballot items stay since every pair is pairwise complete
+    from anes_scales import usable_items
+    return usable_items(df, [col for col in theme_columns(df.columns, 'trans_qs') + theme_columns(df.columns, 'gay_qs')
+                             if kind_of(col) in ('binary', 'ordinal', 'thermometer', 'continuous')], min_share=0)
+
+def _is_ordinal(col):
+    return kind_of(col) in ('binary', 'ordinal')
+
+def _jackknife_design(stratum, psu):
+    # psu index per row and, for every replicate (one per psu in a stratum with 2+ psus), the psu it drops,
+    # the weight factor n_h / (n_h - 1) for the rest of its stratum and its variance factor (n_h - 1) / n_h
+    pairs = pd.DataFrame({'stratum': stratum, 'psu': psu})
+    index = pairs.groupby(['stratum', 'psu'], sort=True).ngroup().to_numpy()
+    groups = pairs.drop_duplicates().sort_values(['stratum', 'psu']).reset_index(drop=True)
+    group_stratum = groups.groupby('stratum', sort=True).ngroup().to_numpy()
+    n_h = np.bincount(group_stratum)[group_stratum]
+    dropped = np.flatnonzero(n_h > 1)  # single-psu strata add no variance
+    return {'psu_index': index, 'group_stratum': group_stratum, 'dropped': dropped,
+            'scale': n_h[dropped] / (n_h[dropped] - 1), 'factors': (n_h[dropped] - 1) / n_h[dropped]}
+
+def _replicate_tables(tables, design):
+    # delete-one-psu tables from the psu tables: total - stratum + scale * (stratum - dropped psu)
+    strata = np.zeros((design['group_stratum'].max() + 1,) + tables.shape[1:])
+    np.add.at(strata, design['group_stratum'], tables)
+    own = strata[design['group_stratum'][design['dropped']]]
+    scale = design['scale'][:, None, None]
+    return tables.sum(axis=0)[None] - own + scale * (own - tables[design['dropped']])
+
+def _bvn_cdf(h, k, rho):
+    # bivariate standard normal cdf, rho broadcast against h and k:
+    # phi(h)phi(k) + 1/(2 pi) * integral_0^asin(rho) exp(-(h^2 + k^2 - 2hk sin t) / (2 cos^2 t)) dt
+    from scipy.special import ndtr
+    nodes, node_weights = np.polynomial.legendre.leggauss(gauss_nodes)
+    top = np.arcsin(np.broadcast_to(rho, h.shape))[..., None]
+    theta = (nodes + 1) * top / 2
+    sin, cos2 = np.sin(theta), np.cos(theta) ** 2
+    hh, kk = h[..., None], k[..., None]
+    integrand = np.exp(-(hh * hh + kk * kk - 2 * hh * kk * sin) / (2 * cos2))
+    return ndtr(h) * ndtr(k) + top[..., 0] / 2 * (integrand @ node_weights) / (2 * np.pi)
+
+def _bvn_pdf(h, k, rho):
+    r2 = 1 - rho ** 2
+    return np.exp(-(h * h - 2 * rho * h * k + k * k) / (2 * r2)) / (2 * np.pi * np.sqrt(r2))
+
+def _thresholds(margins):
+    # (tables x categories) weighted margins -> normal thresholds with +-8 standing in for infinity;
+    # an empty category gets a zero-width interval, the same as dropping it
+    from scipy.special import ndtri
+    cum = np.cumsum(margins, axis=-1)[..., :-1] / margins.sum(axis=-1, keepdims=True)
+    inner = ndtri(np.clip(cum, 1e-12, 1 - 1e-12))
+    edge = np.full(inner.shape[:-1] + (1,), 8.0)
+    return np.concatenate([-edge, inner, edge], axis=-1)
+
+def _moments(tables, va, vb):
+    # weighted covariance and sds for a stack of tables; va/vb are shared scores or one row per table
+    p = tables / tables.sum(axis=(1, 2), keepdims=True)
+    pa, pb = p.sum(axis=2), p.sum(axis=1)
+    da = va - np.sum(pa * va, axis=-1, keepdims=True)
+    db = vb - np.sum(pb * vb, axis=-1, keepdims=True)
+    cov = np.einsum('ra,rab,rb->r', np.broadcast_to(da, pa.shape), p, np.broadcast_to(db, pb.shape))
+    return cov, np.sqrt(np.sum(pa * da ** 2, axis=-1)), np.sqrt(np.sum(pb * db ** 2, axis=-1))
+
+def pearson_table(tables, va, vb):
+    cov, sa, sb = _moments(tables, va, vb)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where((sa > 0) & (sb > 0), cov / (sa * sb), np.nan)
+
+def spearman_table(tables, va, vb):
+    # pearson of the weighted mid-ranks, ties share the midpoint of their weight
+    pa, pb = tables.sum(axis=2), tables.sum(axis=1)
+    return pearson_table(tables, np.cumsum(pa, axis=-1) - pa / 2, np.cumsum(pb, axis=-1) - pb / 2)
+
+def polychoric_table(tables, start=None, max_iter=50, tol=1e-8, max_halvings=30):
+    # two-step: thresholds from each table's weighted margins, then fisher scoring on rho for the weighted
+    # multinomial likelihood, all tables at once (dP/drho at a cell corner is the bivariate normal density).
+    # a step that lowers a table's log-likelihood is halved until it doesn't, so strongly correlated items
+    # can't swing to the bound, and tables still moving after max_iter get nan rather than the last iterate
+    h, k = _thresholds(tables.sum(axis=2))[:, :, None], _thresholds(tables.sum(axis=1))[:, None, :]
+    h, k = np.broadcast_arrays(h, k)
+    total = tables.sum(axis=(1, 2))
+    rho = np.zeros(len(tables)) if start is None else np.broadcast_to(start, len(tables)).astype(float)
+    rho = np.nan_to_num(np.clip(rho, -max_abs_rho, max_abs_rho))
+
+    def corners(values):
+        return values[:, 1:, 1:] - values[:, :-1, 1:] - values[:, 1:, :-1] + values[:, :-1, :-1]
+
+    def probabilities(rho):
+        # quadrature error leaves far-corner cells near zero or negative at high rho; a floor far above
+        # 1e-300 keeps slope ** 2 / p in the information from swamping the step
+        return np.maximum(corners(_bvn_cdf(h, k, rho[:, None, None])), min_cell_p)
+
+    def loglik(probs):
+        return np.sum(tables * np.log(probs), axis=(1, 2))
+
+    probs = probabilities(rho)
+    ll = loglik(probs)
+    converged = np.zeros(len(tables), dtype=bool)
+    for _ in range(max_iter):
+        slope = corners(_bvn_pdf(h, k, rho[:, None, None]))
+        score = np.sum(tables / probs * slope, axis=(1, 2))
+        info = total * np.sum(slope ** 2 / probs, axis=(1, 2))
+        step = np.divide(score, info, out=np.zeros_like(score), where=info > 0)
+        step = np.where(converged, 0.0, np.clip(rho + step, -max_abs_rho, max_abs_rho) - rho)
+        for _ in range(max_halvings):
+            new_rho = rho + step
+            new_probs = probabilities(new_rho)
+            new_ll = loglik(new_probs)
+            worse = new_ll < ll - 1e-12 * np.abs(ll)
+            if not worse.any():
+                break
+            step = np.where(worse, step / 2, step)
+        # a table no halving could improve keeps its iterate and stops
+        step = np.where(worse, 0.0, step)
+        rho, probs, ll = np.where(worse, rho, new_rho), np.where(worse[:, None, None], probs, new_probs), np.where(worse, ll, new_ll)
+        converged |= np.abs(step) < tol
+        if converged.all():
+            break
+    ordered = (np.count_nonzero(tables.sum(axis=2), axis=1) > 1) & (np.count_nonzero(tables.sum(axis=1), axis=1) > 1)
+    return np.where(ordered & converged, rho, np.nan)
+
+def polyserial_table(tables, continuous, ordinal):
+    # ad hoc two-step estimator (olsson, drasgow & dorans 1982), continuous item on the rows:
+    # rho = r_xy * sd(y) / sum_j phi(tau_j) (y_{j+1} - y_j)
+    cov, sx, sy = _moments(tables, continuous, ordinal)
+    tau = _thresholds(tables.sum(axis=1))[:, 1:-1]
+    denom = np.sum(np.exp(-tau ** 2 / 2) / np.sqrt(2 * np.pi) * np.diff(ordinal), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = np.where((sx > 0) & (sy > 0) & (denom > 0), cov / sx / denom, np.nan)
+    return np.clip(rho, -1, 1)
+
+def _pair_estimates(tables, va, vb, kind_a, kind_b, start=None):
+    # every method for a stack of tables (full sample or jackknife replicates) -> {method: array}
+    estimates = {'pearson': pearson_table(tables, va, vb), 'spearman': spearman_table(tables, va, vb)}
+    if kind_a == 'ordinal' and kind_b == 'ordinal':
+        estimates['polychoric'] = polychoric_table(tables, start=estimates['pearson'] if start is None else start)
+    elif kind_a == 'continuous' and kind_b == 'ordinal':
+        estimates['polychoric'] = polyserial_table(tables, va, vb)
+    elif kind_a == 'ordinal' and kind_b == 'continuous':
+        estimates['polychoric'] = polyserial_table(tables.transpose(0, 2, 1), vb, va)
+    else:
+        estimates['polychoric'] = estimates['pearson']
+    return estimates
+
+_worker_state = {}
+
+def _init_worker(state):
+    _worker_state.update(state)
+
+def _pair_batch(pairs):
+    # estimates and jackknife ses for a batch of (i, j) pairs
+    state = _worker_state
+    out = []
+    for i, j in pairs:
+        codes_a, codes_b = state['codes'][i], state['codes'][j]
+        ok = (codes_a >= 0) & (codes_b >= 0) & state['usable']
+        n = int(ok.sum())
+        if n < min_pair_n:
+            out.append((i, j, n, None, None))
+            continue
+        va, vb = state['levels'][i], state['levels'][j]
+        design = state['design']
+        a, b, groups = len(va), len(vb), state['n_groups']
+        cells = (state['psu_index'][ok] * a + codes_a[ok]) * b + codes_b[ok]
+        tables = np.bincount(cells, weights=state['weights'][ok], minlength=groups * a * b).reshape(groups, a, b)
+        kinds = state['kinds'][i], state['kinds'][j]
+        estimate = {method: float(value[0]) for method, value in
+                    _pair_estimates(tables.sum(axis=0)[None], va, vb, *kinds).items()}
+        se = None
+        if design is not None and len(design['dropped']):
+            # polychoric starts every replicate from the full-sample rho
+            reps = _pair_estimates(_replicate_tables(tables, design), va, vb, *kinds, start=estimate['polychoric'])
+            se = {method: float(np.sqrt(np.nansum(design['factors'] * (reps[method] - estimate[method]) ** 2)))
+                  for method in methods}
+        out.append((i, j, n, estimate, se))
+    return out
+
+def _prepare(df, columns, replicates):
+    weights = df['weight'].to_numpy(dtype=float) if 'weight' in df.columns else np.ones(len(df))
+    usable = ~np.isnan(weights)
+    state = {'codes': [], 'levels': [], 'kinds': []}
+    for col in columns:
+        values = df[col].where(valid_mask(df[col], col)).to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        levels, codes = np.unique(values[present], return_inverse=True)
+        full = np.full(len(df), -1, dtype=np.intp)
+        full[present] = codes
+        state['codes'].append(full)
+        state['levels'].append(levels)
+        state['kinds'].append('ordinal' if _is_ordinal(col) else 'continuous')
+    has_design = replicates and 'psu' in df.columns and 'stratum' in df.columns
+    if has_design:
+        usable &= df['psu'].notna().to_numpy() & df['stratum'].notna().to_numpy()
+        design = _jackknife_design(df.loc[usable, 'stratum'].to_numpy(), df.loc[usable, 'psu'].to_numpy())
+        psu_index = np.zeros(len(df), dtype=np.intp)
+        psu_index[usable] = design.pop('psu_index')
+    else:
+        design, psu_index = None, np.zeros(len(df), dtype=np.intp)
+    state.update(weights=np.nan_to_num(weights), usable=usable, psu_index=psu_index, n_groups=int(psu_index.max()) + 1,
+                 design=design)
+    return state
+
+@profiled
+def correlation_matrices(df, columns=None, replicates=True, processes=None, batch_size=None):
+    """
+    weighted pearson, spearman and polychoric matrices over pairwise-complete respondents. the polychoric
+    matrix is mixed: polychoric for two ordinal items, polyserial for an ordinal item and a thermometer,
+    pearson for two thermometers. ses are delete-one-psu jackknife over the design's strata.
+    returns {'columns', 'n', 'pair_method', method: {'estimate', 'se'}} with square frames
+    """
+    columns = columns or default_items(df)
+    state = _prepare(df, columns, replicates)
+    pairs = [(i, j) for i in range(len(columns)) for j in range(i + 1, len(columns))]
+    processes = processes or os.cpu_count() or 1
+    batch_size = batch_size or max(1, -(-len(pairs) // (processes * 4)))
+    batches = [pairs[start:start + batch_size] for start in range(0, len(pairs), batch_size)]
+
+    if processes <= 1 or len(batches) <= 1:
+        _init_worker(state)
+        results = [entry for batch in batches for entry in _pair_batch(batch)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context(), initializer=_init_worker,
+                                 initargs=(state,)) as pool:
+            results = [entry for batch in pool.map(_pair_batch, batches) for entry in batch]
+
+    def square(diagonal):
+        return pd.DataFrame(np.full((len(columns), len(columns)), np.nan), index=columns, columns=columns).astype(float) \
+            if diagonal is None else pd.DataFrame(np.diag(np.full(len(columns), diagonal)), index=columns, columns=columns)
+
+    output = {'columns': columns, 'n': square(0.0), 'pair_method': pd.DataFrame('', index=columns, columns=columns)}
+    for method in methods:
+        output[method] = {'estimate': square(1.0), 'se': square(0.0)}
+    for col, codes in zip(columns, state['codes']):
+        output['n'].loc[col, col] = int(((codes >= 0) & state['usable']).sum())
+    for i, j, n, estimate, se in results:
+        a, b = columns[i], columns[j]
+        output['n'].loc[a, b] = output['n'].loc[b, a] = n
+        kinds = {state['kinds'][i], state['kinds'][j]}
+        output['pair_method'].loc[a, b] = output['pair_method'].loc[b, a] = \
+            'polychoric' if kinds == {'ordinal'} else 'polyserial' if len(kinds) == 2 else 'pearson'
+        for method in methods:
+            value = np.nan if estimate is None else estimate[method]
+            error = np.nan if se is None else se[method]
+            output[method]['estimate'].loc[a, b] = output[method]['estimate'].loc[b, a] = value
+            output[method]['se'].loc[a, b] = output[method]['se'].loc[b, a] = error
+    output['n'] = output['n'].astype(int)
+    return output
+
+def correlation_table(output):
+    # long format: one row per pair with every method's estimate and se
+    columns = output['columns']
+    rows = []
+    for i, a in enumerate(columns):
+        for b in columns[i + 1:]:
+            row = {'item_a': a, 'item_b': b, 'n': int(output['n'].loc[a, b]), 'polychoric_method': output['pair_method'].loc[a, b]}
+            for method in methods:
+                row[method] = output[method]['estimate'].loc[a, b]
+                row[f'{method}_se'] = output[method]['se'].loc[a, b]
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+def main(argv=None):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    parser = argparse.ArgumentParser(description='Weighted pearson, spearman and polychoric correlations among LGBTQ+ items')
+    parser.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    parser.add_argument('--vars', default=None, help='comma separated items (default: every ordered transgender and gay item)')
+    parser.add_argument('--no-se', action='store_true', help='skip the jackknife standard errors')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--output', default='anes_correlations.csv')
+    parser.add_argument('--json', default='anes_correlations.json')
+    args = parser.parse_args(argv)
+
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    output = correlation_matrices(df, args.vars.split(',') if args.vars else None,
+                                  replicates=not args.no_se, processes=args.processes)
+    table = correlation_table(output)
+    table.to_csv(args.output, index=False)
+    with open(args.json, 'w') as f:
+        json.dump({'columns': output['columns'], 'n': output['n'].values.tolist(),
+                   'pair_method': output['pair_method'].values.tolist(),
+                   **{method: {part: output[method][part].round(6).where(output[method][part].notna(), None).values.tolist()
+                               for part in ('estimate', 'se')} for method in methods}}, f, indent=2)
+    print(f"{len(table)} item pairs over {len(output['columns'])} items saved to {args.output} and {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
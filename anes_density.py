@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from data.schema import columns_of_kind
+
+def _linear_bin(values, weights, grid_min, grid_max, grid_size):
+    # split each observation's weight between its two neighbouring grid points
+    delta = (grid_max - grid_min) / (grid_size - 1)
+    pos = (values - grid_min) / delta
+    lo = np.clip(np.floor(pos).astype(np.int64), 0, grid_size - 2)
+    frac = np.clip(pos - lo, 0.0, 1.0)
+    counts = np.bincount(lo, weights=weights * (1 - frac), minlength=grid_size)
+    counts += np.bincount(lo + 1, weights=weights * frac, minlength=grid_size)
+    return counts, delta
+
+def _silverman_bandwidth(grid, probs, n_eff):
+    # weighted mean, sd and iqr read off the binned grid, so this does not depend on n
+    mean = np.sum(grid * probs)
+    sd = np.sqrt(np.sum(probs * (grid - mean) ** 2))
+    cdf = np.cumsum(probs)
+    iqr = np.interp(0.75, cdf, grid) - np.interp(0.25, cdf, grid)
+    spread = min(sd, iqr / 1.349) if iqr > 0 else sd
+    return 0.9 * spread * n_eff ** (-0.2)
+
+def _fft_smooth(counts, delta, bandwidth):
+    # gaussian kernel convolution via fft, reflecting mass at both ends of the bounded scale
+    grid_size = counts.shape[-1]
+    reach = min(int(np.ceil(4 * bandwidth / delta)), grid_size - 1)
+    offsets = np.arange(-reach, reach + 1) * delta
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    kernel /= kernel.sum() * delta
+
+    padded = np.concatenate([counts[..., reach:0:-1], counts, counts[..., -2:-reach - 2:-1]], axis=-1)
+    n_fft = padded.shape[-1] + kernel.size - 1
+    smoothed = np.fft.irfft(np.fft.rfft(padded, n_fft, axis=-1) * np.fft.rfft(kernel, n_fft), n_fft, axis=-1)
+    smoothed = smoothed[..., 2 * reach:2 * reach + grid_size]
+    return np.maximum(smoothed, 0)
+
+def weighted_binned_kde(values, weights=None, grid_min=0, grid_max=100, grid_size=401,
+                        bandwidth=None, n_boot=0, ci=0.95, random_state=None):
+    values = np.asarray(values, dtype=float)
+    weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=float)
+    valid = np.isfinite(values) & np.isfinite(weights) & (weights > 0) & (values >= grid_min) & (values <= grid_max)
+    values, weights = values[valid], weights[valid]
+
+    grid = np.linspace(grid_min, grid_max, grid_size)
+    if len(values) == 0:
+        return None
+
+    counts, delta = _linear_bin(values, weights, grid_min, grid_max, grid_size)
+    total = counts.sum()
+    probs = counts / total
+    n_eff = total ** 2 / np.sum(weights ** 2)
+
+    if bandwidth is None:
+        bandwidth = _silverman_bandwidth(grid, probs, n_eff)
+    bandwidth = max(float(bandwidth), delta)
+
+    density = _fft_smooth(probs, delta, bandwidth)
+    density /= density.sum() * delta
+    result = {
+        "grid": grid,
+        "density": density,
+        "bandwidth": bandwidth,
+        "n": int(len(values)),
+        "n_effective": float(n_eff)
+    }
+
+    if n_boot > 0:
+        # resample the binned distribution at the effective sample size, all replicates smoothed in one fft
+        rng = np.random.default_rng(random_state)
+        boot_counts = rng.multinomial(max(int(round(n_eff)), 1), probs, size=n_boot).astype(float)
+        boot_density = _fft_smooth(boot_counts, delta, bandwidth)
+        boot_density /= boot_density.sum(axis=1, keepdims=True) * delta
+        alpha = (1 - ci) / 2
+        result["lower"] = np.quantile(boot_density, alpha, axis=0)
+        result["upper"] = np.quantile(boot_density, 1 - alpha, axis=0)
+        result["n_boot"] = n_boot
+
+    return result
+
+def thermometer_kdes(df, therm_cols=None, **kde_kwargs):
+    if therm_cols is None:
+        therm_cols = columns_of_kind(df.columns, 'thermometer')
+    weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
+
+    results = {}
+    for col in therm_cols:
+        if col not in df.columns:
+            continue
+        kde = weighted_binned_kde(pd.to_numeric(df[col], errors='coerce').values, weights.values, **kde_kwargs)
+        if kde is not None:
+            results[col] = kde
+    return results
+
+def kde_to_frame(kde):
+    frame = pd.DataFrame({"score": kde["grid"], "density": kde["density"]})
+    if "lower" in kde:
+        frame["lower"] = kde["lower"]
+        frame["upper"] = kde["upper"]
+    return frame
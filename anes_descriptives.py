@@ -2,8 +2,21 @@ import pandas as pd
 import numpy as np
 import json
 from datetime import datetime
+from anes_profiling import profiled
+from data.schema import is_thermometer, theme_columns, analysis_columns, kind_map, schema_dict
+from anes_summary import format_results_summary, print_summary_report
+from anes_backend import weighted_frequencies
+from anes_labels import value_label
+from anes_bitmaps import select_rows, selection_label
+from anes_memory import plan, weighted_moments, float_bytes
 
-def generate_descriptive_json(df, trans_cols=None, gay_cols=None, output_file=None):
+@profiled
+def generate_descriptive_json(df, trans_cols=None, gay_cols=None, output_file=None, backend=None, selection=None,
+                              deff_threshold=None):
+    # selection: bitmap Selection, bool mask or where-expression restricting the respondents
+    # deff_threshold: effective n below which design_effects flags an estimate (default min_effective_n)
+    full_df = df
+    df = select_rows(df, selection)
     results = {
         "metadata": {
             "analysis_date": datetime.now().isoformat(),
@@ -17,19 +30,27 @@ def generate_descriptive_json(df, trans_cols=None, gay_cols=None, output_file=No
     }
     
     if trans_cols is None:
-        trans_cols = [col for col in df.columns if 'trans' in col.lower()]
+        trans_cols = theme_columns(df.columns, 'trans_qs')
     if gay_cols is None:
-        gay_cols = [col for col in df.columns if 'gay' in col.lower()]
+        gay_cols = theme_columns(df.columns, 'gay_qs')
     
-    demo_cols = [col for col in df.columns if col.startswith('resp_')]
-    other_cols = [col for col in df.columns if col not in trans_cols + gay_cols + demo_cols + ['weight', 'case_id'] and not col.startswith(('case_id', 'int_mode', 'prepost_status', 'sample_type', 'psu', 'stratum', 'sample_mode'))]
+    demo_cols = theme_columns(df.columns, 'demographics')
+    other_cols = [col for col in analysis_columns(df.columns) if col not in trans_cols + gay_cols + demo_cols]
     
-    results["transgender_questions"] = _analyze_question_group(df, trans_cols, "Transgender")
-    results["gay_lgb_questions"] = _analyze_question_group(df, gay_cols, "Gay/LGB") 
-    results["demographics"] = _analyze_question_group(df, demo_cols, "Demographics")
-    results["other_variables"] = _analyze_question_group(df, other_cols, "Other")
+    results["transgender_questions"] = _analyze_question_group(df, trans_cols, "Transgender", backend)
+    results["gay_lgb_questions"] = _analyze_question_group(df, gay_cols, "Gay/LGB", backend) 
+    results["demographics"] = _analyze_question_group(df, demo_cols, "Demographics", backend)
+    results["other_variables"] = _analyze_question_group(df, other_cols, "Other", backend)
     
     results["summary_statistics"] = _generate_summary_stats(df, trans_cols, gay_cols, demo_cols)
+    if selection is not None:
+        results["metadata"]["selection"] = selection_label(selection)
+
+    if 'weight' in df.columns:
+        # scipy's sparse module is only paid for here; a selection is a domain of the full design
+        from anes_design_effects import design_effects, min_effective_n
+        domains = {'all': None} if selection is None else {selection_label(selection): selection}
+        results["design_effects"] = design_effects(full_df, domains, threshold=deff_threshold or min_effective_n)
     
     if output_file:
         with open(output_file, 'w') as f:
@@ -37,7 +58,16 @@ def generate_descriptive_json(df, trans_cols=None, gay_cols=None, output_file=No
     
     return results
 
-def _analyze_question_group(df, columns, group_name):
+def _is_numeric_column(series):
+    if series.dtype == 'object' or series.dtype == 'string':
+        try:
+            pd.to_numeric(series, errors='raise')
+        except (ValueError, TypeError):
+            return False
+    return True
+
+@profiled
+def _analyze_question_group(df, columns, group_name, backend=None):
     group_results = {
         "group_info": {
             "name": group_name,
@@ -49,6 +79,12 @@ def _analyze_question_group(df, columns, group_name):
     
     weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
     
+    # every categorical item's counts and weighted counts come from one grouped pass
+    categorical_cols = [col for col in columns if col in df.columns and not is_thermometer(col)
+                        and _is_numeric_column(df[col])]
+    table = weighted_frequencies(df, categorical_cols, backend=backend)
+    frequencies = {col: group for col, group in table.groupby('question', sort=False)}
+    
     for col in columns:
         if col not in df.columns:
             continue
@@ -58,26 +94,22 @@ def _analyze_question_group(df, columns, group_name):
             continue
         
         # skip non-numeric columns
-        if df[col].dtype == 'object' or df[col].dtype == 'string':
-            try:
-                pd.to_numeric(df[col], errors='raise')
-            except (ValueError, TypeError):
-                continue
+        if not _is_numeric_column(df[col]):
+            continue
             
         group_results["group_info"]["questions_with_data"] += 1
         
-        # define if therm or not
-        is_thermometer = 'therm' in col.lower()
+        is_therm = is_thermometer(col)
         
         question_stats = {
             "variable_name": col,
-            "question_type": "thermometer" if is_thermometer else "categorical",
+            "question_type": "thermometer" if is_therm else "categorical",
             "total_responses": len(valid_data),
             "missing_responses": int(df[col].isna().sum()),
             "response_rate": len(valid_data) / len(df) * 100
         }
         
-        if is_thermometer:
+        if is_therm:
             try:
                 numeric_data = pd.to_numeric(valid_data, errors='coerce')
                 valid_therm = numeric_data[(numeric_data >= 0) & (numeric_data <= 100)].dropna()
@@ -98,14 +130,11 @@ def _analyze_question_group(df, columns, group_name):
                     })
                     
                     if 'weight' in df.columns:
-                        valid_mask = (pd.to_numeric(df[col], errors='coerce') >= 0) & \
-                                   (pd.to_numeric(df[col], errors='coerce') <= 100) & \
-                                   df[col].notna() & weights.notna()
-                        if valid_mask.sum() > 0:
-                            weighted_mean = np.average(
-                                pd.to_numeric(df.loc[valid_mask, col], errors='coerce'), 
-                                weights=weights[valid_mask]
-                            )
+                        # streamed over chunks under a memory budget instead of three full to_numeric copies
+                        decision = plan('weighted_mean', len(df), 4 * float_bytes)
+                        count, total, weighted_mean, _ = weighted_moments(df[col], weights, decision['chunk_rows'],
+                                                                          valid_range=(0, 100))
+                        if count > 0:
                             question_stats["weighted_mean"] = float(weighted_mean)
                 else:
                     question_stats.update({
@@ -120,61 +149,28 @@ def _analyze_question_group(df, columns, group_name):
                 question_stats["error"] = str(e)
         else:
             try:
-                try:
-                    numeric_data = pd.to_numeric(valid_data)
-                except (ValueError, TypeError):
-                    numeric_data = valid_data
-                
-                value_counts = numeric_data.value_counts().sort_index()
-                
-                filtered_counts = {}
-                filtered_percentages = {}
-                
-                for value, count in value_counts.items():
-                    try:
-                        numeric_key = float(value) if pd.api.types.is_numeric_dtype(type(value)) else str(value)
-                        if isinstance(numeric_key, (int, float)) and not np.isnan(numeric_key):
-                            filtered_counts[int(numeric_key) if float(numeric_key).is_integer() else numeric_key] = int(count)
-                            filtered_percentages[int(numeric_key) if float(numeric_key).is_integer() else numeric_key] = round(count / len(numeric_data) * 100, 2)
-                    except (ValueError, TypeError):
-                        continue
-                
-                if filtered_counts:
+                counts = frequencies.get(col)
+                if counts is not None and len(counts):
+                    total = int(counts['n'].sum())
+                    keys = [int(value) if float(value).is_integer() else float(value) for value in counts['value']]
                     question_stats.update({
-                        "unique_values": len(filtered_counts),
-                        "value_counts": filtered_counts,
-                        "percentages": filtered_percentages,
-                        "mode": None
+                        "unique_values": len(keys),
+                        "value_counts": dict(zip(keys, counts['n'].astype(int).tolist())),
+                        "percentages": {key: round(n / total * 100, 2) for key, n in zip(keys, counts['n'])},
+                        "value_labels": {key: value_label(col, key) for key in keys},
+                        # most frequent value, ties go to the lowest code like Series.mode
+                        "mode": keys[int(np.argmax(counts['n'].values))]
                     })
                     
-                    try:
-                        mode_val = numeric_data.mode()
-                        if len(mode_val) > 0 and pd.api.types.is_numeric_dtype(type(mode_val.iloc[0])):
-                            mode_numeric = float(mode_val.iloc[0])
-                            question_stats["mode"] = int(mode_numeric) if mode_numeric.is_integer() else mode_numeric
-                    except:
-                        question_stats["mode"] = None
-                    
                     if 'weight' in df.columns:
-                        weighted_counts = {}
-                        weighted_percentages = {}
-                        valid_mask = df[col].notna() & weights.notna()
-                        
-                        if valid_mask.sum() > 0:
-                            total_weight = weights[valid_mask].sum()
-                            for value in filtered_counts.keys():
-                                try:
-                                    value_mask = valid_mask & (pd.to_numeric(df[col], errors='coerce') == value)
-                                    if value_mask.sum() > 0:
-                                        weighted_count = weights[value_mask].sum()
-                                        weighted_counts[value] = float(weighted_count)
-                                        weighted_percentages[value] = float(weighted_count / total_weight * 100)
-                                except:
-                                    continue
-                            
-                            if weighted_counts:
-                                question_stats["weighted_counts"] = weighted_counts
-                                question_stats["weighted_percentages"] = weighted_percentages
+                        weighted = counts['n_weighted'].values > 0
+                        total_weight = counts['weighted_n'].values[weighted].sum()
+                        if weighted.any():
+                            question_stats["weighted_counts"] = {
+                                key: float(w) for key, w, keep in zip(keys, counts['weighted_n'], weighted) if keep}
+                            question_stats["weighted_percentages"] = {
+                                key: float(w / total_weight * 100)
+                                for key, w, keep in zip(keys, counts['weighted_n'], weighted) if keep}
                 else:
                     question_stats.update({
                         "unique_values": 0,
@@ -190,6 +186,7 @@ def _analyze_question_group(df, columns, group_name):
     
     return group_results
 
+@profiled
 def _generate_summary_stats(df, trans_cols, gay_cols, demo_cols):
     summary = {
         "data_quality": {
@@ -224,9 +221,9 @@ def _generate_summary_stats(df, trans_cols, gay_cols, demo_cols):
     all_survey_cols = trans_cols + gay_cols + demo_cols
     if all_survey_cols:
         missing_per_respondent = df[all_survey_cols].isna().sum(axis=1)
-        summary["data_quality"]["completely_missing_cases"] = (missing_per_respondent == len(all_survey_cols)).sum()
-        summary["data_quality"]["partially_complete_cases"] = ((missing_per_respondent > 0) & (missing_per_respondent < len(all_survey_cols))).sum()
-        summary["data_quality"]["complete_cases"] = (missing_per_respondent == 0).sum()
+        summary["data_quality"]["completely_missing_cases"] = int((missing_per_respondent == len(all_survey_cols)).sum())
+        summary["data_quality"]["partially_complete_cases"] = int(((missing_per_respondent > 0) & (missing_per_respondent < len(all_survey_cols))).sum())
+        summary["data_quality"]["complete_cases"] = int((missing_per_respondent == 0).sum())
     
     for group_name, cols in [("transgender", trans_cols), ("gay_lgb", gay_cols), ("demographics", demo_cols)]:
         if cols:
@@ -257,40 +254,41 @@ def _generate_summary_stats(df, trans_cols, gay_cols, demo_cols):
     
     return summary
 
-def save_descriptive_json(df, trans_cols=None, gay_cols=None, filename="anes_descriptive_stats.json"):
-    return generate_descriptive_json(df, trans_cols, gay_cols, filename)
+@profiled
+def aggregate_facets(df, question_cols, facet_col, therm_bins=25, selection=None):
+    # one grouped pass over all items: long format, thermometers binned, weights summed per (facet, question, value)
+    df = select_rows(df, selection)
+    existing_cols = [col for col in question_cols if col in df.columns]
+    weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
+    base = pd.DataFrame({'facet': df[facet_col], 'weight': weights})
+    base = pd.concat([base, df[existing_cols]], axis=1)
+    base = base[base['facet'].notna() & (base['facet'] >= 0) & base['weight'].notna()]
 
-def print_summary_report(stats_dict): 
-    print("Summary Report:")   
-    # metadata
-    metadata = stats_dict["metadata"]
-    print(f"\nAnalysis Date: {metadata['analysis_date']}")
-    print(f"Total Respondents: {metadata['total_respondents']:,}")
-    print(f"Total Variables: {metadata['total_variables']}")
-    
-    # data quality
-    quality = stats_dict["summary_statistics"]["data_quality"]
-    print(f"\nData Quality:")
-    print(f"  Complete cases: {quality['complete_cases']:,} ({quality['complete_cases']/metadata['total_respondents']*100:.1f}%)")
-    print(f"  Partially complete: {quality['partially_complete_cases']:,} ({quality['partially_complete_cases']/metadata['total_respondents']*100:.1f}%)")
-    print(f"  Completely missing: {quality['completely_missing_cases']:,} ({quality['completely_missing_cases']/metadata['total_respondents']*100:.1f}%)")
-    
-    # question groups
-    print(f"\nQuestion Groups:")
-    for group_name, group_data in stats_dict["summary_statistics"]["question_group_summary"].items():
-        print(f"  {group_name.title()}:")
-        print(f"    Questions: {group_data['total_questions']}")
-        print(f"    Avg response rate: {group_data['avg_response_rate']:.1f}%")
-        print(f"    High missingness (>50%): {group_data['questions_with_high_missingness']}")
-    
-    # weights
-    weights_info = stats_dict["summary_statistics"]["weights_info"]
-    print(f"\nWeights:")
-    if weights_info["has_weights"]:
-        weight_stats = weights_info["weight_statistics"]
-        print(f"  Available: Yes")
-        print(f"  Mean weight: {weight_stats['mean']:.3f}")
-        print(f"  Weight range: {weight_stats['min']:.3f} - {weight_stats['max']:.3f}")
-        print(f"  Total weighted N: {weight_stats['total_weighted_n']:,.0f}")
-    else:
-        print(f"  Available: No")
\ No newline at end of file
+    long = base.melt(id_vars=['facet', 'weight'], value_vars=existing_cols,
+                     var_name='question', value_name='value').dropna(subset=['value'])
+
+    # per-kind dispatch on the question column: range bounds come from the schema, one lookup per item
+    kinds = kind_map(existing_cols)
+    therm_cols = [col for col in existing_cols if kinds[col] == 'thermometer']
+    therm_mask = long['question'].isin(therm_cols)
+    low = long['question'].map({col: schema_dict[col]['valid_min'] for col in therm_cols})
+    high = long['question'].map({col: schema_dict[col]['valid_max'] for col in therm_cols})
+    long = long[~therm_mask | ((long['value'] >= low) & (long['value'] <= high))]
+    therm_mask = therm_mask[long.index]
+    bin_width = 100 / therm_bins
+    binned = (np.minimum(long['value'] // bin_width, therm_bins - 1) * bin_width + bin_width / 2)
+    long['value'] = np.where(therm_mask, binned, long['value'])
+
+    grouped = long.groupby(['facet', 'question', 'value'], sort=True)['weight'].agg(['sum', 'size'])
+    grouped.columns = ['weighted_n', 'n']
+    totals = grouped.groupby(level=['facet', 'question'])['weighted_n'].transform('sum')
+    grouped['weighted_percentage'] = grouped['weighted_n'] / totals * 100
+    return grouped.reset_index()
+
+def reorder_columns(available_cols, desired_order):
+    ordered = [col for col in desired_order if col in available_cols]
+    remaining = [col for col in available_cols if col not in desired_order]
+    return ordered + remaining
+
+def save_descriptive_json(df, trans_cols=None, gay_cols=None, filename="anes_descriptive_stats.json", selection=None):
+    return generate_descriptive_json(df, trans_cols, gay_cols, filename, selection=selection)
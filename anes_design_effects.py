@@ -0,0 +1,249 @@
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from anes_profiling import profiled
+from data.schema import kind_of, analysis_columns, valid_mask
+from anes_bitmaps import as_mask, selection_label
+from anes_memory import plan, chunk_slices, float_bytes
+
+# design effects and effective sample sizes for every estimate samplics_analysis makes. rows are summed
+# into stratum/psu aggregates once per domain (sparse products over all items and categories together);
+# taylor variances, srs variances, kish's weighting effect and effective n all come from those sums
+
+min_effective_n = 30  # estimates resting on fewer effective respondents than this are flagged
+continuous_kinds = ('thermometer', 'continuous')
+
+def design_codes(df):
+    # rows usable for estimation, each row's psu number and each psu's stratum number. without psu/stratum
+    # every respondent is its own psu in one stratum (weights only, with-replacement variance)
+    weights = df['weight'].to_numpy(dtype=float, na_value=np.nan) if 'weight' in df.columns else np.ones(len(df))
+    usable = ~np.isnan(weights)
+    if 'psu' in df.columns and 'stratum' in df.columns:
+        stratum = df['stratum'].to_numpy(dtype=float, na_value=np.nan)
+        psu = df['psu'].to_numpy(dtype=float, na_value=np.nan)
+        usable &= ~np.isnan(stratum) & ~np.isnan(psu)
+        pairs = pd.MultiIndex.from_arrays([stratum[usable], psu[usable]])
+        psu_codes, psus = pd.factorize(pairs, sort=True)
+        stratum_of_psu = pd.factorize(psus.get_level_values(0), sort=True)[0]
+    else:
+        psu_codes = np.arange(int(usable.sum()))
+        stratum_of_psu = np.zeros(len(psu_codes), dtype=np.int64)
+    codes = np.full(len(df), -1, dtype=np.int64)
+    codes[usable] = psu_codes
+    return np.where(usable, weights, 0.0), codes, stratum_of_psu
+
+def estimate_specs(df, variables=None):
+    """
+    one entry per item: kind, its column range in the estimate matrix and, for categorical items, the
+    sorted categories. continuous items (thermometers) have one estimate, the mean
+    """
+    variables = variables or [col for col in analysis_columns(df.columns) if pd.api.types.is_numeric_dtype(df[col])]
+    specs, first = [], 0
+    for var in variables:
+        if kind_of(var) in continuous_kinds:
+            spec = {'variable': var, 'type': 'continuous', 'first': first, 'categories': None}
+        else:
+            categories = np.sort(df[var].dropna().unique().astype(float))
+            if len(categories) == 0:
+                continue
+            spec = {'variable': var, 'type': 'categorical', 'first': first, 'categories': categories}
+        first += 1 if spec['categories'] is None else len(spec['categories'])
+        specs.append(spec)
+    return specs, first
+
+def _indicators(df, specs, n_estimates):
+    # sparse n x estimates (1 for a category, the value for a mean) and n x items (answered) matrices
+    rows_y, cols_y, values_y, cols_v = [], [], [], []
+    for idx, spec in enumerate(specs):
+        values = df[spec['variable']].to_numpy(dtype=float, na_value=np.nan)
+        # category shares keep every answered code ('Other' education too), as samplics_analysis does;
+        # means only count values inside the item's range
+        answered = ~np.isnan(values)
+        if spec['type'] == 'continuous':
+            answered &= valid_mask(df[spec['variable']], spec['variable']).to_numpy(dtype=bool, na_value=False)
+        rows = np.flatnonzero(answered)
+        if spec['type'] == 'continuous':
+            cols, data = np.full(len(rows), spec['first']), values[rows]
+        else:
+            cols, data = spec['first'] + np.searchsorted(spec['categories'], values[rows]), np.ones(len(rows))
+        rows_y.append(rows)
+        cols_y.append(cols)
+        values_y.append(data)
+        cols_v.append(np.full(len(rows), idx))
+    rows = np.concatenate(rows_y) if rows_y else np.zeros(0, dtype=np.int64)
+    join = lambda parts: np.concatenate(parts) if parts else np.zeros(0)
+    y = sparse.csr_matrix((join(values_y), (rows, join(cols_y))), shape=(len(df), n_estimates))
+    answered = sparse.csr_matrix((np.ones(len(rows)), (rows, join(cols_v))), shape=(len(df), len(specs)))
+    return y, answered
+
+def _aggregates(y, answered, weights, codes, n_psus, in_domain):
+    # additive sums for one row block: psu x estimate weighted totals, psu x item weighted and plain counts,
+    # and per item/estimate totals for the srs and kish parts
+    w = np.where(in_domain, weights, 0.0)
+    keep = np.flatnonzero(codes >= 0)
+    by_psu = sparse.csr_matrix((w[keep], (codes[keep], keep)), shape=(n_psus, len(w)))
+    present = sparse.csr_matrix((np.ones(len(keep)), (codes[keep], keep)), shape=(n_psus, len(w)))
+    used = (codes >= 0) & in_domain
+    return {
+        'psu_y': (by_psu @ y).toarray(),
+        'psu_w': (by_psu @ answered).toarray(),
+        'psu_n': (present @ answered).toarray(),
+        'n': answered.T @ used.astype(float),
+        'w2': answered.T @ (w ** 2),
+        'wy2': y.multiply(y).T @ w
+    }
+
+def _taylor(totals, item_of, stratum_of_psu, present):
+    """
+    with-replacement taylor variance of every ratio mean sum(w y) / sum(w): psu scores
+    z = (sum(w y) - mean * sum(w)) / total weight, then n_h / (n_h - 1) * sum((z - mean z_h)^2) per stratum.
+    present marks the psus that count towards n_h; strata with one psu add nothing (samplics' skip)
+    """
+    w_total = totals['psu_w'].sum(axis=0)[item_of]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        estimate = totals['psu_y'].sum(axis=0) / w_total
+        z = (totals['psu_y'] - estimate * totals['psu_w'][:, item_of]) / w_total
+    z = np.where(present, np.nan_to_num(z), 0.0)
+    strata = sparse.csr_matrix((np.ones(len(stratum_of_psu)), (stratum_of_psu, np.arange(len(stratum_of_psu)))))
+    n_h = strata @ present.astype(float)
+    sums, squares = strata @ z, strata @ (z ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per_stratum = np.where(n_h > 1, n_h / (n_h - 1) * (squares - sums ** 2 / n_h), 0.0)
+    return estimate, w_total, per_stratum.sum(axis=0)
+
+def _key(value):
+    return int(value) if float(value).is_integer() else float(value)
+
+def _round(value, digits=None):
+    # json-safe: nan/inf become None
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value) if digits is None else round(float(value), digits)
+
+@profiled
+def design_effects(df, domains=None, variables=None, threshold=min_effective_n):
+    """
+    kish weighting deff, per-estimate deff (taylor variance / srs variance of the same weighted mean)
+    and effective n for every item, category and domain. domains: {label: selection} with any form
+    as_mask takes, None meaning everyone; default is the whole sample. rows outside a domain still
+    count towards its psus, like samplics_analysis(domain=...)
+    """
+    domains = {'all': None} if domains is None else domains
+    weights, codes, stratum_of_psu = design_codes(df)
+    specs, n_estimates = estimate_specs(df, variables)
+    item_of = np.concatenate([np.full(1 if s['categories'] is None else len(s['categories']), idx)
+                              for idx, s in enumerate(specs)]) if specs else np.zeros(0, dtype=np.int64)
+    is_share = np.concatenate([np.full(1 if s['categories'] is None else len(s['categories']), s['categories'] is not None)
+                               for s in specs]) if specs else np.zeros(0, dtype=bool)
+    n_psus = len(stratum_of_psu)
+    # the sparse indicators hold ~2 values per answered cell; over the memory budget rows go in blocks
+    decision = plan('design_effects', len(df), 4 * float_bytes * max(len(specs), 1))
+    blocks = chunk_slices(len(df), decision['chunk_rows'])
+    masks = {label: (np.ones(len(df), dtype=bool) if selection is None
+                     else as_mask(selection, df).to_numpy(dtype=bool)) for label, selection in domains.items()}
+
+    totals = {label: None for label in domains}
+    for block in blocks:
+        part = df.iloc[block]
+        y, answered = _indicators(part, specs, n_estimates)
+        for label, mask in masks.items():
+            sums = _aggregates(y, answered, weights[block], codes[block], n_psus, mask[block])
+            totals[label] = sums if totals[label] is None else {k: totals[label][k] + v for k, v in sums.items()}
+
+    report = {'threshold': threshold, 'psus': int(n_psus), 'strata': int(stratum_of_psu.max() + 1) if n_psus else 0,
+              'domains': {}, 'flagged': []}
+    for label, sums in totals.items():
+        mask = masks[label]
+        # a whole-sample estimate only passes psus where the item was answered; a domain passes every psu
+        present = sums['psu_n'][:, item_of] > 0 if domains[label] is None else np.ones_like(sums['psu_y'], dtype=bool)
+        estimate, w_total, variance = _taylor(sums, item_of, stratum_of_psu, present)
+        n, w2 = sums['n'][item_of], sums['w2'][item_of]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # srs variance of the weighted mean: weighted element variance (n / (n - 1) corrected) over n;
+            # p(1 - p) for a category, which stays exactly 0 for a category everyone in the domain picked
+            element = np.where(is_share, estimate * (1 - estimate), np.maximum(sums['wy2'] / w_total - estimate ** 2, 0.0))
+            element = element * n / (n - 1)
+            srs_variance = element / n
+            deff = variance / srs_variance
+            effective_n = n / deff
+            kish_deff = n * w2 / w_total ** 2
+        in_domain = mask & (codes >= 0)
+        domain_w = weights[in_domain]
+        section = {'respondents': int(in_domain.sum()),
+                   'kish_deff': _round(len(domain_w) * (domain_w ** 2).sum() / domain_w.sum() ** 2, 4) if len(domain_w) else None,
+                   'kish_effective_n': _round(domain_w.sum() ** 2 / (domain_w ** 2).sum(), 1) if len(domain_w) else None,
+                   'variables': {}}
+        for spec in specs:
+            first = spec['first']
+            keys = ['mean'] if spec['categories'] is None else [_key(c) for c in spec['categories']]
+            if n[first] == 0:
+                continue
+            entry = {'type': spec['type'], 'n': int(n[first]), 'kish_deff': _round(kish_deff[first], 4),
+                     'kish_effective_n': _round(n[first] / kish_deff[first], 1), 'estimates': {}}
+            for offset, key in enumerate(keys):
+                col = first + offset
+                flagged = bool(np.isfinite(effective_n[col]) and effective_n[col] < threshold)
+                entry['estimates'][key] = {
+                    'estimate': _round(estimate[col]), 'se': _round(np.sqrt(variance[col])),
+                    'srs_se': _round(np.sqrt(srs_variance[col])), 'deff': _round(deff[col], 4),
+                    'effective_n': _round(effective_n[col], 1), 'flagged': flagged}
+                if flagged:
+                    report['flagged'].append({'domain': label, 'variable': spec['variable'], 'category': key,
+                                              'effective_n': _round(effective_n[col], 1)})
+            section['variables'][spec['variable']] = entry
+        report['domains'][label] = section
+    return report
+
+def facet_domains(df, col):
+    # one domain per answered value of col, labelled like where-expressions
+    values = np.sort(df[col].dropna().unique().astype(float))
+    return {f"{col} == {_key(value)}": df[col] == value for value in values}
+
+def format_design_effects(report, top=15):
+    lines = [f"Design effects over {report['psus']} psus in {report['strata']} strata "
+             f"(flag: effective n < {report['threshold']:g})"]
+    for label, section in report['domains'].items():
+        deffs = [e['deff'] for v in section['variables'].values() for e in v['estimates'].values() if e['deff']]
+        lines.append(f"  {label}: {section['respondents']:,} respondents, kish deff {section['kish_deff']}, "
+                     f"kish effective n {section['kish_effective_n']:,}"
+                     + (f", median estimate deff {np.median(deffs):.2f}" if deffs else ''))
+    lines.append(f"{len(report['flagged'])} estimate(s) flagged")
+    for row in sorted(report['flagged'], key=lambda r: r['effective_n'] or 0)[:top]:
+        lines.append(f"  {row['domain']:<28} {row['variable']:<22} {str(row['category']):<8} "
+                     f"effective n {row['effective_n']}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    from anes_bitmaps import BitmapIndex
+    parser = argparse.ArgumentParser(description='Design effects and effective sample sizes for every estimate')
+    parser.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    parser.add_argument('--vars', default=None, help='comma separated items (default: every analysis item)')
+    parser.add_argument('--facets', default=None, help='comma separated columns; every value becomes a domain')
+    parser.add_argument('--where', action='append', default=[], help='a domain as a where-expression (repeatable)')
+    parser.add_argument('--threshold', type=float, default=min_effective_n)
+    parser.add_argument('--json', default='anes_design_effects.json')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    df, _ = load_and_prepare_data(args.csv, var_dict)
+    domains = {'all': None}
+    index = BitmapIndex(df, columns=[]) if args.where else None
+    for text in args.where:
+        selection = index.select(text)
+        domains[selection_label(selection)] = selection
+    for col in (args.facets.split(',') if args.facets else []):
+        domains.update(facet_domains(df, col))
+    report = design_effects(df, domains, args.vars.split(',') if args.vars else None, args.threshold)
+    with open(args.json, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(format_design_effects(report, args.top))
+    print(f"Saved: {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
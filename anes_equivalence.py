@@ -0,0 +1,454 @@
+import os
+import sys
+import json
+import math
+import time
+import tempfile
+import argparse
+import warnings
+import contextlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from data.dicts import var_dict
+from anes_synthetic import write_synthetic
+
+# golden-output equivalence: every case runs its reference implementation and each fast path on the
+# same input, compares every number within the case's tolerances and times both sides. the reference
+# output is also pinned in a golden json, so a change to the reference path itself shows up as well
+
+bundled_csv = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lgbt_anes.csv')
+reference_backend = 'pandas'
+default_rows = 10_000
+default_golden = 'anes_golden.json'
+default_history = 'anes_equivalence_history.jsonl'
+default_tolerance = {'rtol': 1e-9, 'atol': 1e-12}
+max_reported = 5  # differences listed per comparison, the rest are only counted
+tiny_budget = 1  # bytes; forces every budgeted step onto its chunked path
+
+# inputs and outputs
+
+def _processed_frame(inputs):
+    from anes_statistics import load_and_prepare_data
+    return load_and_prepare_data(inputs['processed_csv'], var_dict, backend=reference_backend)[0]
+
+@contextlib.contextmanager
+def _memory_budget(budget):
+    from anes_memory import set_memory_budget, memory_budget
+    previous = memory_budget()
+    set_memory_budget(budget)
+    try:
+        yield
+    finally:
+        set_memory_budget(previous)
+
+def _has_polars():
+    from anes_backend import available_backends
+    return 'polars' in available_backends()
+
+def _descriptives_output(results):
+    # the run date is the only field that is allowed to change
+    return {key: ({k: v for k, v in value.items() if k != 'analysis_date'} if key == 'metadata' else value)
+            for key, value in results.items()}
+
+def _ingest_output(output_file):
+    # compared as written, so the streamed ingest (which returns nothing) is checked the same way
+    return pd.read_csv(output_file, float_precision='round_trip')
+
+def _sports_output(result):
+    # the published numbers: sample sizes, means, the difference, p and both distributions
+    pre, post = result['pre_data'], result['post_data']
+    return {'n_pre': len(pre), 'n_post': len(post), 'pre_mean': float(pre.mean()), 'post_mean': float(post.mean()),
+            'difference': float(result['difference']), 'p_value': float(result['p_value']),
+            'pre_counts': pre.value_counts().sort_index(), 'post_counts': post.value_counts().sort_index()}
+
+# reference implementations that are not simply the plain path of the function itself
+
+def reference_lgbt_fixed(input_file, output_file):
+    """
+    the original ingest: whole file in, missing codes replaced column by column and weight/psu/stratum
+    taken row by row from the first usable design in priority order
+    """
+    from anes_backend import missing_codes
+    from data.weights import weights_dict, priority_order
+    df = pd.read_csv(input_file)
+    existing_columns = [col for col in var_dict if col in df.columns]
+    filtered_df = df[existing_columns].copy().rename(columns=var_dict)
+    for col in filtered_df.columns:
+        filtered_df[col] = filtered_df[col].replace(missing_codes, np.nan)
+    filtered_df['weight'], filtered_df['psu'], filtered_df['stratum'] = np.nan, np.nan, np.nan
+    filtered_df['sample_mode'] = 'no_design'
+
+    available = {name: cols for name, cols in weights_dict.items() if all(col in df.columns for col in cols.values())}
+    for cols in available.values():
+        for col in cols.values():
+            df[col] = pd.to_numeric(df[col].replace([' ', '', '  ', '   '], np.nan), errors='coerce')
+            df[col] = df[col].replace(missing_codes, np.nan)
+    priority = [name for name in priority_order if name in available]
+
+    for idx in filtered_df.index:
+        for name in priority:
+            cols = available[name]
+            weight, psu, stratum = df.loc[idx, cols['weight']], df.loc[idx, cols['psu']], df.loc[idx, cols['stratum']]
+            if pd.notna(weight) and pd.notna(psu) and pd.notna(stratum) and weight > 0:
+                filtered_df.loc[idx, 'weight'] = weight
+                filtered_df.loc[idx, 'psu'] = psu
+                filtered_df.loc[idx, 'stratum'] = stratum
+                filtered_df.loc[idx, 'sample_mode'] = name
+                break
+    filtered_df.to_csv(output_file, index=False)
+    return filtered_df
+
+def _taylor_mean(y, weights, stratum, psu, base, domain):
+    # weighted mean of y over the domain and its taylor-linearized se: the psu totals of
+    # w * (y - mean) / sum(w) spread within each stratum, times n_h / (n_h - 1); single-psu strata add nothing.
+    # every base row keeps its psu in the count, domain or not
+    w = weights[base] * domain[base]
+    y = y[base].where(domain[base], 0.0)
+    mean = (w * y).sum() / w.sum()
+    z = w * (y - mean) / w.sum()
+    variance = 0.0
+    for _, totals in z.groupby([stratum[base], psu[base]]).sum().groupby(level=0):
+        if len(totals) > 1:
+            variance += len(totals) / (len(totals) - 1) * ((totals - totals.mean()) ** 2).sum()
+    return mean, math.sqrt(variance)
+
+def reference_samplics_analysis(df, domain=None):
+    """
+    the design-based estimates written out column by column without samplics: weighted shares of every
+    category of the valid answers and weighted means of the valid thermometer ratings, with stratified
+    taylor ses (psu within stratum) or simple random sampling ses when the design is missing
+    """
+    from data.schema import kind_of, analysis_columns, valid_mask
+    weights = (df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)).astype(float)
+    has_design = 'psu' in df.columns and 'stratum' in df.columns
+    design_mask = df['psu'].notna() & df['stratum'].notna() if has_design else pd.Series(True, index=df.index)
+    stratum = df['stratum'] if has_design else pd.Series(0, index=df.index)
+    psu = df['psu'] if has_design else pd.Series(np.arange(len(df)), index=df.index)
+    in_domain = pd.Series(True, index=df.index) if domain is None else domain
+
+    def estimate(y, base, answered):
+        return _taylor_mean(y.astype(float), weights, stratum, psu, base, answered)
+
+    results = {}
+    for var in analysis_columns(df.columns):
+        if df[var].dtype in ['object', 'string'] or not pd.api.types.is_numeric_dtype(df[var]):
+            continue
+        answered = df[var].notna() & weights.notna() & in_domain
+        if answered.sum() <= 10:
+            continue
+        if kind_of(var) in ('thermometer', 'continuous'):
+            rated = answered & valid_mask(df[var], var)
+            if rated.sum() <= 10:
+                continue
+            base = weights.notna() & design_mask if domain is not None else rated & design_mask
+            mean, se = estimate(df[var], base, rated)
+            results[var] = {"type": "continuous", "mean": float(mean), "se": se, "n": int(rated.sum())}
+            continue
+        base = weights.notna() & design_mask if domain is not None else answered & design_mask
+        categories = {}
+        for cat in sorted(df.loc[answered, var].unique()):
+            if (answered & (df[var] == cat)).sum() < 5:
+                continue
+            share, se = estimate(df[var] == cat, base, answered)
+            categories[float(cat)] = {"proportion": float(share), "se": se}
+        if categories:
+            results[var] = {"type": "categorical", "categories": categories, "n": int(answered.sum())}
+    return results
+
+# cases: each setup returns a zero-argument callable (setup is not timed), like benchmark_dict
+
+def _descriptives(backend=reference_backend, compact=False, budget=None):
+    def setup(inputs, workdir):
+        from anes_descriptives import generate_descriptive_json
+        from data.schema import compact_frame
+        df = _processed_frame(inputs)
+        df = compact_frame(df) if compact else df
+
+        def run():
+            with _memory_budget(budget):
+                return generate_descriptive_json(df, backend=backend)
+        return run
+    return setup
+
+def _samplics(compact=False, domain=None, reference=False):
+    # domain: None, 'mask' (pandas isin) or 'bitmap' (prebuilt index); both select the same respondents
+    def setup(inputs, workdir):
+        from anes_statistics import samplics_analysis
+        from anes_bitmaps import BitmapIndex
+        from data.schema import compact_frame
+        df = _processed_frame(inputs)
+        df = compact_frame(df) if compact else df
+        selection = None
+        if domain == 'mask':
+            selection = df['resp_partyid'].isin([1, 2, 3])
+        elif domain == 'bitmap':
+            selection = BitmapIndex(df).isin('resp_partyid', [1, 2, 3])
+        if reference:
+            return lambda: reference_samplics_analysis(df, domain=selection)
+        return lambda: samplics_analysis(df, domain=selection)
+    return setup
+
+def _lgbt_fixed(backend=None, budget=None, reference=False):
+    def setup(inputs, workdir):
+        from data.formatanes import anes_lgbt_fixed
+        output_file = os.path.join(workdir, f"ingest_{'reference' if reference else backend}_{budget or 'all'}.csv")
+
+        def run():
+            if reference:
+                reference_lgbt_fixed(inputs['raw_csv'], output_file)
+            else:
+                with _memory_budget(budget):
+                    anes_lgbt_fixed(inputs['raw_csv'], output_file, backend=backend)
+            return output_file
+        return run
+    return setup
+
+def _sports(backend=reference_backend):
+    def setup(inputs, workdir):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        from sports_crosssect import main as sports_main
+
+        def run():
+            result = sports_main(inputs['processed_csv'], backend=backend)
+            plt.close('all')
+            return result
+        return run
+    return setup
+
+equivalence_dict = {
+    # the golden output comes from the code before the fast paths, which had no design effects or value labels
+    'generate_descriptive_json': {
+        'needs': 'processed', 'reference': _descriptives(), 'output': _descriptives_output,
+        'not_in_golden': ('design_effects', 'value_labels'),
+        'candidates': {'polars': (_descriptives(backend='polars'), _has_polars),
+                       'compact_dtypes': (_descriptives(compact=True), None),
+                       'chunked': (_descriptives(budget=tiny_budget), None)}
+    },
+    'samplics_analysis': {
+        'needs': 'processed', 'reference': _samplics(reference=True), 'rtol': 1e-8,
+        'candidates': {'samplics': (_samplics(), None), 'compact_dtypes': (_samplics(compact=True), None)}
+    },
+    'samplics_analysis_domain': {
+        'needs': 'processed', 'reference': _samplics(domain='mask', reference=True), 'rtol': 1e-8,
+        'candidates': {'mask': (_samplics(domain='mask'), None), 'bitmap': (_samplics(domain='bitmap'), None)}
+    },
+    # the original reader's default float parser can be 1 ulp off the exact (round_trip) one the backends use
+    'anes_lgbt_fixed': {
+        'needs': 'raw', 'reference': _lgbt_fixed(reference=True), 'output': _ingest_output, 'rtol': 1e-14, 'atol': 0,
+        'candidates': {'pandas': (_lgbt_fixed(backend='pandas'), None),
+                       'polars': (_lgbt_fixed(backend='polars'), _has_polars),
+                       'chunked': (_lgbt_fixed(backend='pandas', budget=tiny_budget), None)}
+    },
+    'sports_crosssect.main': {
+        'needs': 'processed', 'reference': _sports(), 'output': _sports_output, 'rtol': 1e-12,
+        'candidates': {'polars': (_sports(backend='polars'), _has_polars)}
+    }
+}
+
+# comparison
+
+def normalize(value):
+    """
+    any output -> plain json-like values: frames become {column: values}, series and arrays lists,
+    numpy scalars python numbers and every dict key a string (whole-number floats without '.0'),
+    so live outputs and outputs read back from the golden file compare the same way
+    """
+    if isinstance(value, pd.DataFrame):
+        return {'columns': [str(col) for col in value.columns], 'rows': len(value),
+                'data': {str(col): normalize(value[col]) for col in value.columns}}
+    if isinstance(value, pd.Series):
+        return {'index': normalize(value.index.tolist()), 'values': normalize(value.tolist())}
+    if isinstance(value, dict):
+        return {_key(key): normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [normalize(item) for item in (value.tolist() if isinstance(value, np.ndarray) else value)]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+def _without(value, keys):
+    # a normalized output minus the named fields at any depth
+    if isinstance(value, dict):
+        return {key: _without(item, keys) for key, item in value.items() if key not in keys}
+    if isinstance(value, list):
+        return [_without(item, keys) for item in value]
+    return value
+
+def _key(key):
+    if isinstance(key, (float, np.floating)) and float(key).is_integer():
+        return str(int(key))
+    return str(normalize(key))
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+def compare(reference, candidate, rtol=default_tolerance['rtol'], atol=default_tolerance['atol'], path=''):
+    """
+    every difference between two normalized outputs as 'path: reference != candidate' lines. numbers
+    match when |a - b| <= atol + rtol * max(|a|, |b|) (ints and floats alike), None and nan are both
+    missing, everything else must be equal
+    """
+    if isinstance(reference, dict) and isinstance(candidate, dict):
+        found = [f"{path}/{key}: missing" for key in reference if key not in candidate]
+        found += [f"{path}/{key}: unexpected" for key in candidate if key not in reference]
+        for key in reference:
+            if key in candidate:
+                found += compare(reference[key], candidate[key], rtol, atol, f"{path}/{key}")
+        return found
+    if isinstance(reference, list) and isinstance(candidate, list):
+        if len(reference) != len(candidate):
+            return [f"{path}: length {len(reference)} != {len(candidate)}"]
+        return [d for idx, (a, b) in enumerate(zip(reference, candidate)) for d in compare(a, b, rtol, atol, f"{path}[{idx}]")]
+    if _is_missing(reference) or _is_missing(candidate):
+        return [] if _is_missing(reference) and _is_missing(candidate) else [f"{path}: {reference!r} != {candidate!r}"]
+    if _is_number(reference) and _is_number(candidate):
+        if math.isinf(reference) or math.isinf(candidate):
+            return [] if reference == candidate else [f"{path}: {reference!r} != {candidate!r}"]
+        close = abs(reference - candidate) <= atol + rtol * max(abs(reference), abs(candidate))
+        return [] if close else [f"{path}: {reference!r} != {candidate!r}"]
+    return [] if reference == candidate else [f"{path}: {reference!r} != {candidate!r}"]
+
+# running
+
+def _timed(setup, inputs, workdir, output, repeat):
+    # quiet runs; the fastest of `repeat` is the time, the last result is the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        func = setup(inputs, workdir)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+    return normalize(output(result)), min(timings)
+
+def prepare_inputs(datasets, workdir, rows=default_rows, seed=0):
+    # the bundled file is processed only (the raw release is not bundled); synthetic data has both layouts
+    prepared = {}
+    if 'bundled' in datasets:
+        prepared['bundled'] = {'processed_csv': bundled_csv, 'raw_csv': None}
+    if 'synthetic' in datasets:
+        prepared[f'synthetic-{rows}-seed{seed}'] = {
+            'processed_csv': write_synthetic(os.path.join(workdir, 'processed.csv'), rows, layout='processed', seed=seed),
+            'raw_csv': write_synthetic(os.path.join(workdir, 'raw.csv'), rows, layout='raw', seed=seed)}
+    return prepared
+
+def run_equivalence(cases=None, datasets=('bundled', 'synthetic'), rows=default_rows, seed=0, repeat=1,
+                    golden=None, tolerance=None):
+    """
+    every case on every dataset: one row for the reference (checked against golden[case@dataset] when
+    given) and one per fast path with its differences and speedup. tolerance overrides the cases' own
+    """
+    cases = list(equivalence_dict) if cases is None else cases
+    rows_out, references = [], {}
+    with tempfile.TemporaryDirectory(prefix='anes_equivalence_') as workdir:
+        for dataset, inputs in prepare_inputs(datasets, workdir, rows, seed).items():
+            for name in cases:
+                case = equivalence_dict[name]
+                key = f"{name}@{dataset}"
+                if inputs[f"{case['needs']}_csv"] is None:
+                    rows_out.append({'case': name, 'dataset': dataset, 'implementation': 'reference',
+                                     'status': f"skipped (needs {case['needs']} input)"})
+                    continue
+                rtol = (tolerance or {}).get('rtol', case.get('rtol', default_tolerance['rtol']))
+                atol = (tolerance or {}).get('atol', case.get('atol', default_tolerance['atol']))
+                output = case.get('output', lambda result: result)
+                try:
+                    expected, seconds = _timed(case['reference'], inputs, workdir, output, repeat)
+                except Exception as e:
+                    rows_out.append({'case': name, 'dataset': dataset, 'implementation': 'reference',
+                                     'status': f'error: {type(e).__name__}: {e}'})
+                    continue
+                references[key] = expected
+                entry = {'case': name, 'dataset': dataset, 'implementation': 'reference', 'seconds': seconds,
+                         'status': 'ok'}
+                if golden is not None:
+                    if key not in golden:
+                        entry['status'] = 'no golden output'
+                    else:
+                        found = compare(golden[key]['output'], _without(expected, case.get('not_in_golden', ())),
+                                        rtol, atol)
+                        entry.update(status='ok' if not found else 'golden mismatch', differences=len(found),
+                                     first_differences=found[:max_reported])
+                rows_out.append(entry)
+
+                for candidate, (setup, available) in case['candidates'].items():
+                    entry = {'case': name, 'dataset': dataset, 'implementation': candidate}
+                    if available is not None and not available():
+                        rows_out.append({**entry, 'status': 'skipped (not installed)'})
+                        continue
+                    try:
+                        actual, candidate_seconds = _timed(setup, inputs, workdir, output, repeat)
+                    except Exception as e:
+                        rows_out.append({**entry, 'status': f'error: {type(e).__name__}: {e}'})
+                        continue
+                    found = compare(expected, actual, rtol, atol)
+                    rows_out.append({**entry, 'status': 'ok' if not found else 'mismatch', 'seconds': candidate_seconds,
+                                     'speedup': seconds / candidate_seconds if candidate_seconds > 0 else None,
+                                     'differences': len(found), 'first_differences': found[:max_reported]})
+    return rows_out, references
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the fast paths against their reference implementations')
+    parser.add_argument('--cases', default=','.join(equivalence_dict))
+    parser.add_argument('--datasets', default='bundled,synthetic', help='bundled and/or synthetic')
+    parser.add_argument('--rows', type=int, default=default_rows, help='synthetic respondents')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--rtol', type=float, default=None, help='relative tolerance for every case')
+    parser.add_argument('--atol', type=float, default=None, help='absolute tolerance for every case')
+    parser.add_argument('--golden', default=default_golden)
+    parser.add_argument('--update-golden', action='store_true', help='pin the current reference outputs')
+    parser.add_argument('--history', default=default_history)
+    args = parser.parse_args(argv)
+
+    tolerance = {key: value for key, value in (('rtol', args.rtol), ('atol', args.atol)) if value is not None}
+    golden = None
+    if os.path.exists(args.golden):
+        with open(args.golden) as f:
+            golden = json.load(f)
+    results, references = run_equivalence(args.cases.split(','), args.datasets.split(','), args.rows, args.seed,
+                                          args.repeat, None if args.update_golden else golden, tolerance)
+
+    run_time = datetime.now().isoformat()
+    with open(args.history, 'a') as f:
+        for result in results:
+            f.write(json.dumps({'time': run_time, **result}) + "\n")
+
+    print(f"{'case':<28}{'dataset':<24}{'implementation':<16}{'seconds':>9}{'speedup':>9}  status")
+    for result in results:
+        seconds = f"{result['seconds']:.3f}" if 'seconds' in result else '-'
+        speedup = f"x{result['speedup']:.1f}" if result.get('speedup') else '-'
+        print(f"{result['case']:<28}{result['dataset']:<24}{result['implementation']:<16}{seconds:>9}{speedup:>9}  "
+              f"{result['status']}")
+        for line in result.get('first_differences', []):
+            print(f"      {line}")
+        if result.get('differences', 0) > max_reported:
+            print(f"      ... {result['differences'] - max_reported} more")
+
+    if args.update_golden:
+        from anes_results import code_version
+        golden = golden or {}
+        version = code_version()
+        for key, output in references.items():
+            golden[key] = {'output': output, 'updated': run_time, 'code_version': version}
+        with open(args.golden, 'w') as f:
+            json.dump(golden, f)
+        print(f"Golden outputs updated: {args.golden} ({len(references)} case(s))")
+
+    failed = [r for r in results if r['status'] in ('mismatch', 'golden mismatch') or r['status'].startswith('error')]
+    if failed:
+        print(f"\n{len(failed)} check(s) failed")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import os
+import math
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from data.schema import schema_dict, kind_of, valid_mask
+from anes_profiling import profiled
+from anes_backend import mp_context
+
+# chained equations with predictive mean matching: every imputed value is an observed answer from a
+# donor with a similar prediction, so codes stay on their scale without a model per item type.
+# imputations are kept as overlays (row positions once, imputed values per draw), never as frame copies
+
+default_m = 5
+default_iterations = 5
+donor_pool = 5
+split_ballot_share = 0.5  # items missing for at least this share were only asked of part of the sample
+
+def default_targets(df):
+    # post-wave items with item nonresponse, leaving out split-ballot items that were not asked
+    base = df[df['weight'].notna()] if 'weight' in df.columns else df
+    return [col for col in df.columns if col in schema_dict and schema_dict[col]['wave'] == 'post'
+            and kind_of(col) not in ('admin', 'design') and 0 < base[col].isna().mean() < split_ballot_share]
+
+def default_predictors(df, targets=()):
+    base = df[df['weight'].notna()] if 'weight' in df.columns else df
+    return [col for col in df.columns if col in schema_dict and schema_dict[col]['wave'] == 'pre'
+            and col not in targets and base[col].isna().mean() < split_ballot_share]
+
+def _design_matrix(frame, predictors):
+    # nominal items become dummies, the rest enter as codes; missing predictors are mean-filled
+    # with an indicator so they never drop a row
+    blocks = [np.ones((len(frame), 1))]
+    for col in predictors:
+        values = frame[col].where(valid_mask(frame[col], col)).to_numpy(dtype=float)
+        missing = np.isnan(values)
+        if kind_of(col) == 'nominal':
+            codes = schema_dict[col]['valid_codes'][1:]
+            blocks.append(np.column_stack([values == code for code in codes]).astype(float))
+        else:
+            fill = np.nanmean(values) if (~missing).any() else 0.0
+            blocks.append(np.where(missing, fill, values)[:, None])
+        if missing.any():
+            blocks.append(missing[:, None].astype(float))
+    return np.hstack(blocks)
+
+def _as_predictor(values, usable):
+    # another target as a predictor: rows it can't speak for (ineligible, sentinel answers) get its mean
+    fill = values[usable].mean() if usable.any() else 0.0
+    return np.where(usable, values, fill)[:, None]
+
+def _wls(X, y, w, ridge=1e-6):
+    xtw = X.T * w
+    return np.linalg.solve(xtw @ X + ridge * np.eye(X.shape[1]), xtw @ y)
+
+def _pmm_draw(X_obs, y_obs, w_obs, X_mis, rng, k=donor_pool):
+    # beta from a bayesian bootstrap of the weights for the missing rows, the point fit for the donors
+    beta_hat = _wls(X_obs, y_obs, w_obs)
+    beta_star = _wls(X_obs, y_obs, w_obs * rng.exponential(1.0, len(w_obs)))
+    pred_obs = X_obs @ beta_hat
+    pred_mis = X_mis @ beta_star
+
+    order = np.argsort(pred_obs, kind='stable')
+    sorted_pred = pred_obs[order]
+    k = min(k, len(sorted_pred))
+    pos = np.searchsorted(sorted_pred, pred_mis)
+    # the k nearest donors sit inside the 2k window around each insertion point
+    window = np.clip(pos[:, None] + np.arange(-k, k)[None, :], 0, len(sorted_pred) - 1)
+    dist = np.abs(sorted_pred[window] - pred_mis[:, None])
+    nearest = np.argsort(dist, axis=1, kind='stable')[:, :k]
+    pick = nearest[np.arange(len(pred_mis)), rng.integers(0, k, len(pred_mis))]
+    return y_obs[order[window[np.arange(len(pred_mis)), pick]]]
+
+@profiled
+def impute_chained(df, targets=None, predictors=None, m=default_m, iterations=default_iterations, k=donor_pool, seed=0):
+    targets = default_targets(df) if targets is None else [col for col in targets if col in df.columns]
+    predictors = default_predictors(df, targets) if predictors is None else [col for col in predictors if col in df.columns]
+    # only item nonresponse inside the weighted sample is filled. respondents without a weight (the -6 'no post
+    # interview' cases) are unit nonresponse, which the post weights already adjust for; imputing their
+    # post-wave answers would count them twice, and the file carries no pre-wave weight to estimate them with
+    eligible = df['weight'].notna().to_numpy() if 'weight' in df.columns else np.ones(len(df), dtype=bool)
+    weights = df['weight'].to_numpy(dtype=float) if 'weight' in df.columns else np.ones(len(df))
+
+    X_base = _design_matrix(df, predictors)
+    # 998/999 thermometer answers are neither imputed nor used as donors
+    observed = {col: valid_mask(df[col], col).to_numpy() & eligible for col in targets}
+    positions = {col: np.flatnonzero(df[col].isna().to_numpy() & eligible) for col in targets}
+    # rows where a target can act as a predictor: observed answers plus its own imputed rows
+    usable = {}
+    for col in targets:
+        usable[col] = observed[col].copy()
+        usable[col][positions[col]] = True
+    values = {col: df[col].to_numpy(dtype=float) for col in targets}
+
+    rng = np.random.default_rng(seed)
+    overlays = []
+    for _ in range(m):
+        current = {col: values[col].copy() for col in targets}
+        for col in targets:
+            donors = current[col][observed[col]]
+            current[col][positions[col]] = rng.choice(donors, size=len(positions[col]))
+        for _ in range(iterations):
+            for col in targets:
+                if not len(positions[col]):
+                    continue
+                others = [_as_predictor(current[other], usable[other])
+                          for other in targets if other != col]
+                X = np.hstack([X_base] + others) if others else X_base
+                obs = observed[col]
+                current[col][positions[col]] = _pmm_draw(X[obs], current[col][obs], weights[obs],
+                                                         X[positions[col]], rng, k)
+        overlays.append({col: current[col][positions[col]].astype((schema_dict[col]['dtype'] or 'float64').lower())
+                         for col in targets})
+
+    return {'targets': targets, 'predictors': predictors, 'positions': positions, 'overlays': overlays,
+            'm': m, 'iterations': iterations, 'unweighted_rows': int((~eligible).sum())}
+
+def complete(df, imputations, i, columns=None):
+    # completed frame for draw i, holding only the requested columns (targets plus design by default)
+    columns = columns or imputations['targets'] + [col for col in ('weight', 'psu', 'stratum') if col in df.columns]
+    frame = {}
+    for col in columns:
+        if col in imputations['overlays'][i]:
+            filled = df[col].to_numpy(dtype=float).copy()
+            filled[imputations['positions'][col]] = imputations['overlays'][i][col]
+            frame[col] = filled
+        else:
+            frame[col] = df[col].to_numpy()
+    return pd.DataFrame(frame, index=df.index)
+
+def rubin_combine(draws):
+    # draws: [(estimate, se)], returns pooled estimate, total se, degrees of freedom and fraction of missing info
+    q = np.array([d[0] for d in draws], dtype=float)
+    u = np.array([d[1] ** 2 if d[1] is not None else np.nan for d in draws], dtype=float)
+    m = len(q)
+    q_bar, u_bar = q.mean(), np.nanmean(u) if not np.isnan(u).all() else np.nan
+    b = q.var(ddof=1) if m > 1 else 0.0
+    t = u_bar + (1 + 1 / m) * b
+    if np.isnan(t):
+        return {'estimate': float(q_bar), 'se': None, 'df': None, 'fmi': None, 'between_var': float(b)}
+    r = (1 + 1 / m) * b / u_bar if u_bar > 0 else math.inf
+    dof = (m - 1) * (1 + 1 / r) ** 2 if r > 0 else math.inf
+    return {'estimate': float(q_bar), 'se': float(math.sqrt(t)), 'df': None if math.isinf(dof) else float(dof),
+            'fmi': float((1 + 1 / m) * b / t) if t > 0 else 0.0, 'between_var': float(b)}
+
+_worker_state = {}
+
+def _init_worker(df, imputations):
+    # forked workers inherit the base frame for free, spawned ones get it pickled once;
+    # after that only the draw index crosses the process boundary
+    _worker_state['df'] = df
+    _worker_state['imputations'] = imputations
+
+def _estimate_draw(i):
+    from anes_statistics import samplics_analysis
+    return samplics_analysis(complete(_worker_state['df'], _worker_state['imputations'], i))
+
+def _pool(draw_results):
+    pooled = {}
+    for var in draw_results[0]:
+        per_draw = [results.get(var) for results in draw_results]
+        if any(entry is None for entry in per_draw):
+            continue
+        first = per_draw[0]
+        if first['type'] == 'continuous':
+            combined = rubin_combine([(entry['mean'], entry['se']) for entry in per_draw])
+            pooled[var] = {'type': 'continuous', 'mean': combined['estimate'], 'se': combined['se'],
+                           'df': combined['df'], 'fmi': combined['fmi'], 'n': first['n'], 'm': len(per_draw)}
+        else:
+            categories = {}
+            for cat in first['categories']:
+                if all(cat in entry['categories'] for entry in per_draw):
+                    combined = rubin_combine([(entry['categories'][cat]['proportion'], entry['categories'][cat]['se'])
+                                              for entry in per_draw])
+                    categories[cat] = {'proportion': combined['estimate'], 'se': combined['se'],
+                                       'df': combined['df'], 'fmi': combined['fmi']}
+            pooled[var] = {'type': 'categorical', 'categories': categories, 'n': first['n'], 'm': len(per_draw)}
+    return pooled
+
+@profiled
+def estimate_imputed(df, imputations, processes=None):
+    # samplics_analysis on every completed dataset in a process pool, pooled with rubin's rules
+    m = imputations['m']
+    processes = processes or min(m, os.cpu_count() or 1)
+    if processes == 1:
+        _init_worker(df, imputations)
+        return _pool([_estimate_draw(i) for i in range(m)])
+    import samplics.estimation  # noqa: F401  import once in the parent so forked workers share it
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context(),
+                             initializer=_init_worker, initargs=(df, imputations)) as pool:
+        draw_results = list(pool.map(_estimate_draw, range(m)))
+    return _pool(draw_results)
@@ -0,0 +1,138 @@
+import os
+import importlib.util
+import numpy as np
+import pandas as pd
+from data.dicts import ans_dict
+from data.schema import schema_dict, get_spec, is_range, valid_mask
+from anes_backend import weighted_frequencies
+
+# value labels come from ans_dict through the schema; range items (thermometers, age) stay numeric
+
+# frequency tables bin range items by lower edge (the last edge is one past the top value)
+therm_table_bins = list(range(0, 100, 10)) + [101]
+table_bin_dict = {
+    'trans_therm': therm_table_bins,
+    'gay_therm': therm_table_bins,
+    'resp_age': [18, 25, 35, 45, 55, 65, 75, 81]
+}
+
+def value_labels(col):
+    return get_spec(col)['labels']
+
+def value_label(col, value):
+    # one code -> its label ('Don't know rating' style sentinels included), 'Value n' for codes the codebook doesn't name
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    code = int(value) if float(value).is_integer() else value
+    if code in get_spec(col)['sentinels']:
+        return ans_dict[col][code]
+    return value_labels(col).get(code, f'Value {code}')
+
+def _bin_label(col, low):
+    # '20-29'; the top bin reads '75+' when the top value is itself 'or older'
+    edges = table_bin_dict[col]
+    high = edges[edges.index(low) + 1] - 1
+    if high == get_spec(col)['valid_max'] and high in value_labels(col):
+        return f'{low}+'
+    return f'{low}-{high}'
+
+def _binned_ranges(df, columns):
+    # range items -> lower edge of their table bin; sentinels and anything off the bins keep their code
+    range_cols = [col for col in columns if col in df.columns and col in table_bin_dict and is_range(col)]
+    if not range_cols:
+        return df
+    frame = df[[col for col in columns if col in df.columns] + [col for col in ('weight',) if col in df.columns]]
+    binned = {}
+    for col in range_cols:
+        edges = np.asarray(table_bin_dict[col], dtype=float)
+        values = frame[col].to_numpy(dtype=float, na_value=np.nan)
+        inside = valid_mask(frame[col], col).to_numpy(dtype=bool, na_value=False) & (values >= edges[0]) & (values < edges[-1])
+        lows = edges[np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)]
+        binned[col] = np.where(inside, lows, values)
+    return frame.assign(**binned)
+
+def is_labeled(col):
+    spec = schema_dict.get(col)
+    return bool(spec and spec['labels'] and spec['kind'] in ('binary', 'ordinal', 'nominal'))
+
+def label_series(series, col=None):
+    # codes -> ordered Categorical in one step; codes without a label become nan
+    col = col or series.name
+    if not is_labeled(col):
+        return series
+    labels = value_labels(col)
+    codes = sorted(labels)
+    values = pd.to_numeric(series, errors='coerce')
+    categorical = pd.Categorical(values, categories=[float(code) for code in codes],
+                                 ordered=get_spec(col)['kind'] == 'ordinal')
+    return pd.Series(categorical.rename_categories([labels[code] for code in codes]), index=series.index, name=series.name)
+
+def label_frame(df, columns=None):
+    columns = [col for col in (columns or df.columns) if col in df.columns]
+    labeled = df.copy()
+    for col in columns:
+        if is_labeled(col):
+            labeled[col] = label_series(df[col], col)
+    return labeled
+
+def frequency_tables(df, columns, backend=None):
+    """
+    every item's labelled frequency table from one grouped pass, long format. range items come in
+    table_bin_dict bins; sentinel codes (998 "don't know rating") keep a labelled row with their counts
+    but no percentage, which is out of the valid responses only
+    """
+    table = weighted_frequencies(_binned_ranges(df, columns), columns, backend=backend)
+    binned = table['question'].isin([col for col in columns if col in table_bin_dict and is_range(col)])
+    sentinel = np.array([value in get_spec(col)['sentinels'] for col, value in zip(table['question'], table['value'])],
+                        dtype=bool)
+    binned &= ~sentinel & table['value'].isin([float(edge) for edges in table_bin_dict.values() for edge in edges])
+    table.insert(2, 'label', [_bin_label(col, int(value)) if is_bin else value_label(col, value)
+                              for col, value, is_bin in zip(table['question'], table['value'], binned)])
+    counted = table['n'].where(~sentinel)
+    table['percentage'] = counted / counted.groupby(table['question'], sort=False).transform('sum') * 100
+    weighted = table['weighted_n'].where((table['n_weighted'] > 0) & ~sentinel)
+    table['weighted_percentage'] = weighted / weighted.groupby(table['question'], sort=False).transform('sum') * 100
+    table['value'] = [int(v) if float(v).is_integer() else v for v in table['value']]
+    return table.drop(columns='n_weighted')
+
+def _markdown_table(frame):
+    header = '| ' + ' | '.join(frame.columns) + ' |'
+    rule = '|' + '|'.join('---:' if pd.api.types.is_numeric_dtype(frame[col]) else '---' for col in frame.columns) + '|'
+    rows = ['| ' + ' | '.join(('' if np.isnan(v) else f'{v:.2f}') if isinstance(v, float) else str(v) for v in row) + ' |'
+            for row in frame.itertuples(index=False)]
+    return '\n'.join([header, rule] + rows)
+
+def _excel_engine():
+    for engine in ('openpyxl', 'xlsxwriter'):
+        if importlib.util.find_spec(engine):
+            return engine
+    return None
+
+def export_frequency_tables(df, columns, output_stem='anes_frequencies', formats=('csv', 'md', 'xlsx'), backend=None):
+    # tables are built once and written to every format: one long csv, one markdown file with a
+    # section per item, one workbook with a sheet per item
+    table = frequency_tables(df, columns, backend=backend)
+    output_dir = os.path.dirname(output_stem)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    saved = []
+    for fmt in formats:
+        path = f'{output_stem}.{fmt}'
+        if fmt == 'csv':
+            table.to_csv(path, index=False)
+        elif fmt == 'md':
+            with open(path, 'w') as f:
+                for question, group in table.groupby('question', sort=False):
+                    f.write(f'## {question}\n\n{_markdown_table(group.drop(columns="question"))}\n\n')
+        elif fmt == 'xlsx':
+            engine = _excel_engine()
+            if engine is None:
+                print(f"Skipping {path}: writing xlsx needs openpyxl or xlsxwriter installed")
+                continue
+            with pd.ExcelWriter(path, engine=engine) as writer:
+                for question, group in table.groupby('question', sort=False):
+                    group.drop(columns='question').to_excel(writer, sheet_name=question[:31], index=False)
+        else:
+            raise ValueError(f"Unknown table format '{fmt}', expected csv, md or xlsx")
+        saved.append(path)
+    return saved
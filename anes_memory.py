@@ -0,0 +1,96 @@
+import os
+import numpy as np
+from anes_profiling import write_record
+
+# memory budget for a run: stages estimate their footprint up front and switch to a chunked variant
+# when the in-memory one would not fit. every choice goes to the run log as a 'memory_plan' record.
+# set ANES_MEMORY_BUDGET=2G (or call set_memory_budget / pass --memory-budget) to turn it on
+
+_state = {"budget": None}
+size_units = {'': 1, 'b': 1, 'k': 1 << 10, 'kb': 1 << 10, 'm': 1 << 20, 'mb': 1 << 20, 'g': 1 << 30, 'gb': 1 << 30}
+min_chunk_rows = 10_000
+float_bytes = 8
+
+def parse_size(text):
+    # '512M', '2g', '1.5GB' or plain bytes -> bytes
+    if text is None or isinstance(text, (int, float)):
+        return text
+    value = text.strip().lower()
+    number = value.rstrip('bkmg')
+    unit = value[len(number):]
+    if unit not in size_units or not number:
+        raise ValueError(f"Cannot read memory size '{text}', expected e.g. 512M or 2G")
+    return int(float(number) * size_units[unit])
+
+def set_memory_budget(budget):
+    _state["budget"] = parse_size(budget)
+    return _state["budget"]
+
+def memory_budget():
+    # explicit setting > ANES_MEMORY_BUDGET env var > no budget
+    if _state["budget"] is not None:
+        return _state["budget"]
+    return parse_size(os.environ.get('ANES_MEMORY_BUDGET') or None)
+
+def estimate_csv_rows(path, sample_lines=2000):
+    # file size over the mean length of the first lines; good enough to plan with
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        lines = [len(line) for _, line in zip(range(sample_lines), f)]
+    return int(size / (sum(lines) / len(lines))) if lines else 0
+
+def plan(name, rows, bytes_per_row, fixed_bytes=0, budget=None):
+    """
+    in-memory or chunked for one stage: the whole thing takes fixed + rows * bytes_per_row; chunked runs
+    take chunks of as many rows as fit in what the budget leaves after the fixed part
+    """
+    budget = memory_budget() if budget is None else budget
+    estimate = fixed_bytes + rows * bytes_per_row
+    decision = {"strategy": "in_memory", "chunk_rows": None, "rows": int(rows),
+                "estimate_mb": round(estimate / (1 << 20), 1),
+                "budget_mb": None if budget is None else round(budget / (1 << 20), 1)}
+    if budget is not None and estimate > budget:
+        room = max(budget - fixed_bytes, 0)
+        decision.update(strategy="chunked", chunk_rows=int(max(min_chunk_rows, room // max(bytes_per_row, 1))))
+    if budget is not None:
+        write_record({"event": "memory_plan", "name": name, **decision})
+    return decision
+
+def chunk_slices(n, chunk_rows=None):
+    chunk_rows = chunk_rows or max(n, 1)
+    return [slice(start, min(start + chunk_rows, n)) for start in range(0, n, chunk_rows)]
+
+def _float_chunk(values, part):
+    # one chunk as float64 with nan for missing, whether values is a Series (nullable ints too) or an array
+    if hasattr(values, 'iloc'):
+        return values.iloc[part].to_numpy(dtype=float, na_value=np.nan)
+    return np.asarray(values[part], dtype=float)
+
+def weighted_moments(values, weights, chunk_rows=None, valid_range=None):
+    """
+    count, total weight, weighted mean and weighted (population) variance over the rows where both are
+    present (and the value is inside valid_range), one chunk at a time; chunks merge with the parallel
+    (chan) update so no full-length copy is made
+    """
+    count, total, mean, m2 = 0, 0.0, 0.0, 0.0
+    for part in chunk_slices(len(values), chunk_rows):
+        x, w = _float_chunk(values, part), _float_chunk(weights, part)
+        keep = ~(np.isnan(x) | np.isnan(w))
+        if valid_range is not None:
+            keep &= (x >= valid_range[0]) & (x <= valid_range[1])
+        x, w = x[keep], w[keep]
+        chunk_total = w.sum()
+        count += len(x)
+        if chunk_total <= 0:
+            continue
+        chunk_mean = np.dot(w, x) / chunk_total
+        chunk_m2 = np.dot(w, (x - chunk_mean) ** 2)
+        delta = chunk_mean - mean
+        combined = total + chunk_total
+        mean += delta * chunk_total / combined
+        m2 += chunk_m2 + delta ** 2 * total * chunk_total / combined
+        total = combined
+    if total <= 0:
+        return count, 0.0, np.nan, np.nan
+    return count, total, mean, m2 / total
@@ -0,0 +1,355 @@
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.special import expit
+from scipy.stats import norm
+from anes_profiling import profiled
+from data.schema import kind_of, schema_dict, valid_mask
+from anes_bitmaps import as_mask
+from anes_memory import plan, chunk_slices, float_bytes
+from anes_design_effects import design_codes
+
+# survey-weighted proportional-odds (cumulative logit) models, P(y <= k | x) = logistic(threshold_k - x'b),
+# for the ordered policy items. items with the same number of categories are fitted together: one batched
+# newton step updates every item's thresholds and slopes over the shared covariate matrix. ses are
+# taylor-linearized (sandwich) from psu totals of the score, with the same strata/psu codes as design_effects
+
+default_items = ['trans_military', 'trans_bathroom', 'trans_sports_pre', 'trans_sports_post',
+                 'gay_marriage', 'gay_adoption']
+default_covariates = ['resp_partyid', 'resp_age', 'resp_edu', 'resp_race']
+max_iterations = 50
+default_tol = 1e-8  # change in log-likelihood (relative) or largest step that counts as converged
+max_halvings = 30
+
+def covariate_matrix(df, covariates):
+    """
+    the shared model matrix (no intercept, the thresholds take its place): nominal covariates become
+    dummies against their first code, the rest enter as codes. only the schema's valid codes count, so
+    off-scale answers (resp_edu 95 'Other') are missing rather than the top of the scale. returns the
+    matrix, column names and the rows with every covariate answered
+    """
+    blocks, names = [], []
+    complete = np.ones(len(df), dtype=bool)
+    for col in covariates:
+        values = _valid_values(df, col)
+        complete &= ~np.isnan(values)
+        if kind_of(col) == 'nominal':
+            for code in schema_dict[col]['valid_codes'][1:]:
+                blocks.append(values == code)
+                names.append(f"{col}={code}")
+        else:
+            blocks.append(values)
+            names.append(col)
+    X = np.column_stack(blocks).astype(float) if blocks else np.zeros((len(df), 0))
+    return np.where(complete[:, None], X, 0.0), names, complete
+
+def _valid_values(df, col):
+    # float values with nan for missing, out-of-range and (for coded columns) codes outside valid_codes
+    values = df[col].where(valid_mask(df[col], col)).to_numpy(dtype=float, na_value=np.nan)
+    valid_codes = schema_dict[col]['valid_codes'] if col in schema_dict else None
+    if valid_codes:
+        values = np.where(np.isin(values, valid_codes), values, np.nan)
+    return values
+
+def _outcomes(df, items, usable):
+    # each item's answers as 0..K-1 over the codes it actually has, -1 where it can't be used
+    codes, categories = {}, {}
+    for item in items:
+        values = _valid_values(df, item)
+        answered = usable & ~np.isnan(values)
+        categories[item] = np.unique(values[answered])
+        codes[item] = np.where(answered, np.searchsorted(categories[item], np.nan_to_num(values)), -1)
+    return codes, categories
+
+def _parts(params, y, X):
+    # per row and item: log p(y), the two cut-point arguments' derivatives and the design rows A (upper
+    # cut) and B (lower cut); shapes (items, rows) and (items, rows, params)
+    n_items, n_cuts = y.shape[0], params.shape[1] - X.shape[1]
+    theta, beta = params[:, :n_cuts], params[:, n_cuts:]
+    cuts = np.concatenate([np.full((n_items, 1), -np.inf), theta, np.full((n_items, 1), np.inf)], axis=1)
+    eta = beta @ X.T
+    yc = np.maximum(y, 0)
+    Fu = expit(np.take_along_axis(cuts, yc + 1, axis=1) - eta)
+    Fl = expit(np.take_along_axis(cuts, yc, axis=1) - eta)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = Fu - Fl
+        logp = np.log(p)
+    fu, fl = Fu * (1 - Fu), Fl * (1 - Fl)
+    return {'logp': logp, 'p': p, 'Fu': Fu, 'Fl': Fl, 'fu': fu, 'fl': fl}, yc, n_cuts
+
+def _loglik(params, y, X, w):
+    parts, _, _ = _parts(params, y, X)
+    # rows outside an item's model carry no weight, whatever their (dummy) category
+    return np.where(w > 0, w * parts['logp'], 0.0).sum(axis=1)
+
+def _derivatives(params, y, X, w, with_scores=False):
+    parts, yc, n_cuts = _parts(params, y, X)
+    p, fu, fl = parts['p'], parts['fu'], parts['fl']
+    fpu, fpl = fu * (1 - 2 * parts['Fu']), fl * (1 - 2 * parts['Fl'])
+    safe = np.where(w > 0, p, 1.0)
+    da, db = fu / safe, -fl / safe
+    d2a, d2b, dab = fpu / safe - da ** 2, -fpl / safe - db ** 2, -da * db
+    # d upper / d theta_j = [y == j], d lower / d theta_j = [y - 1 == j], both move with -x
+    cut = np.arange(n_cuts)
+    minus_x = np.broadcast_to(-X, (y.shape[0],) + X.shape)
+    A = np.concatenate([(yc[..., None] == cut).astype(float), minus_x], axis=2)
+    B = np.concatenate([(yc[..., None] - 1 == cut).astype(float), minus_x], axis=2)
+    ll = np.where(w > 0, w * parts['logp'], 0.0).sum(axis=1)
+    # batched matmuls (blas) rather than einsum for the (items, params, params) products
+    At, Bt = A.transpose(0, 2, 1), B.transpose(0, 2, 1)
+    grad = (At @ (w * da)[..., None] + Bt @ (w * db)[..., None])[..., 0]
+    cross = (At * (w * dab)[:, None, :]) @ B
+    hess = (At * (w * d2a)[:, None, :]) @ A + (Bt * (w * d2b)[:, None, :]) @ B + cross + cross.transpose(0, 2, 1)
+    scores = (w * da)[..., None] * A + (w * db)[..., None] * B if with_scores else None
+    return ll, grad, hess, scores
+
+def _start(y, w, n_cuts, n_covariates):
+    # thresholds at the weighted marginal cumulative logits, slopes at zero
+    shares = np.stack([np.bincount(np.maximum(row, 0), weights=wt, minlength=n_cuts + 1) for row, wt in zip(y, w)])
+    cumulative = np.clip(np.cumsum(shares, axis=1)[:, :-1] / shares.sum(axis=1, keepdims=True), 1e-6, 1 - 1e-6)
+    return np.concatenate([np.log(cumulative / (1 - cumulative)), np.zeros((len(y), n_covariates))], axis=1)
+
+def _summed(func, blocks, params, y, X, w):
+    # log-likelihood, gradient and hessian are sums over rows, so row blocks just add up
+    total = None
+    for block in blocks:
+        part = func(params, y[:, block], X[block], w[:, block])
+        total = part if total is None else total + part if isinstance(part, np.ndarray) else tuple(
+            None if b is None else a + b for a, b in zip(total, part))
+    return total
+
+def _newton(y, X, w, blocks, tol=default_tol):
+    """
+    batched newton-raphson on the weighted pseudo log-likelihood of every item in y at once; each item
+    halves its own step until its log-likelihood does not drop and its thresholds stay ordered
+    """
+    n_items, n_cuts = y.shape[0], int(y.max()) if y.size else 0
+    params = _start(y, w, n_cuts, X.shape[1])
+    ll = _summed(_loglik, blocks, params, y, X, w)
+    converged = np.zeros(n_items, dtype=bool)
+    iterations = np.zeros(n_items, dtype=int)
+    for iteration in range(1, max_iterations + 1):
+        _, grad, hess, _ = _summed(_derivatives, blocks, params, y, X, w)
+        try:
+            step = np.linalg.solve(-hess, grad[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(-h, g, rcond=None)[0] for h, g in zip(hess, grad)])
+        step[converged] = 0.0
+        size = np.ones(n_items)
+        for _ in range(max_halvings):
+            trial = params + size[:, None] * step
+            trial_ll = _summed(_loglik, blocks, trial, y, X, w)
+            ordered = (np.diff(trial[:, :n_cuts], axis=1) > 0).all(axis=1)
+            ok = ordered & np.isfinite(trial_ll) & (trial_ll >= ll - 1e-10 * np.abs(ll))
+            if ok.all():
+                break
+            size = np.where(ok, size, size / 2)
+        trial = np.where(ok[:, None], trial, params)
+        trial_ll = np.where(ok, trial_ll, ll)
+        moved = np.abs(trial - params).max(axis=1)
+        iterations = np.where(converged, iterations, iteration)
+        converged |= (np.abs(trial_ll - ll) <= tol * (1 + np.abs(ll))) & (moved <= np.sqrt(tol))
+        params, ll = trial, trial_ll
+        if converged.all():
+            break
+    return params, ll, iterations, converged
+
+def _sandwich(params, y, X, w, blocks, codes, stratum_of_psu):
+    # bread: the inverse (negative) hessian; meat: between-psu variance of the psu score totals within
+    # strata, n_h / (n_h - 1) scaled, over the psus where the item has respondents (single-psu strata skipped)
+    n_items, n_params = params.shape
+    n_psus = len(stratum_of_psu)
+    totals = np.zeros((n_psus, n_items * n_params))
+    present = np.zeros((n_psus, n_items))
+    hess = np.zeros((n_items, n_params, n_params))
+    for block in blocks:
+        _, _, part_hess, scores = _derivatives(params, y[:, block], X[block], w[:, block], with_scores=True)
+        hess += part_hess
+        block_codes = codes[block]
+        keep = np.flatnonzero(block_codes >= 0)
+        by_psu = sparse.csr_matrix((np.ones(len(keep)), (block_codes[keep], keep)), shape=(n_psus, len(block_codes)))
+        totals += by_psu @ scores.transpose(1, 0, 2).reshape(len(block_codes), -1)
+        present += by_psu @ (w[:, block] > 0).T.astype(float)
+    present = present > 0
+    totals = totals.reshape(n_psus, n_items, n_params) * present[..., None]
+    strata = sparse.csr_matrix((np.ones(n_psus), (stratum_of_psu, np.arange(n_psus))))
+    n_h = strata @ present.astype(float)
+    sums = (strata @ totals.reshape(n_psus, -1)).reshape(-1, n_items, n_params)
+    outer = (strata @ np.einsum('gmp,gmq->gmpq', totals, totals).reshape(n_psus, -1)).reshape(-1, n_items, n_params, n_params)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(n_h > 1, n_h / (n_h - 1), 0.0)
+        centred = outer - np.einsum('hmp,hmq->hmpq', sums, sums) / np.where(n_h > 0, n_h, 1.0)[..., None, None]
+    meat = (scale[..., None, None] * centred).sum(axis=0)
+    bread = np.linalg.pinv(-hess)
+    return bread @ meat @ bread
+
+@profiled
+def fit_ordinal(df, items=None, covariates=None, tol=default_tol):
+    """
+    one proportional-odds model per item over the same covariates, on respondents with a weight, a
+    design and every covariate. returns {item: model}; each model keeps its categories, parameter names,
+    estimates, sandwich covariance, log-likelihood and convergence so predictions need only the model
+    """
+    items = [item for item in (default_items if items is None else items) if item in df.columns]
+    covariates = [col for col in (default_covariates if covariates is None else covariates) if col in df.columns]
+    weights, codes, stratum_of_psu = design_codes(df)
+    X, names, complete = covariate_matrix(df, covariates)
+    usable = complete & (codes >= 0) & (weights > 0)
+    # dummies for codes nobody usable has would make the hessian singular
+    keep = [j for j in range(X.shape[1]) if np.ptp(X[usable, j]) > 0] if usable.any() else []
+    X, names = X[:, keep], [names[j] for j in keep]
+    y_codes, categories = _outcomes(df, items, usable)
+
+    models = {}
+    by_size = {}
+    for item in items:
+        if len(categories[item]) >= 2:
+            by_size.setdefault(len(categories[item]), []).append(item)
+    for size, group in by_size.items():
+        y = np.stack([y_codes[item] for item in group])
+        w = np.where(y >= 0, weights, 0.0)
+        # the batch holds a few (items, rows, params) arrays; over the memory budget rows go in blocks
+        decision = plan('fit_ordinal', len(df), 6 * float_bytes * len(group) * (size - 1 + X.shape[1]))
+        blocks = chunk_slices(len(df), decision['chunk_rows'])
+        params, ll, iterations, converged = _newton(y, X, w, blocks, tol)
+        cov = _sandwich(params, y, X, w, blocks, codes, stratum_of_psu)
+        for idx, item in enumerate(group):
+            labels = [f"{_code(a)}|{_code(b)}" for a, b in zip(categories[item][:-1], categories[item][1:])]
+            models[item] = {
+                'item': item, 'categories': categories[item], 'covariates': covariates,
+                'names': labels + names, 'n_thresholds': size - 1, 'params': params[idx], 'cov': cov[idx],
+                'n': int((y[idx] >= 0).sum()), 'weighted_n': float(w[idx].sum()), 'loglik': float(ll[idx]),
+                'iterations': int(iterations[idx]), 'converged': bool(converged[idx])
+            }
+    return {item: models[item] for item in items if item in models}
+
+def _code(value):
+    return int(value) if float(value).is_integer() else float(value)
+
+def coefficient_table(models):
+    # one row per item and parameter: estimate, design se, z, p and (slopes) the cumulative odds ratio
+    rows = []
+    for item, model in models.items():
+        se = np.sqrt(np.maximum(np.diag(model['cov']), 0.0))
+        for j, (name, estimate) in enumerate(zip(model['names'], model['params'])):
+            z = estimate / se[j] if se[j] > 0 else np.nan
+            slope = j >= model['n_thresholds']
+            rows.append({'item': item, 'term': name, 'kind': 'slope' if slope else 'threshold', 'estimate': estimate,
+                         'se': se[j], 'z': z, 'p': 2 * norm.sf(abs(z)) if np.isfinite(z) else np.nan,
+                         'odds_ratio': np.exp(estimate) if slope else np.nan})
+    return pd.DataFrame(rows)
+
+def _probabilities(models, X):
+    # every item's category probabilities for the rows of X, items with equal category counts in one
+    # broadcast: {item: (rows, categories)}
+    by_size = {}
+    for item, model in models.items():
+        by_size.setdefault(model['n_thresholds'], []).append(item)
+    out = {}
+    for n_cuts, group in by_size.items():
+        params = np.stack([models[item]['params'] for item in group])
+        eta = params[:, n_cuts:] @ X.T
+        cumulative = expit(params[:, None, :n_cuts] - eta[..., None])
+        padded = np.concatenate([np.zeros(cumulative.shape[:2] + (1,)), cumulative,
+                                 np.ones(cumulative.shape[:2] + (1,))], axis=2)
+        for idx, item in enumerate(group):
+            out[item] = np.diff(padded[idx], axis=1)
+    return out
+
+def _model_matrix(models, df):
+    # df's covariates laid out like the fitted models' columns (every model shares them)
+    model = next(iter(models.values()))
+    X, names, complete = covariate_matrix(df, model['covariates'])
+    slope_names = model['names'][model['n_thresholds']:]
+    return X[:, [names.index(name) for name in slope_names]], complete
+
+def predict_probabilities(models, profiles):
+    """
+    category probabilities for covariate profiles (a frame with the covariate columns, one row per
+    profile), all items and profiles in one batch. long frame: item, profile, category, probability
+    """
+    X, complete = _model_matrix(models, profiles)
+    rows = []
+    for item, probs in _probabilities(models, X).items():
+        for profile in np.flatnonzero(complete):
+            for category, probability in zip(models[item]['categories'], probs[profile]):
+                rows.append({'item': item, 'profile': profiles.index[profile], 'category': _code(category),
+                             'probability': probability})
+    return pd.DataFrame(rows)
+
+@profiled
+def subgroup_probabilities(models, df, domains):
+    """
+    weighted average predicted category probabilities within each subgroup ({label: selection}, None for
+    everyone) over the respondents with every covariate: one (rows x domains) weight matrix applied to every
+    item's predicted probabilities at once. long frame: item, domain, category, probability
+    """
+    X, complete = _model_matrix(models, df)
+    weights = df['weight'].to_numpy(dtype=float, na_value=np.nan) if 'weight' in df.columns else np.ones(len(df))
+    weights = np.where(complete & ~np.isnan(weights), weights, 0.0)
+    labels = list(domains)
+    D = np.column_stack([weights * (np.ones(len(df), dtype=bool) if domains[label] is None
+                                    else as_mask(domains[label], df).to_numpy(dtype=bool)) for label in labels])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        D = D / D.sum(axis=0)
+    rows = []
+    for item, probs in _probabilities(models, X).items():
+        averaged = D.T @ probs
+        for d, label in enumerate(labels):
+            for category, probability in zip(models[item]['categories'], averaged[d]):
+                rows.append({'item': item, 'domain': label, 'category': _code(category), 'probability': probability})
+    return pd.DataFrame(rows)
+
+def main(argv=None):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    from anes_design_effects import facet_domains
+    from anes_bitmaps import BitmapIndex, selection_label
+    parser = argparse.ArgumentParser(description='Survey-weighted proportional-odds models for the ordered items')
+    parser.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    parser.add_argument('--items', default=','.join(default_items))
+    parser.add_argument('--covariates', default=','.join(default_covariates))
+    parser.add_argument('--facets', default=None, help='comma separated columns; predicted shares for every value')
+    parser.add_argument('--where', action='append', default=[], help='a subgroup as a where-expression (repeatable)')
+    parser.add_argument('--output', default='anes_ordinal_coefficients.csv')
+    parser.add_argument('--predictions', default='anes_ordinal_predictions.csv')
+    parser.add_argument('--json', default='anes_ordinal.json')
+    args = parser.parse_args(argv)
+
+    df, _ = load_and_prepare_data(args.csv, var_dict)
+    models = fit_ordinal(df, args.items.split(','), args.covariates.split(','))
+    table = coefficient_table(models)
+    table.to_csv(args.output, index=False)
+
+    domains = {'all': None}
+    index = BitmapIndex(df, columns=[]) if args.where else None
+    for text in args.where:
+        selection = index.select(text)
+        domains[selection_label(selection)] = selection
+    for col in (args.facets.split(',') if args.facets else []):
+        domains.update(facet_domains(df, col))
+    predictions = subgroup_probabilities(models, df, domains) if models else pd.DataFrame()
+    predictions.to_csv(args.predictions, index=False)
+    with open(args.json, 'w') as f:
+        json.dump({item: {'n': model['n'], 'weighted_n': model['weighted_n'], 'loglik': model['loglik'],
+                          'iterations': model['iterations'], 'converged': model['converged'],
+                          'categories': [_code(c) for c in model['categories']]} for item, model in models.items()},
+                  f, indent=2)
+
+    for item in args.items.split(','):
+        if item not in models:
+            print(f"{item}: skipped (no respondents with a design and every covariate, or one category)")
+    for item, model in models.items():
+        print(f"{item}: n {model['n']:,}, {len(model['categories'])} categories, log-likelihood {model['loglik']:.1f}, "
+              f"{model['iterations']} iterations{'' if model['converged'] else ' (not converged)'}")
+        slopes = table[(table['item'] == item) & (table['kind'] == 'slope')]
+        for row in slopes.itertuples():
+            print(f"  {row.term:<18}{row.estimate:>9.3f}{row.se:>8.3f}  OR {row.odds_ratio:>6.2f}  p {row.p:.3f}")
+    print(f"Saved: {args.output}, {args.predictions}, {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import os
+import ast
+import hashlib
+import inspect
+import pickle
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from anes_profiling import profile_stage, write_record
+from anes_results import file_fingerprint
+from anes_memory import set_memory_budget, memory_budget as current_budget
+
+# stage functions import their heavy modules lazily so cached runs stay cheap
+def _load_stage(csv_file_path):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    df, column_mapping = load_and_prepare_data(csv_file_path, var_dict)
+    return {"df": df}
+
+def _columns_stage(df):
+    from data.dicts import theme_dict
+    from anes_statistics import basic_descriptive_stats
+    trans_cols, gay_cols, demo_cols = basic_descriptive_stats(df, theme_dict)
+    return {"trans_cols": trans_cols, "gay_cols": gay_cols, "demo_cols": demo_cols}
+
+def _estimates_stage(df):
+    from anes_statistics import samplics_analysis
+    return {"samplics_results": samplics_analysis(df)}
+
+def _descriptives_stage(df, trans_cols, gay_cols, json_file):
+    from anes_descriptives import generate_descriptive_json
+    descriptive_stats = generate_descriptive_json(df, trans_cols=trans_cols, gay_cols=gay_cols, output_file=json_file)
+    return {"descriptive_stats": descriptive_stats, "json_files": [json_file] if json_file else []}
+
+def _figures_stage(df, trans_cols, gay_cols, exports):
+    from anes_visualizations import order_visualizations, get_exports
+    order_visualizations(df, trans_cols, gay_cols, exports=exports)
+    figure_files = []
+    for stem, cols in [("transgender_questions_distribution", trans_cols), ("gay_lgb_questions_distribution", gay_cols)]:
+        if cols:
+            figure_files += [f"{stem}{spec['suffix']}.{spec['format']}" for spec in get_exports(exports)]
+    return {"figure_files": figure_files}
+
+# inputs/outputs are name -> type; 'files' names outputs that list files the stage writes,
+# 'main_thread' keeps pyplot work off the worker threads
+stage_dict = {
+    "load": {
+        "func": _load_stage,
+        "inputs": {"csv_file_path": str},
+        "outputs": {"df": pd.DataFrame}
+    },
+    "columns": {
+        "func": _columns_stage,
+        "inputs": {"df": pd.DataFrame},
+        "outputs": {"trans_cols": list, "gay_cols": list, "demo_cols": list}
+    },
+    "estimates": {
+        "func": _estimates_stage,
+        "inputs": {"df": pd.DataFrame},
+        "outputs": {"samplics_results": dict}
+    },
+    "descriptives": {
+        "func": _descriptives_stage,
+        "inputs": {"df": pd.DataFrame, "trans_cols": list, "gay_cols": list, "json_file": (str, type(None))},
+        "outputs": {"descriptive_stats": dict, "json_files": list},
+        "files": ["json_files"]
+    },
+    "figures": {
+        "func": _figures_stage,
+        "inputs": {"df": pd.DataFrame, "trans_cols": list, "gay_cols": list, "exports": (list, str, type(None))},
+        "outputs": {"figure_files": list},
+        "files": ["figure_files"],
+        "main_thread": True
+    }
+}
+
+def _hash_value(name, value):
+    # '*_path' parameters are input files and fingerprinted by content, everything else by its repr
+    if name.endswith('_path') and isinstance(value, str) and os.path.isfile(value):
+        return file_fingerprint(value)
+    return hashlib.sha256(repr(value).encode()).hexdigest()
+
+_repo_root = os.path.dirname(os.path.abspath(__file__))
+_module_hashes = {}
+
+def _local_imports(source):
+    # names of the modules a piece of source imports, top level or inside functions
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    return names
+
+def _module_file(name):
+    # source file of a module in this repo, None for the standard library and site-packages
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, ValueError):
+        return None
+    origin = getattr(spec, 'origin', None)
+    if not origin or not origin.endswith('.py') or not os.path.abspath(origin).startswith(_repo_root + os.sep):
+        return None
+    return origin
+
+def code_fingerprint(func):
+    """
+    hash of a stage's code: its own source plus every repo module it imports, followed transitively,
+    so editing e.g. anes_statistics.py invalidates the stages that call into it
+    """
+    h = hashlib.sha256(inspect.getsource(func).encode())
+    seen, todo = set(), sorted(_local_imports(inspect.getsource(func)))
+    while todo:
+        path = _module_file(todo.pop())
+        if path is None or path in seen:
+            continue
+        seen.add(path)
+        if path not in _module_hashes:
+            with open(path, 'rb') as f:
+                source = f.read()
+            _module_hashes[path] = (hashlib.sha256(source).hexdigest(), sorted(_local_imports(source)))
+        digest, imports = _module_hashes[path]
+        todo.extend(imports)
+    for path in sorted(seen):
+        h.update(f"{os.path.relpath(path, _repo_root)}:{_module_hashes[path][0]}".encode())
+    return h.hexdigest()
+
+def _check_types(stage_name, kind, values, spec):
+    for name, expected in spec.items():
+        if not isinstance(values[name], expected):
+            raise TypeError(f"Stage '{stage_name}' {kind} '{name}' should be {expected}, got {type(values[name]).__name__}")
+
+def _stage_order(stages, params):
+    producers = {out: name for name, stage in stages.items() for out in stage["outputs"]}
+    for name, stage in stages.items():
+        for inp in stage["inputs"]:
+            if inp not in producers and inp not in params:
+                raise ValueError(f"Stage '{name}' needs '{inp}', which no stage produces and no parameter provides")
+    deps = {name: {producers[inp] for inp in stage["inputs"] if inp in producers} for name, stage in stages.items()}
+    return deps
+
+def run_pipeline(params, stages=None, targets=None, cache_dir=".anes_cache", use_cache=True, max_workers=None,
+                 memory_budget=None):
+    # memory_budget ('2G', bytes) lets load, frequency and moment steps fall back to chunked variants
+    if memory_budget is not None:
+        set_memory_budget(memory_budget)
+    stages = stage_dict if stages is None else stages
+    deps = _stage_order(stages, params)
+
+    # only run what the targets need
+    if targets is not None:
+        needed, todo = set(), list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in needed:
+                needed.add(name)
+                todo.extend(deps[name])
+        stages = {name: stage for name, stage in stages.items() if name in needed}
+        deps = {name: deps[name] & needed for name in stages}
+
+    values = dict(params)
+    fingerprints = {name: _hash_value(name, value) for name, value in params.items()}
+    status = {}
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def prepare(name):
+        stage = stages[name]
+        inputs = {inp: values[inp] for inp in stage["inputs"]}
+        _check_types(name, "input", inputs, stage["inputs"])
+        h = hashlib.sha256(name.encode())
+        h.update(code_fingerprint(stage["func"]).encode())
+        for inp in sorted(stage["inputs"]):
+            h.update(fingerprints[inp].encode())
+        return inputs, h.hexdigest()
+
+    def load_cached(name, fingerprint):
+        path = os.path.join(cache_dir, f"{name}-{fingerprint[:16]}.pkl")
+        if not use_cache or not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            cached = pickle.load(f)
+        # written files must still hold what this run wrote; another command may have overwritten them
+        for file_path, digest in cached["file_hashes"].items():
+            if not os.path.isfile(file_path) or file_fingerprint(file_path) != digest:
+                return None
+        return cached["outputs"]
+
+    def execute(name, inputs, fingerprint):
+        frame = next((v for v in inputs.values() if isinstance(v, pd.DataFrame)), None)
+        budget = current_budget()
+        extra = {} if budget is None else {"memory_budget_mb": round(budget / (1 << 20), 1),
+                                           "input_mb": round(frame.memory_usage().sum() / (1 << 20), 1) if frame is not None else None}
+        with profile_stage(name, df=frame, fingerprint=fingerprint[:16], **extra) as record:
+            outputs = stages[name]["func"](**inputs)
+            if record["rows"] is None:
+                frame = next((v for v in outputs.values() if isinstance(v, pd.DataFrame)), None)
+                record["rows"], record["columns"] = frame.shape if frame is not None else (None, None)
+        _check_types(name, "output", outputs, stages[name]["outputs"])
+        if use_cache:
+            path = os.path.join(cache_dir, f"{name}-{fingerprint[:16]}.pkl")
+            file_hashes = {file_path: file_fingerprint(file_path) for key in stages[name].get("files", [])
+                           for file_path in outputs[key]}
+            with open(path + ".tmp", 'wb') as f:
+                pickle.dump({"outputs": outputs, "file_hashes": file_hashes}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        return outputs
+
+    def finish(name, outputs, fingerprint, how):
+        for key, value in outputs.items():
+            values[key] = value
+            fingerprints[key] = hashlib.sha256(f"{fingerprint}:{key}".encode()).hexdigest()
+        status[name] = how
+
+    pending = set(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            ready = [name for name in pending if deps[name] <= set(status)]
+            main_thread = []
+            for name in sorted(ready):
+                pending.discard(name)
+                inputs, fingerprint = prepare(name)
+                cached = load_cached(name, fingerprint)
+                if cached is not None:
+                    write_record({"event": "stage", "name": name, "status": "cached", "fingerprint": fingerprint[:16]})
+                    finish(name, cached, fingerprint, "cached")
+                elif stages[name].get("main_thread"):
+                    main_thread.append((name, inputs, fingerprint))
+                else:
+                    running[pool.submit(execute, name, inputs, fingerprint)] = (name, fingerprint)
+
+            if ready and not main_thread and not running:
+                # cache hits may have unblocked more stages
+                continue
+            for name, inputs, fingerprint in main_thread:
+                finish(name, execute(name, inputs, fingerprint), fingerprint, "ran")
+            if main_thread:
+                continue
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages {sorted(pending)} have unresolved dependencies")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, fingerprint = running.pop(future)
+                finish(name, future.result(), fingerprint, "ran")
+
+    values["stage_status"] = status
+    return values
@@ -0,0 +1,168 @@
+import os
+import atexit
+import sys
+import json
+import time
+import uuid
+import socket
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# set ANES_PROFILE=path/to/run_log.jsonl (or call start_run_log) to record every stage and hot function
+_state = {"path": None, "run_id": None}
+_lock = threading.Lock()
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _shape(obj):
+    shape = getattr(obj, 'shape', None)
+    if shape is not None and len(shape) == 2:
+        return int(shape[0]), int(shape[1])
+    return None, None
+
+def start_run_log(path="anes_run_log.jsonl", run_id=None, **run_info):
+    _state["path"] = path
+    _state["run_id"] = run_id or f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    write_record({"event": "run_start", "argv": sys.argv, "host": socket.gethostname(),
+                  "python": sys.version.split()[0], **run_info})
+    return _state["run_id"]
+
+def stop_run_log():
+    if _state["path"]:
+        write_record({"event": "run_end"})
+    _state["path"] = None
+    _state["run_id"] = None
+
+def is_profiling():
+    return _state["path"] is not None
+
+def current_run_id():
+    return _state["run_id"]
+
+def write_record(record):
+    if not _state["path"]:
+        return
+    record = {"run_id": _state["run_id"], "time": datetime.now().isoformat(), **record}
+    line = json.dumps(record, default=str)
+    with _lock:
+        with open(_state["path"], 'a') as f:
+            f.write(line + "\n")
+
+@contextmanager
+def profile_stage(name, df=None, kind="stage", **extra):
+    # yields the record so the block can add rows/columns or anything else before it is written
+    record = {"event": kind, "name": name, **extra}
+    record["rows"], record["columns"] = _shape(df)
+    if not is_profiling():
+        yield record
+        return
+
+    rss_start = _current_rss_mb()
+    peak_start = _peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    status = "ok"
+    try:
+        yield record
+    except BaseException as e:
+        status = f"error: {type(e).__name__}: {e}"
+        raise
+    finally:
+        peak_end = _peak_rss_mb()
+        record.update({
+            "status": status,
+            "wall_s": round(time.perf_counter() - wall_start, 6),
+            "cpu_s": round(time.thread_time() - cpu_start, 6),
+            "rss_start_mb": rss_start,
+            "rss_end_mb": _current_rss_mb(),
+            "peak_rss_mb": peak_end,
+            "peak_rss_growth_mb": None if peak_end is None else round(peak_end - peak_start, 3),
+            "thread": threading.current_thread().name
+        })
+        write_record(record)
+
+def profiled(func=None, name=None):
+    # decorator for hot functions; a no-op apart from one check when no run log is active
+    if func is None:
+        return functools.partial(profiled, name=name)
+    label = name or f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_profiling():
+            return func(*args, **kwargs)
+        frame = next((a for a in list(args) + list(kwargs.values()) if _shape(a)[0] is not None), None)
+        with profile_stage(label, df=frame, kind="function") as record:
+            result = func(*args, **kwargs)
+            if record["rows"] is None:
+                record["rows"], record["columns"] = _shape(result)
+            return result
+    return wrapper
+
+def read_run_log(path):
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                runs.setdefault(record["run_id"], []).append(record)
+    return runs
+
+def summarize_run(records):
+    summary = {}
+    for record in records:
+        # cached stages did no work, leave them out rather than report 0s
+        if record.get("event") not in ("stage", "function") or record.get("status") == "cached":
+            continue
+        entry = summary.setdefault(record["name"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": 0.0})
+        entry["calls"] += 1
+        entry["wall_s"] += record.get("wall_s") or 0.0
+        entry["cpu_s"] += record.get("cpu_s") or 0.0
+        entry["peak_rss_mb"] = max(entry["peak_rss_mb"], record.get("peak_rss_mb") or 0.0)
+    return summary
+
+def compare_runs(path, run_a=None, run_b=None):
+    # defaults to the last two runs in the log
+    runs = read_run_log(path)
+    run_ids = list(runs)
+    if len(run_ids) < 2 and (run_a is None or run_b is None):
+        raise ValueError(f"Need two runs to compare, found {len(run_ids)} in {path}")
+    run_a = run_a or run_ids[-2]
+    run_b = run_b or run_ids[-1]
+    a, b = summarize_run(runs[run_a]), summarize_run(runs[run_b])
+
+    comparison = {}
+    for name in list(a) + [n for n in b if n not in a]:
+        wall_a = a.get(name, {}).get("wall_s")
+        wall_b = b.get(name, {}).get("wall_s")
+        comparison[name] = {
+            "wall_s_a": wall_a,
+            "wall_s_b": wall_b,
+            "ratio": wall_b / wall_a if wall_a and wall_b is not None else None,
+            "peak_rss_mb_a": a.get(name, {}).get("peak_rss_mb"),
+            "peak_rss_mb_b": b.get(name, {}).get("peak_rss_mb")
+        }
+    return {"run_a": run_a, "run_b": run_b, "stages": comparison}
+
+if os.environ.get("ANES_PROFILE"):
+    start_run_log(os.environ["ANES_PROFILE"])
+    atexit.register(stop_run_log)
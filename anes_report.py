@@ -0,0 +1,225 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+from data.dicts import order_dict
+from anes_labels import value_labels
+from anes_descriptives import aggregate_facets, reorder_columns, format_results_summary
+
+default_report_facets = ['resp_partyid', 'resp_race', 'gay_id']
+
+def _to_json_safe(obj):
+    # numpy scalars, float keys from samplics and nan need to become plain json
+    if isinstance(obj, dict):
+        return {str(int(k)) if isinstance(k, float) and float(k).is_integer() else str(k): _to_json_safe(v)
+                for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_to_json_safe(v) for v in obj]
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and (math.isnan(obj) or math.isinf(obj)):
+        return None
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+def build_report_aggregates(df, question_cols, facet_cols=None, therm_bins=20):
+    # compact rows of [facet value, response value, weighted %, n], 'all' is the unfaceted distribution
+    facet_cols = default_report_facets if facet_cols is None else facet_cols
+    facet_cols = [col for col in facet_cols if col in df.columns]
+
+    frame = df.assign(_all=1)
+    aggregates = {}
+    for facet_col in ['_all'] + facet_cols:
+        agg = aggregate_facets(frame, question_cols, facet_col, therm_bins=therm_bins)
+        agg = agg.round({'weighted_percentage': 2})
+        facet_key = 'all' if facet_col == '_all' else facet_col
+        aggregates[facet_key] = {
+            question: group[['facet', 'value', 'weighted_percentage', 'n']].values.tolist()
+            for question, group in agg.groupby('question', sort=False)
+        }
+    return aggregates
+
+def build_report_payload(df, descriptive_stats, samplics_results=None, trans_cols=None, gay_cols=None,
+                         facet_cols=None, therm_bins=20):
+    trans_cols = list(descriptive_stats['transgender_questions']['questions']) if trans_cols is None else trans_cols
+    gay_cols = list(descriptive_stats['gay_lgb_questions']['questions']) if gay_cols is None else gay_cols
+    ordered = {
+        'transgender_questions': reorder_columns(trans_cols, order_dict['trans_qs']),
+        'gay_lgb_questions': reorder_columns(gay_cols, order_dict['gay_qs'])
+    }
+    question_cols = ordered['transgender_questions'] + ordered['gay_lgb_questions']
+    facet_cols = default_report_facets if facet_cols is None else facet_cols
+    facet_cols = [col for col in facet_cols if col in df.columns]
+
+    payload = {
+        'summary_text': format_results_summary(descriptive_stats),
+        'metadata': descriptive_stats['metadata'],
+        'order': ordered,
+        'descriptives': {group: descriptive_stats[group]['questions'] for group in ordered},
+        'estimates': samplics_results or {},
+        'labels': {col: value_labels(col) for col in question_cols + facet_cols if value_labels(col)},
+        'facets': facet_cols,
+        'aggregates': build_report_aggregates(df, question_cols, facet_cols, therm_bins=therm_bins)
+    }
+    return _to_json_safe(payload)
+
+_report_template = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: Helvetica, Arial, sans-serif; margin: 24px; color: #222; }
+h1 { font-size: 22px; } h2 { font-size: 18px; margin-top: 32px; border-bottom: 1px solid #ccc; }
+pre { background: #f6f6f6; padding: 12px; }
+.controls { position: sticky; top: 0; background: white; padding: 8px 0; border-bottom: 1px solid #eee; }
+.grid { display: flex; flex-wrap: wrap; gap: 16px; }
+.panel { width: 340px; border: 1px solid #ddd; padding: 8px; }
+.panel h3 { font-size: 14px; margin: 0 0 4px 0; }
+.panel .meta { font-size: 11px; color: #666; }
+table { border-collapse: collapse; font-size: 12px; margin-top: 6px; }
+td, th { border: 1px solid #ddd; padding: 2px 6px; text-align: right; }
+th:first-child, td:first-child { text-align: left; }
+</style>
+</head>
+<body>
+<h1>__TITLE__</h1>
+<pre id="summary"></pre>
+<div class="controls">
+  Group by <select id="facet"></select>
+  <select id="level"></select>
+</div>
+<div id="content"></div>
+<script id="report-data" type="application/json">__DATA__</script>
+<script>
+(function () {
+  var data = JSON.parse(document.getElementById('report-data').textContent);
+  var colors = ['firebrick', 'orange', 'gold', 'green', 'lightseagreen', 'cornflowerblue', 'rebeccapurple', 'orchid', 'saddlebrown'];
+  var facetSelect = document.getElementById('facet');
+  var levelSelect = document.getElementById('level');
+  document.getElementById('summary').textContent = data.summary_text;
+
+  function label(col, code) {
+    var labels = data.labels[col] || {};
+    var key = String(Math.round(code));
+    return labels[key] !== undefined ? labels[key] : 'Value ' + key;
+  }
+
+  function title(col) {
+    return col.split('_').map(function (w) { return w.charAt(0).toUpperCase() + w.slice(1); }).join(' ');
+  }
+
+  function option(select, value, text) {
+    var opt = document.createElement('option');
+    opt.value = value; opt.textContent = text; select.appendChild(opt);
+  }
+
+  function barChart(rows, isTherm, col, color) {
+    var w = 320, h = 160, pad = 24, ns = 'http://www.w3.org/2000/svg';
+    var svg = document.createElementNS(ns, 'svg');
+    svg.setAttribute('width', w); svg.setAttribute('height', h + pad);
+    if (!rows.length) { return svg; }
+    var max = Math.max.apply(null, rows.map(function (r) { return r[2]; }));
+    var bw = (w - pad) / rows.length;
+    rows.forEach(function (r, i) {
+      var bh = max > 0 ? (r[2] / max) * (h - 10) : 0;
+      var rect = document.createElementNS(ns, 'rect');
+      rect.setAttribute('x', pad + i * bw + 1); rect.setAttribute('y', h - bh);
+      rect.setAttribute('width', Math.max(bw - 2, 1)); rect.setAttribute('height', bh);
+      rect.setAttribute('fill', color); rect.setAttribute('stroke', 'black'); rect.setAttribute('stroke-width', '0.5');
+      var tip = document.createElementNS(ns, 'title');
+      tip.textContent = (isTherm ? 'Score ~' + r[1] : label(col, r[1])) + ': ' + r[2].toFixed(1) + '% (n=' + r[3] + ')';
+      rect.appendChild(tip);
+      svg.appendChild(rect);
+    });
+    var axis = document.createElementNS(ns, 'text');
+    axis.setAttribute('x', pad); axis.setAttribute('y', h + 16); axis.setAttribute('font-size', '10');
+    axis.textContent = isTherm ? 'Cold (0) ... Warm (100)' : label(col, rows[0][1]) + ' ... ' + label(col, rows[rows.length - 1][1]);
+    svg.appendChild(axis);
+    return svg;
+  }
+
+  function estimateTable(col) {
+    var est = data.estimates[col];
+    var table = document.createElement('table');
+    if (!est) { return table; }
+    var html = '';
+    if (est.type === 'continuous') {
+      html = '<tr><th>Design mean</th><th>SE</th><th>n</th></tr><tr><td>' + est.mean.toFixed(2) + '</td><td>' +
+        (est.se === null ? '-' : est.se.toFixed(3)) + '</td><td>' + est.n + '</td></tr>';
+    } else {
+      html = '<tr><th>Response</th><th>Proportion</th><th>SE</th></tr>';
+      Object.keys(est.categories).sort(function (a, b) { return a - b; }).forEach(function (k) {
+        var c = est.categories[k];
+        html += '<tr><td>' + label(col, Number(k)) + '</td><td>' + c.proportion.toFixed(3) + '</td><td>' +
+          (c.se === null ? '-' : c.se.toFixed(4)) + '</td></tr>';
+      });
+    }
+    table.innerHTML = html;
+    return table;
+  }
+
+  function render() {
+    var facet = facetSelect.value, level = levelSelect.value;
+    var content = document.getElementById('content');
+    content.innerHTML = '';
+    Object.keys(data.order).forEach(function (group) {
+      var h2 = document.createElement('h2');
+      h2.textContent = group === 'transgender_questions' ? 'Transgender Questions' : 'Gay/LGB Questions';
+      content.appendChild(h2);
+      var grid = document.createElement('div'); grid.className = 'grid';
+      data.order[group].forEach(function (col, idx) {
+        var rows = (data.aggregates[facet][col] || []).filter(function (r) {
+          return facet === 'all' || String(Math.round(r[0])) === level;
+        });
+        var desc = (data.descriptives[group] || {})[col] || {};
+        var isTherm = desc.question_type === 'thermometer';
+        var panel = document.createElement('div'); panel.className = 'panel';
+        var n = rows.reduce(function (s, r) { return s + r[3]; }, 0);
+        panel.innerHTML = '<h3>' + title(col) + '</h3><div class="meta">n=' + n.toLocaleString() +
+          (desc.response_rate !== undefined ? ', response rate ' + desc.response_rate.toFixed(1) + '%' : '') +
+          (desc.weighted_mean !== undefined ? ', weighted mean ' + desc.weighted_mean.toFixed(1) : '') + '</div>';
+        panel.appendChild(barChart(rows, isTherm, col, colors[idx % colors.length]));
+        if (facet === 'all') { panel.appendChild(estimateTable(col)); }
+        grid.appendChild(panel);
+      });
+      content.appendChild(grid);
+    });
+  }
+
+  function fillLevels() {
+    levelSelect.innerHTML = '';
+    var facet = facetSelect.value;
+    levelSelect.style.display = facet === 'all' ? 'none' : '';
+    if (facet === 'all') { return; }
+    var seen = {};
+    Object.keys(data.aggregates[facet]).forEach(function (col) {
+      data.aggregates[facet][col].forEach(function (r) { seen[Math.round(r[0])] = true; });
+    });
+    Object.keys(seen).sort(function (a, b) { return a - b; }).forEach(function (code) {
+      option(levelSelect, code, label(facet, Number(code)));
+    });
+  }
+
+  option(facetSelect, 'all', 'All respondents');
+  data.facets.forEach(function (f) { option(facetSelect, f, title(f)); });
+  facetSelect.addEventListener('change', function () { fillLevels(); render(); });
+  levelSelect.addEventListener('change', render);
+  fillLevels();
+  render();
+})();
+</script>
+</body>
+</html>
+"""
+
+def generate_html_report(df, descriptive_stats, samplics_results=None, trans_cols=None, gay_cols=None,
+                         facet_cols=None, output_file="anes_report.html", title="ANES 2024 LGBTQ+ Questions"):
+    payload = build_report_payload(df, descriptive_stats, samplics_results, trans_cols, gay_cols, facet_cols)
+    # keep the inline json from closing the script tag
+    data = json.dumps(payload, separators=(',', ':')).replace('</', '<\\/')
+    html = _report_template.replace('__TITLE__', title).replace('__DATA__', data)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(html)
+    return output_file
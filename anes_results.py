@@ -0,0 +1,245 @@
+import os
+import json
+import sqlite3
+import hashlib
+import subprocess
+from datetime import datetime
+
+# one sqlite file keeps every run's estimates so trend and regression checks are queries, not greps over
+# overwritten json. stdlib only, so listing and diffing runs stays a quick command
+
+default_store = 'anes_results.db'
+text_artifact_limit = 5 * 1024 * 1024  # json/txt/html outputs up to this size are kept verbatim
+text_suffixes = ('.json', '.txt', '.csv', '.md', '.html')
+
+schema_sql = """
+create table if not exists runs (
+    run_id text primary key,
+    started text not null,
+    command text,
+    input_path text,
+    input_fingerprint text,
+    code_version text,
+    params text,
+    rows integer
+);
+create table if not exists estimates (
+    run_id text not null references runs(run_id),
+    source text not null,
+    variable text not null,
+    category text not null,
+    statistic text not null,
+    domain text not null default '',
+    estimate real,
+    se real,
+    n integer,
+    design text
+);
+create index if not exists estimates_variable on estimates(variable, domain);
+create index if not exists estimates_domain on estimates(domain);
+create index if not exists estimates_run on estimates(run_id, source);
+create table if not exists artifacts (
+    run_id text not null references runs(run_id),
+    path text not null,
+    sha256 text,
+    bytes integer,
+    content blob
+);
+create index if not exists artifacts_run on artifacts(run_id);
+"""
+
+def file_fingerprint(path):
+    # sha256 of the file contents, streamed
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def code_version(root=None):
+    # git commit (+ '-dirty' with uncommitted changes to tracked files), else a hash of the python sources
+    root = root or os.path.dirname(os.path.abspath(__file__))
+    try:
+        head = subprocess.run(['git', '-C', root, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=10)
+        if head.returncode == 0:
+            dirty = subprocess.run(['git', '-C', root, 'status', '--porcelain', '--untracked-files=no'],
+                                   capture_output=True, text=True, timeout=10).stdout.strip()
+            return head.stdout.strip() + ('-dirty' if dirty else '')
+    except (OSError, subprocess.SubprocessError):
+        pass
+    h = hashlib.sha256()
+    for folder in (root, os.path.join(root, 'data')):
+        for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            if name.endswith('.py'):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    h.update(f.read())
+    return f"src-{h.hexdigest()[:12]}"
+
+def design_spec(columns):
+    # how the estimates were weighted, from the design columns the frame carried
+    columns = set(columns)
+    if {'weight', 'psu', 'stratum'} <= columns:
+        return 'taylor(weight, psu, stratum)'
+    return 'weight' if 'weight' in columns else 'unweighted'
+
+def _category(value):
+    # categories are stored as text; whole-number codes without the trailing .0
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def estimate_rows(results, domain='', design=None, source='samplics'):
+    # samplics_analysis output -> (source, variable, category, statistic, domain, estimate, se, n, design)
+    rows = []
+    for var, entry in results.items():
+        if entry.get('type') == 'continuous':
+            rows.append((source, var, 'mean', 'mean', domain, entry['mean'], entry.get('se'), entry.get('n'), design))
+        elif entry.get('type') == 'categorical':
+            for cat, values in entry['categories'].items():
+                rows.append((source, var, _category(cat), 'proportion', domain, values['proportion'], values.get('se'),
+                             entry.get('n'), design))
+    return rows
+
+def descriptive_rows(descriptive_stats, domain='', design=None):
+    # weighted shares and weighted means from the descriptives json (no ses there)
+    rows = []
+    for group, section in descriptive_stats.items():
+        if not isinstance(section, dict) or 'questions' not in section:
+            continue
+        for var, stats in section['questions'].items():
+            n = stats.get('total_responses')
+            if stats.get('weighted_mean') is not None:
+                rows.append(('descriptives', var, 'mean', 'weighted_mean', domain, stats['weighted_mean'], None, n, design))
+            for cat, pct in (stats.get('weighted_percentages') or {}).items():
+                rows.append(('descriptives', var, _category(cat), 'weighted_share', domain, pct / 100, None, n, design))
+    return rows
+
+class ResultsStore:
+    """
+    runs, their estimates and the files they wrote, in one sqlite file. add_* calls are bulk inserts
+    in one transaction; diff_runs lines two runs up estimate by estimate
+    """
+    def __init__(self, path=default_store):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('pragma journal_mode=wal')
+        self.conn.execute('pragma synchronous=normal')
+        self.conn.executescript(schema_sql)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start_run(self, command=None, input_path=None, params=None, rows=None, run_id=None):
+        from anes_profiling import current_run_id
+        run_id = run_id or current_run_id() or datetime.now().strftime('%Y%m%dT%H%M%S-') + os.urandom(3).hex()
+        fingerprint = file_fingerprint(input_path) if input_path and os.path.isfile(input_path) else None
+        with self.conn:
+            self.conn.execute('insert or replace into runs values (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (run_id, datetime.now().isoformat(), command, input_path, fingerprint, code_version(),
+                               json.dumps(params or {}, default=str), rows))
+        return run_id
+
+    def add_estimates(self, run_id, rows):
+        with self.conn:
+            self.conn.executemany('insert into estimates values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  [(run_id, *row) for row in rows])
+        return len(rows)
+
+    def add_results(self, run_id, results, domain='', design=None, source='samplics'):
+        return self.add_estimates(run_id, estimate_rows(results, domain, design, source))
+
+    def add_descriptives(self, run_id, descriptive_stats, domain='', design=None):
+        return self.add_estimates(run_id, descriptive_rows(descriptive_stats, domain, design))
+
+    def add_artifacts(self, run_id, paths):
+        # every output file's hash; small text outputs are kept whole so old runs can be read back
+        rows = []
+        for path in paths:
+            if not path or not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            content = None
+            if path.endswith(text_suffixes) and size <= text_artifact_limit:
+                with open(path, 'rb') as f:
+                    content = f.read()
+            rows.append((run_id, path, file_fingerprint(path), size, content))
+        with self.conn:
+            self.conn.executemany('insert into artifacts values (?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def runs(self, limit=None):
+        sql = ('select r.*, (select count(*) from estimates e where e.run_id = r.run_id) as estimates '
+               'from runs r order by started desc')
+        rows = self.conn.execute(sql + (' limit ?' if limit else ''), (limit,) if limit else ()).fetchall()
+        return [dict(row) for row in rows]
+
+    def _run_ids(self, run_a, run_b):
+        # defaults to the last two runs, like profiling's compare_runs
+        if run_a and run_b:
+            return run_a, run_b
+        recent = [row['run_id'] for row in self.runs(limit=2)]
+        if len(recent) < 2:
+            raise ValueError(f"Need two runs to diff, found {len(recent)} in {self.path}")
+        return run_a or recent[1], run_b or recent[0]
+
+    def estimates(self, run_id=None, variable=None, domain=None, source=None):
+        clauses, values = [], []
+        for column, value in [('run_id', run_id), ('variable', variable), ('domain', domain), ('source', source)]:
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                values.append(value)
+        sql = 'select * from estimates' + (' where ' + ' and '.join(clauses) if clauses else '')
+        return [dict(row) for row in self.conn.execute(sql, values)]
+
+    def artifact(self, run_id, path):
+        row = self.conn.execute('select content from artifacts where run_id = ? and path = ?', (run_id, path)).fetchone()
+        return None if row is None else row['content']
+
+    def diff_runs(self, run_a=None, run_b=None, source=None, tolerance=1e-9):
+        """
+        every estimate of two runs side by side: status added/removed/changed/same, the difference and
+        z = difference / sqrt(se_a^2 + se_b^2) when both have ses. changed rows first, largest |z| first
+        """
+        run_a, run_b = self._run_ids(run_a, run_b)
+        key = lambda row: (row['source'], row['variable'], row['category'], row['statistic'], row['domain'])
+        a = {key(row): row for row in self.estimates(run_a, source=source)}
+        b = {key(row): row for row in self.estimates(run_b, source=source)}
+        rows = []
+        for k in list(a) + [k for k in b if k not in a]:
+            old, new = a.get(k), b.get(k)
+            entry = dict(zip(('source', 'variable', 'category', 'statistic', 'domain'), k))
+            entry.update(estimate_a=old and old['estimate'], estimate_b=new and new['estimate'],
+                         se_a=old and old['se'], se_b=new and new['se'], n_a=old and old['n'], n_b=new and new['n'],
+                         difference=None, z=None)
+            if old is None or new is None:
+                entry['status'] = 'added' if old is None else 'removed'
+            else:
+                diff = (new['estimate'] or 0.0) - (old['estimate'] or 0.0)
+                entry['difference'] = diff
+                if old['se'] and new['se']:
+                    entry['z'] = diff / (old['se'] ** 2 + new['se'] ** 2) ** 0.5
+                moved = abs(diff) > tolerance or old['n'] != new['n'] or old['design'] != new['design']
+                entry['status'] = 'changed' if moved else 'same'
+            rows.append(entry)
+        order = {'changed': 0, 'added': 1, 'removed': 2, 'same': 3}
+        rows.sort(key=lambda r: (order[r['status']], -abs(r['z'] or 0.0), -abs(r['difference'] or 0.0)))
+        return {'run_a': run_a, 'run_b': run_b, 'rows': rows}
+
+    def trend(self, variable, category=None, domain='', source='samplics'):
+        # one estimate across every run, oldest first
+        sql = ('select r.run_id, r.started, r.code_version, r.input_fingerprint, e.category, e.statistic, '
+               'e.estimate, e.se, e.n from estimates e join runs r on r.run_id = e.run_id '
+               'where e.variable = ? and e.domain = ? and e.source = ?')
+        values = [variable, domain, source]
+        if category is not None:
+            sql += ' and e.category = ?'
+            values.append(category)
+        return [dict(row) for row in self.conn.execute(sql + ' order by r.started, e.category', values)]
@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from data.dicts import theme_dict
+from data.schema import schema_dict, theme_columns, valid_mask
+from anes_backend import mp_context
+from anes_profiling import profiled
+
+# attitude indices from the theme_dict item groups: items are reverse coded from their scale direction
+# so higher always means more supportive, weighted z-scored, and checked with a weighted principal axis
+# factor analysis plus alpha and omega. bootstrap cis come from rao-wu psu resampling; every replicate
+# is a row of a weight matrix, so moments, eigen decompositions and coefficients run batched
+
+scale_groups = ['trans_qs', 'gay_qs']
+min_item_share = 0.5  # items answered by less of the weighted sample (split ballots) stay out of the scale
+duplicate_r = 0.99  # an item this correlated with an earlier one repeats it (pre/post combined versions)
+min_items_answered = 0.5  # share of a scale's items a respondent needs for a score
+default_boot = 200
+paf_iterations = 100
+
+def scale_name(group):
+    return f"{group.removesuffix('_qs')}_scale"
+
+def _weighted_corr(X, w):
+    # X complete (n x p), w (n,) or (b x n) -> (p x p) or (b x p x p)
+    w = np.atleast_2d(w)
+    w = w / w.sum(axis=1, keepdims=True)
+    mean = w @ X
+    cov = np.einsum('bn,ni,nj->bij', w, X, X) - mean[:, :, None] * mean[:, None, :]
+    sd = np.sqrt(np.maximum(np.diagonal(cov, axis1=1, axis2=2), 1e-300))
+    return cov / sd[:, :, None] / sd[:, None, :]
+
+def usable_items(df, columns, weight_col='weight', min_share=min_item_share):
+    # drops split-ballot items (answered by under min_share of the weighted sample) and items that
+    # duplicate an earlier one
+    weights = df[weight_col] if weight_col in df.columns else pd.Series(1.0, index=df.index)
+    base = weights.notna()
+    items = []
+    for col in columns:
+        answered = valid_mask(df[col], col) & base
+        if weights[answered].sum() < min_share * weights[base].sum():
+            continue
+        duplicate = False
+        for kept in items:
+            both = answered & valid_mask(df[kept], kept)
+            if both.sum() > 2:
+                r = _weighted_corr(df.loc[both, [col, kept]].to_numpy(dtype=float), weights[both].to_numpy())[0, 0, 1]
+                duplicate = abs(r) > duplicate_r
+            if duplicate:
+                break
+        if not duplicate:
+            items.append(col)
+    return items
+
+def scale_items(df, group, weight_col='weight'):
+    # the group's items that have a scale direction, minus split-ballot items and duplicates
+    return usable_items(df, [col for col in theme_columns(df.columns, group) if schema_dict[col]['direction'] != 0],
+                        weight_col)
+
+def _paf(R, n_factors, iterations=paf_iterations, tol=1e-6):
+    # iterated principal axis factoring on a stack of correlation matrices (b x p x p), squared multiple
+    # correlations as the starting communalities
+    R = np.asarray(R)
+    h = 1 - 1 / np.diagonal(np.linalg.pinv(R), axis1=1, axis2=2)
+    eye = np.eye(R.shape[-1], dtype=bool)
+    for _ in range(iterations):
+        reduced = np.where(eye, h[:, :, None], R)
+        values, vectors = np.linalg.eigh(reduced)
+        values, vectors = values[:, ::-1][:, :n_factors], vectors[:, :, ::-1][:, :, :n_factors]
+        loadings = vectors * np.sqrt(np.maximum(values, 0))[:, None, :]
+        new_h = np.clip(np.sum(loadings ** 2, axis=2), 1e-6, 1.0)
+        done = np.max(np.abs(new_h - h)) < tol
+        h = new_h
+        if done:
+            break
+    return loadings
+
+def _varimax(loadings, iterations=100, tol=1e-8):
+    # batched kaiser varimax rotation (b x p x k)
+    b, p, k = loadings.shape
+    rotation = np.broadcast_to(np.eye(k), (b, k, k)).copy()
+    criterion = np.zeros(b)
+    for _ in range(iterations):
+        rotated = loadings @ rotation
+        target = rotated ** 3 - rotated * np.sum(rotated ** 2, axis=1, keepdims=True) / p
+        u, s, vt = np.linalg.svd(np.swapaxes(loadings, 1, 2) @ target)
+        rotation = u @ vt
+        new = s.sum(axis=1)
+        if np.max(np.abs(new - criterion)) < tol * np.max(np.abs(new)):
+            break
+        criterion = new
+    return loadings @ rotation
+
+def _align(loadings, reference):
+    # orthogonal procrustes of every replicate onto the full-sample loadings (sign flips and factor swaps)
+    u, _, vt = np.linalg.svd(np.swapaxes(loadings, 1, 2) @ reference[None])
+    return loadings @ (u @ vt)
+
+def _coefficients(R, n_factors):
+    # loadings (rotated when k > 1), standardized alpha and one-factor omega for a stack of correlation matrices
+    p = R.shape[-1]
+    alpha = p / (p - 1) * (1 - p / R.sum(axis=(1, 2)))
+    general = _paf(R, 1)[:, :, 0]
+    general *= np.where(general.sum(axis=1, keepdims=True) < 0, -1, 1)
+    explained = np.sum(general, axis=1) ** 2
+    omega = explained / (explained + np.sum(1 - general ** 2, axis=1))
+    if n_factors == 1:
+        return general[:, :, None], alpha, omega
+    rotated = _varimax(_paf(R, n_factors))
+    # orient every factor so its items load positively on balance
+    return rotated * np.where(rotated.sum(axis=1, keepdims=True) < 0, -1, 1), alpha, omega
+
+_worker_state = {}
+
+def _init_worker(state):
+    _worker_state.update(state)
+
+def _rao_wu_weights(weights, stratum_psu, n_boot, seed):
+    # rescaled bootstrap: n_h - 1 psus drawn with replacement in every stratum, weights scaled by
+    # n_h / (n_h - 1) * times drawn; strata with one psu keep their weights
+    rng = np.random.default_rng(seed)
+    psu_index, psu_stratum = stratum_psu
+    n_h = np.bincount(psu_stratum)
+    multipliers = np.ones((n_boot, len(psu_stratum)))
+    for size in np.unique(n_h[n_h > 1]):
+        strata = np.flatnonzero(n_h == size)
+        members = np.concatenate([np.flatnonzero(psu_stratum == h) for h in strata]).reshape(len(strata), size) \
+            if len(strata) else np.empty((0, size), dtype=int)
+        counts = rng.multinomial(size - 1, np.full(size, 1 / size), size=(n_boot, len(strata)))
+        multipliers[:, members] = counts * size / (size - 1)
+    return weights[None, :] * multipliers[:, psu_index]
+
+def _boot_chunk(task):
+    n_boot, seed = task
+    state = _worker_state
+    replicate_weights = _rao_wu_weights(state['weights'], state['stratum_psu'], n_boot, seed)
+    R = _weighted_corr(state['X'], replicate_weights)
+    loadings, alpha, omega = _coefficients(R, state['n_factors'])
+    return _align(loadings, state['reference']), alpha, omega
+
+def _psu_groups(frame):
+    # psu index per respondent and the stratum of every psu, or every respondent its own psu without a design
+    if 'psu' in frame.columns and 'stratum' in frame.columns and frame[['psu', 'stratum']].notna().all().all():
+        psu_index = frame.groupby(['stratum', 'psu'], sort=True).ngroup().to_numpy()
+        first = pd.Series(frame['stratum'].to_numpy()).groupby(psu_index).first()
+        return psu_index, pd.factorize(first.to_numpy(), sort=True)[0]
+    return np.arange(len(frame)), np.zeros(len(frame), dtype=int)
+
+def _interval(draws, level):
+    tail = (1 - level) / 2
+    return np.nanquantile(draws, [tail, 1 - tail], axis=0)
+
+@profiled
+def build_scales(df, groups=None, n_factors=1, n_boot=default_boot, level=0.95, processes=None, seed=0):
+    """
+    score every theme group as a scale. returns the frame with one <group>_scale column per group
+    (mean of the reverse-coded, weighted z-scored items) and {scale: report} with the items, which were
+    reversed, factor loadings, alpha and omega, each with rao-wu bootstrap cis when n_boot > 0
+    """
+    groups = groups or scale_groups
+    weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
+    scored = df.copy()
+    reports = {}
+    for group in groups:
+        items = scale_items(df, group)
+        name = scale_name(group)
+        if len(items) < 3:
+            reports[name] = {'items': items, 'error': 'fewer than three usable items'}
+            continue
+        directions = np.array([schema_dict[col]['direction'] for col in items], dtype=float)
+        # reversed items flip sign, so higher is more supportive for every item
+        values = pd.DataFrame({col: df[col].where(valid_mask(df[col], col)) for col in items}).to_numpy(dtype=float) * directions
+
+        usable = weights.notna().to_numpy()
+        w = weights.fillna(0).to_numpy(dtype=float)
+        answered = ~np.isnan(values) & usable[:, None]
+        means = np.array([np.average(values[answered[:, j], j], weights=w[answered[:, j]]) for j in range(len(items))])
+        sds = np.sqrt([np.average((values[answered[:, j], j] - means[j]) ** 2, weights=w[answered[:, j]])
+                       for j in range(len(items))])
+        z = (values - means) / sds
+        counts = np.sum(~np.isnan(z), axis=1)
+        enough = usable & (counts >= np.ceil(min_items_answered * len(items)))
+        scored[name] = np.where(enough, np.nansum(z, axis=1) / np.maximum(counts, 1), np.nan)
+
+        # factor analysis and reliability on the weighted complete cases
+        complete = usable & ~np.isnan(z).any(axis=1)
+        X, cw = z[complete], w[complete]
+        R = _weighted_corr(X, cw)
+        k = min(n_factors, len(items) - 1)
+        loadings, alpha, omega = _coefficients(R, k)
+        eigenvalues = np.linalg.eigvalsh(R[0])[::-1]
+        report = {
+            'items': items,
+            'reversed': [col for col, d in zip(items, directions) if d < 0],
+            'n_scored': int(enough.sum()),
+            'n_complete': int(complete.sum()),
+            'eigenvalues': eigenvalues.tolist(),
+            'variance_explained': (np.sum(loadings[0] ** 2, axis=0) / len(items)).tolist(),
+            'loadings': {col: loadings[0][j].tolist() for j, col in enumerate(items)},
+            'communalities': {col: float(np.sum(loadings[0][j] ** 2)) for j, col in enumerate(items)},
+            'alpha': float(alpha[0]),
+            'omega': float(omega[0])
+        }
+
+        if n_boot:
+            frame = df.loc[complete]
+            state = {'X': X, 'weights': cw, 'stratum_psu': _psu_groups(frame), 'n_factors': k, 'reference': loadings[0]}
+            workers = processes or os.cpu_count() or 1
+            sizes = [len(chunk) for chunk in np.array_split(np.arange(n_boot), workers) if len(chunk)]
+            seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+            tasks = list(zip(sizes, seeds))
+            if workers <= 1 or len(tasks) <= 1:
+                _init_worker(state)
+                chunks = [_boot_chunk(task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context(), initializer=_init_worker,
+                                         initargs=(state,)) as pool:
+                    chunks = list(pool.map(_boot_chunk, tasks))
+            boot_loadings = np.concatenate([chunk[0] for chunk in chunks])
+            boot_alpha = np.concatenate([chunk[1] for chunk in chunks])
+            boot_omega = np.concatenate([chunk[2] for chunk in chunks])
+            low, high = _interval(boot_loadings, level)
+            report['loadings_ci'] = {col: [low[j].tolist(), high[j].tolist()] for j, col in enumerate(items)}
+            report['alpha_ci'] = _interval(boot_alpha, level).tolist()
+            report['omega_ci'] = _interval(boot_omega, level).tolist()
+            report['bootstrap'] = {'replicates': n_boot, 'level': level, 'method': 'rao-wu rescaled psu bootstrap'}
+        reports[name] = report
+    return scored, reports
+
+def main(argv=None):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    parser = argparse.ArgumentParser(description='Attitude scales from the theme_dict item groups')
+    parser.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    parser.add_argument('--groups', default=','.join(scale_groups), help=f"theme_dict groups, e.g. {','.join(theme_dict)}")
+    parser.add_argument('--factors', type=int, default=1)
+    parser.add_argument('--boot', type=int, default=default_boot, help='bootstrap replicates (0 skips the cis)')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='anes_scales.csv', help='input columns plus the scale scores')
+    parser.add_argument('--json', default='anes_scales.json')
+    args = parser.parse_args(argv)
+
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict)
+    scored, reports = build_scales(df, args.groups.split(','), args.factors, args.boot, processes=args.processes,
+                                   seed=args.seed)
+    scored.to_csv(args.output, index=False)
+    with open(args.json, 'w') as f:
+        json.dump(reports, f, indent=2)
+    for name, report in reports.items():
+        if 'error' in report:
+            print(f"{name}: skipped, {report['error']}")
+            continue
+        ci = report.get('alpha_ci')
+        print(f"{name}: {len(report['items'])} items ({', '.join(report['items'])}), "
+              f"alpha {report['alpha']:.3f}{f' [{ci[0]:.3f}, {ci[1]:.3f}]' if ci else ''}, omega {report['omega']:.3f}")
+    print(f"Saved: {args.output}, {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from data.schema import kind_of, theme_columns, valid_mask
+from anes_backend import mp_context
+from anes_profiling import profiled
+from anes_labels import value_label
+from anes_scales import usable_items
+
+# respondent segments from the joint answers to the categorical trans/gay items. items become a compact
+# int8 matrix (-1 missing), identical answer patterns collapse into one row carrying the summed survey
+# weight, and both models fit on the patterns: weighted latent class analysis by em, and mini-batch
+# k-modes with batches drawn in proportion to the weights. restarts run in a process pool
+
+default_classes = 4
+default_restarts = 10
+em_iterations = 500
+em_tol = 1e-7
+screen_iterations = 50  # every lca start runs this far; only the best one continues to convergence
+kmodes_batch = 4096
+kmodes_iterations = 200
+min_probability = 1e-6
+
+def segment_items(df):
+    # categorical items from both themes in file order, without split-ballot items or duplicates
+    columns = [col for col in theme_columns(df.columns, 'trans_qs') + theme_columns(df.columns, 'gay_qs')
+               if kind_of(col) in ('binary', 'ordinal', 'nominal')]
+    return usable_items(df, columns)
+
+def encode_items(df, items):
+    # int8 codes 0..k-1 per item (-1 missing) and the answer code behind every level
+    codes = np.full((len(df), len(items)), -1, dtype=np.int8)
+    levels = []
+    for j, col in enumerate(items):
+        values = df[col].where(valid_mask(df[col], col)).to_numpy(dtype=float)
+        present = ~np.isnan(values)
+        item_levels, inverse = np.unique(values[present], return_inverse=True)
+        codes[present, j] = inverse
+        levels.append(item_levels)
+    return codes, levels
+
+def collapse_patterns(codes, weights):
+    # unique answer patterns, their summed weights and each respondent's pattern index; rows are keyed
+    # as one mixed-radix int64 when the patterns fit, else fall back to a row-wise unique
+    radix = codes.max(axis=0).astype(np.int64) + 2
+    if np.sum(np.log2(radix)) < 62:
+        keys = np.zeros(len(codes), dtype=np.int64)
+        for j, base in enumerate(radix):
+            keys = keys * base + (codes[:, j].astype(np.int64) + 1)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        patterns = codes[first]
+    else:
+        patterns, inverse = np.unique(codes, axis=0, return_inverse=True)
+    return patterns, np.bincount(inverse, weights=weights, minlength=len(patterns)), inverse.reshape(-1)
+
+# --- latent class analysis ---
+
+def _one_hot(patterns, n_levels):
+    # sparse pattern x (item, level) indicator; missing answers have no entry so they drop out of the
+    # likelihood, and the e and m steps become one sparse product each
+    from scipy import sparse
+    offsets = np.cumsum([0] + list(n_levels))
+    rows, cols = np.nonzero(patterns >= 0)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, offsets[cols] + patterns[rows, cols])),
+                             shape=(len(patterns), offsets[-1])), offsets
+
+def _lca_posterior(onehot, prior, theta):
+    # class posteriors (P x C) and each pattern's log likelihood
+    joint = onehot @ np.log(theta) + np.log(prior)
+    top = joint.max(axis=1, keepdims=True)
+    marginal = top[:, 0] + np.log(np.exp(joint - top).sum(axis=1))
+    return np.exp(joint - marginal[:, None]), marginal
+
+def _lca_fit(onehot, offsets, freq, n_classes, seed, start=None, max_iter=em_iterations):
+    # em from random dirichlet item probabilities (or a previous fit); theta stacks every item's
+    # level x class probabilities into one (levels, C) array
+    if start is None:
+        rng = np.random.default_rng(seed)
+        prior = np.full(n_classes, 1 / n_classes)
+        theta = np.vstack([rng.dirichlet(np.ones(b - a), size=n_classes).T for a, b in zip(offsets[:-1], offsets[1:])])
+    else:
+        prior, theta = start['prior'], start['theta']
+    previous = -np.inf
+    for iteration in range(1, max_iter + 1):
+        posterior, marginal = _lca_posterior(onehot, prior, theta)
+        loglik = float(freq @ marginal)
+        posterior *= freq[:, None]
+        prior = posterior.sum(axis=0) / freq.sum()
+        counts = onehot.T @ posterior
+        for a, b in zip(offsets[:-1], offsets[1:]):
+            block = np.maximum(counts[a:b], min_probability * counts[a:b].sum(axis=0).clip(min=1e-300))
+            theta[a:b] = block / block.sum(axis=0)
+        if abs(loglik - previous) < em_tol * abs(loglik):
+            break
+        previous = loglik
+    return {'loglik': loglik, 'prior': prior, 'theta': theta, 'iterations': iteration, 'seed': int(seed)}
+
+# --- mini-batch k-modes ---
+
+def _mismatch(rows, modes):
+    # observed answers that differ from each mode (rows x modes)
+    observed = rows >= 0
+    return np.sum((rows[:, None, :] != modes[None, :, :]) & observed[:, None, :], axis=2)
+
+def _kmodes_fit(patterns, freq, n_levels, n_clusters, seed):
+    rng = np.random.default_rng(seed)
+    p = freq / freq.sum()
+    modes = patterns[rng.choice(len(patterns), size=n_clusters, replace=len(patterns) < n_clusters, p=p)].copy()
+    # fill a starting mode's missing answers with the item's most common answer
+    for j, k in enumerate(n_levels):
+        observed = patterns[:, j] >= 0
+        common = np.argmax(np.bincount(patterns[observed, j], weights=freq[observed], minlength=k))
+        modes[modes[:, j] < 0, j] = common
+    counts = [np.zeros((n_clusters, k)) for k in n_levels]
+    stable = 0
+    for iteration in range(1, kmodes_iterations + 1):
+        batch = patterns[rng.choice(len(patterns), size=kmodes_batch, p=p)]
+        assigned = np.argmin(_mismatch(batch, modes), axis=1)
+        new_modes = modes.copy()
+        for j, k in enumerate(n_levels):
+            observed = batch[:, j] >= 0
+            counts[j] += np.bincount(assigned[observed] * k + batch[observed, j], minlength=n_clusters * k).reshape(n_clusters, k)
+            seen = counts[j].sum(axis=1) > 0
+            new_modes[seen, j] = np.argmax(counts[j][seen], axis=1)
+        stable = stable + 1 if np.array_equal(new_modes, modes) else 0
+        modes = new_modes
+        if stable >= 5:
+            break
+    distance = _mismatch_chunked(patterns, modes)
+    assigned = np.argmin(distance, axis=1)
+    return {'cost': float(freq @ distance[np.arange(len(patterns)), assigned]), 'modes': modes,
+            'iterations': iteration, 'seed': int(seed)}
+
+def _mismatch_chunked(patterns, modes, chunk=200_000):
+    return np.concatenate([_mismatch(patterns[start:start + chunk], modes) for start in range(0, len(patterns), chunk)])
+
+_worker_state = {}
+
+def _init_worker(state):
+    _worker_state.clear()
+    _worker_state.update(state)
+
+def _fit_restart(task):
+    method, n_segments, seed = task
+    state = _worker_state
+    if method == 'kmodes':
+        return _kmodes_fit(state['patterns'], state['freq'], state['n_levels'], n_segments, seed)
+    if 'onehot' not in state:
+        state['onehot'], state['offsets'] = _one_hot(state['patterns'], state['n_levels'])
+    return _lca_fit(state['onehot'], state['offsets'], state['freq'], n_segments, seed, max_iter=screen_iterations)
+
+def _run_restarts(state, method, n_segments, restarts, processes, seed):
+    seeds = np.random.SeedSequence(seed).generate_state(restarts)
+    tasks = [(method, n_segments, s) for s in seeds]
+    processes = processes or min(restarts, os.cpu_count() or 1)
+    if processes <= 1:
+        _init_worker(state)
+        return [_fit_restart(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context(), initializer=_init_worker,
+                             initargs=(state,)) as pool:
+        return list(pool.map(_fit_restart, tasks))
+
+def _profile(items, levels, member_weights, patterns, freq):
+    # per segment item distributions (weighted, observed answers only) labelled from ans_dict
+    profile = {}
+    for j, col in enumerate(items):
+        observed = patterns[:, j] >= 0
+        dist = np.bincount(patterns[observed, j], weights=(member_weights * freq)[observed], minlength=len(levels[j]))
+        total = dist.sum()
+        profile[col] = {value_label(col, code): float(share) for code, share in
+                        zip(levels[j], dist / total if total else dist)}
+    return profile
+
+@profiled
+def fit_segments(df, items=None, method='lca', n_segments=default_classes, restarts=default_restarts,
+                 processes=None, seed=0):
+    """
+    weighted lca ('lca') or mini-batch k-modes ('kmodes') on the collapsed answer patterns.
+    returns a per-respondent segment Series (nan for rows without a weight) and a report with fit
+    statistics and each segment's weighted share and labelled item profile
+    """
+    if method not in ('lca', 'kmodes'):
+        raise ValueError(f"Unknown segmentation method '{method}', expected lca or kmodes")
+    items = items or segment_items(df)
+    weights = df['weight'].to_numpy(dtype=float) if 'weight' in df.columns else np.ones(len(df))
+    usable = ~np.isnan(weights) & (weights > 0)
+    codes, levels = encode_items(df.loc[usable], items)
+    answered = (codes >= 0).any(axis=1)
+    patterns, freq, inverse = collapse_patterns(codes[answered], weights[usable][answered])
+    n_levels = [len(item_levels) for item_levels in levels]
+    state = {'patterns': patterns, 'freq': freq, 'n_levels': n_levels}
+
+    fits = _run_restarts(state, method, n_segments, restarts, processes, seed)
+    if method == 'lca':
+        onehot, offsets = _one_hot(patterns, n_levels)
+        screened = max(fits, key=lambda fit: fit['loglik'])
+        best = _lca_fit(onehot, offsets, freq, n_segments, screened['seed'], start=screened)
+        posterior, _ = _lca_posterior(onehot, best['prior'], best['theta'])
+        assigned = np.argmax(posterior, axis=1)
+        n_params = (n_segments - 1) + n_segments * sum(k - 1 for k in n_levels)
+        n_eff = int(answered.sum())
+        entropy = -np.sum(freq[:, None] * posterior * np.log(np.maximum(posterior, 1e-300)))
+        fit_stats = {
+            'loglik': best['loglik'], 'parameters': n_params,
+            'aic': -2 * best['loglik'] / freq.sum() * n_eff + 2 * n_params,
+            'bic': -2 * best['loglik'] / freq.sum() * n_eff + np.log(n_eff) * n_params,
+            'entropy_r2': float(1 - entropy / (freq.sum() * np.log(n_segments))) if n_segments > 1 else 1.0,
+            'iterations': screened['iterations'] + best['iterations'],
+            'screen_logliks': sorted((fit['loglik'] for fit in fits), reverse=True)
+        }
+        member = posterior
+    else:
+        best = min(fits, key=lambda fit: fit['cost'])
+        assigned = np.argmin(_mismatch_chunked(patterns, best['modes']), axis=1)
+        fit_stats = {'cost': best['cost'], 'mean_mismatch': best['cost'] / freq.sum(),
+                     'restart_costs': sorted(fit['cost'] for fit in fits)}
+        member = np.eye(n_segments)[assigned]
+
+    # largest segment first so labels are stable across restarts
+    share = (member * freq[:, None]).sum(axis=0) / freq.sum()
+    order = np.argsort(-share, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(n_segments)
+
+    segments = {}
+    for position, segment in enumerate(order):
+        entry = {'share': float(share[segment]), 'profile': _profile(items, levels, member[:, segment], patterns, freq)}
+        if method == 'kmodes':
+            entry['mode'] = {col: value_label(col, levels[j][best['modes'][segment, j]]) for j, col in enumerate(items)}
+        segments[position + 1] = entry
+
+    labels = np.full(len(df), np.nan)
+    rows = np.flatnonzero(usable)[answered]
+    labels[rows] = rank[assigned[inverse]] + 1
+    report = {'method': method, 'segments_requested': n_segments, 'items': items, 'respondents': int(answered.sum()),
+              'patterns': int(len(patterns)), 'restarts': restarts, 'fit': fit_stats, 'segments': segments}
+    return pd.Series(labels, index=df.index, name=f'{method}_segment'), report
+
+def main(argv=None):
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    parser = argparse.ArgumentParser(description='Weighted respondent segments over the categorical LGBTQ+ items')
+    parser.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    parser.add_argument('--method', default='lca', choices=['lca', 'kmodes'])
+    parser.add_argument('--segments', default=str(default_classes), help="number of segments, or a range like 2-6 to compare")
+    parser.add_argument('--restarts', type=int, default=default_restarts)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--output', default='anes_segments.csv', help='case_id and segment per respondent')
+    parser.add_argument('--json', default='anes_segments.json')
+    args = parser.parse_args(argv)
+
+    low, _, high = args.segments.partition('-')
+    counts = list(range(int(low), int(high or low) + 1))
+    df, column_mapping = load_and_prepare_data(args.csv, var_dict, backend=args.backend)
+    reports = {}
+    for count in counts:
+        labels, report = fit_segments(df, method=args.method, n_segments=count, restarts=args.restarts,
+                                      processes=args.processes, seed=args.seed)
+        reports[count] = report
+        stat = f"bic {report['fit']['bic']:,.1f}" if args.method == 'lca' else f"cost {report['fit']['cost']:,.1f}"
+        shares = ', '.join(f"{entry['share']:.1%}" for entry in report['segments'].values())
+        print(f"{count} segments: {stat}; shares {shares} ({report['patterns']:,} patterns from {report['respondents']:,} respondents)")
+    # the written assignment is the last fit, or the lowest bic when comparing lca solutions
+    if args.method == 'lca' and len(counts) > 1:
+        count = min(reports, key=lambda c: reports[c]['fit']['bic'])
+        labels, _ = fit_segments(df, method='lca', n_segments=count, restarts=args.restarts,
+                                 processes=args.processes, seed=args.seed)
+    id_col = df[['case_id']] if 'case_id' in df.columns else pd.DataFrame(index=df.index)
+    id_col.assign(**{labels.name: labels}).to_csv(args.output, index=False)
+    with open(args.json, 'w') as f:
+        json.dump(reports, f, indent=2, default=str)
+    print(f"Saved: {args.output}, {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from data.dicts import var_dict, theme_dict
+from data.weights import weights_dict, priority_order
+from anes_backend import load_designs, mp_context
+from anes_profiling import profiled
+from anes_labels import value_label
+
+# every estimate recomputed under each weights_dict design (and the priority-order assignment the
+# pipeline uses), each restricted to the respondents that design covers. the item columns live once in
+# shared memory; workers map them instead of receiving a pickled copy per design
+
+assigned_design = 'assigned'
+min_design_n = 100  # designs covering fewer respondents are listed but not estimated
+flag_threshold = 1.0  # flag estimates whose spread across designs exceeds this many standard errors
+
+def assign_priority(designs, priority=None):
+    # the pipeline's own choice: first usable design per respondent in priority order
+    priority = priority or priority_order
+    first = designs[priority[0]]
+    assigned = pd.DataFrame(np.nan, index=first.index, columns=first.columns)
+    for name in priority:
+        take = assigned['weight'].isna() & designs[name]['weight'].notna()
+        assigned[take] = designs[name][take]
+    return assigned
+
+def key_estimates(results):
+    # samplics_analysis output -> {(var, 'mean' or category): (estimate, se, n)}
+    flat = {}
+    for var, entry in results.items():
+        if entry.get('type') == 'continuous':
+            flat[(var, 'mean')] = (entry['mean'], entry.get('se'), entry.get('n'))
+        elif entry.get('type') == 'categorical':
+            for cat, values in entry['categories'].items():
+                flat[(var, cat)] = (values['proportion'], values.get('se'), entry.get('n'))
+    return flat
+
+def _estimate(items, design):
+    from anes_statistics import samplics_analysis
+    # copy-on-write keeps the concatenated columns as views of the shared block
+    frame = pd.concat([items, design], axis=1)
+    return key_estimates(samplics_analysis(frame))
+
+_worker_state = {}
+
+def _init_worker(block_name, shape, columns, n_items):
+    # map the shared block once; items and design columns are views into it
+    block = shared_memory.SharedMemory(name=block_name)
+    data = np.ndarray(shape, dtype=np.float64, buffer=block.buf, order='F')
+    _worker_state.update(block=block, data=data, columns=columns, n_items=n_items)
+
+def _estimate_design(name):
+    data, columns, n_items = _worker_state['data'], _worker_state['columns'], _worker_state['n_items']
+    # copy=False is still needed here: pandas 3 copies a numpy array passed to DataFrame by default
+    items = pd.DataFrame(data[:, :n_items], columns=columns[:n_items], copy=False)
+    start = columns.index(f'{name}:weight')
+    design = pd.DataFrame(data[:, start:start + 3], columns=['weight', 'psu', 'stratum'], copy=False)
+    return name, _estimate(items, design)
+
+def _share(items, designs):
+    # one column-major float64 block: the items, then weight/psu/stratum for every design
+    columns = list(items.columns) + [f'{name}:{part}' for name in designs for part in ('weight', 'psu', 'stratum')]
+    shape = (len(items), len(columns))
+    block = shared_memory.SharedMemory(create=True, size=max(1, shape[0] * shape[1] * 8))
+    data = np.ndarray(shape, dtype=np.float64, buffer=block.buf, order='F')
+    data[:, :items.shape[1]] = items.to_numpy(dtype=np.float64)
+    for idx, design in enumerate(designs.values()):
+        start = items.shape[1] + 3 * idx
+        data[:, start:start + 3] = design[['weight', 'psu', 'stratum']].to_numpy(dtype=np.float64)
+    return block, shape, columns
+
+@profiled
+def weight_sensitivity(items, designs, processes=None):
+    """
+    items: cleaned item frame; designs: {name: frame of weight, psu, stratum} (nan where not covered).
+    returns {design: {(var, category): (estimate, se, n)}} plus the eligible count per design
+    """
+    eligible = {name: int(design['weight'].notna().sum()) for name, design in designs.items()}
+    runnable = {name: design for name, design in designs.items() if eligible[name] >= min_design_n}
+    items = items.astype(np.float64)
+    processes = processes or min(len(runnable), os.cpu_count() or 1)
+    if processes <= 1 or len(runnable) <= 1:
+        return {name: _estimate(items, design) for name, design in runnable.items()}, eligible
+
+    import samplics.estimation  # noqa: F401  import once in the parent so forked workers share it
+    block, shape, columns = _share(items, runnable)
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=mp_context(), initializer=_init_worker,
+                                 initargs=(block.name, shape, columns, items.shape[1])) as pool:
+            results = dict(pool.map(_estimate_design, list(runnable)))
+    finally:
+        block.close()
+        block.unlink()
+    return {name: results[name] for name in runnable}, eligible
+
+def summarize_sensitivity(results, reference=assigned_design):
+    # one row per estimate: the reference design's value and the spread across the individual designs
+    keys = sorted({key for estimates in results.values() for key in estimates}, key=lambda k: (k[0], str(k[1])))
+    designs = [name for name in results if name != reference]
+    rows = []
+    for var, category in keys:
+        values = {name: results[name][(var, category)] for name in designs if (var, category) in results[name]}
+        if not values:
+            continue
+        estimates = np.array([v[0] for v in values.values()], dtype=float)
+        ses = np.array([v[1] for v in values.values() if v[1] is not None], dtype=float)
+        ref = results.get(reference, {}).get((var, category), (np.nan, None, None))
+        spread = float(estimates.max() - estimates.min())
+        typical_se = float(np.median(ses)) if len(ses) else np.nan
+        rows.append({
+            'variable': var,
+            'category': category,
+            'label': 'Mean' if category == 'mean' else value_label(var, float(category)),
+            'reference': ref[0],
+            'reference_se': ref[1],
+            'min': float(estimates.min()),
+            'max': float(estimates.max()),
+            'range': spread,
+            'sd': float(estimates.std(ddof=1)) if len(estimates) > 1 else 0.0,
+            'range_in_se': spread / typical_se if typical_se and typical_se > 0 else np.nan,
+            'designs': len(estimates),
+            'min_design': list(values)[int(estimates.argmin())],
+            'max_design': list(values)[int(estimates.argmax())]
+        })
+    table = pd.DataFrame(rows)
+    if not table.empty:
+        table['flagged'] = table['range_in_se'] > flag_threshold
+        table = table.sort_values('range_in_se', ascending=False, na_position='last').reset_index(drop=True)
+    return table
+
+def run_sensitivity(input_file='anes_2024.csv', variables=None, processes=None, backend=None):
+    # raw release -> per design estimates and the spread table
+    columns = {old: new for old, new in var_dict.items() if variables is None or new in variables}
+    items, designs = load_designs(input_file, columns, weights_dict, backend=backend)
+    designs = {assigned_design: assign_priority(designs), **designs}
+    results, eligible = weight_sensitivity(items, designs, processes=processes)
+    return results, eligible, summarize_sensitivity(results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recompute the estimates under every weights_dict design')
+    parser.add_argument('input', nargs='?', default='anes_2024.csv', help='raw ANES release (all design columns)')
+    parser.add_argument('--vars', default=None, help='comma separated items (default: transgender and gay items)')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--backend', default=None)
+    parser.add_argument('--output', default='anes_weight_sensitivity.csv')
+    parser.add_argument('--json', default='anes_weight_sensitivity.json')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    variables = args.vars.split(',') if args.vars else list(theme_dict['trans_qs']) + list(theme_dict['gay_qs'])
+    results, eligible, table = run_sensitivity(args.input, variables, args.processes, args.backend)
+    table.to_csv(args.output, index=False)
+    with open(args.json, 'w') as f:
+        json.dump({'eligible': eligible, 'reference': assigned_design, 'flag_threshold': flag_threshold,
+                   'estimates': {name: {f'{var}:{cat}': list(values) for (var, cat), values in estimates.items()}
+                                 for name, estimates in results.items()}}, f, indent=2, default=str)
+
+    print("Eligible respondents per design:")
+    for name, count in eligible.items():
+        print(f"  {name:<20} {count:>8,}{'' if name in results else '  (skipped)'}")
+    if table.empty:
+        print("No estimates to compare")
+        return 0
+    flagged = int(table['flagged'].sum())
+    print(f"\n{flagged} of {len(table)} estimates move by more than {flag_threshold:g} se across designs")
+    print(f"{'variable':<22}{'category':<10}{'reference':>10}{'min':>9}{'max':>9}{'range/se':>10}")
+    for row in table.head(args.top).itertuples():
+        print(f"{row.variable:<22}{str(row.category):<10}{row.reference:>10.3f}{row.min:>9.3f}{row.max:>9.3f}"
+              f"{row.range_in_se:>10.2f}{'  *' if row.flagged else ''}")
+    print(f"\nSaved: {args.output}, {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
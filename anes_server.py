@@ -0,0 +1,235 @@
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pandas as pd
+from data.dicts import var_dict, theme_dict
+from data.schema import design_cols, analysis_columns
+from anes_statistics import load_and_prepare_data, samplics_analysis
+from anes_descriptives import _analyze_question_group
+from anes_report import _to_json_safe
+from anes_labels import value_label
+from anes_bitmaps import BitmapIndex
+
+default_cache_size = 512
+
+class LRUCache:
+    # bounded query -> result memo shared by the handler threads
+    def __init__(self, maxsize=default_cache_size):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+def parse_domain(df, text, index=None):
+    # 'resp_partyid:1,2,3;int_mode:2' -> Selection of rows matching every clause
+    index = BitmapIndex(df, columns=[]) if index is None else index
+    selection = index.everything()
+    if not text:
+        return selection
+    for clause in text.split(';'):
+        if not clause.strip():
+            continue
+        col, _, codes = clause.partition(':')
+        col = col.strip()
+        if col not in df.columns:
+            raise KeyError(f"Unknown domain column '{col}'")
+        if not codes:
+            raise ValueError(f"Domain clause '{clause}' has no codes, expected column:code,code")
+        values = [float(code) if df[col].dtype.kind in 'iuf' else code.strip() for code in codes.split(',')]
+        selection &= index.isin(col, values)
+    return selection
+
+class AnesService:
+    def __init__(self, csv_file_path, cache_size=default_cache_size):
+        self.df, self.column_mapping = load_and_prepare_data(csv_file_path, var_dict)
+        # built once; every domain/where query after that is bitmap and/or/not
+        self.index = BitmapIndex(self.df)
+        self.cache = LRUCache(cache_size)
+        self.loaded = time.time()
+
+    def _check_vars(self, names):
+        missing = [name for name in names if name not in self.df.columns]
+        if missing:
+            raise KeyError(f"Unknown variable(s): {', '.join(missing)}")
+
+    def _selection(self, params):
+        # domain=col:codes;... and where=<expression> both restrict the rows; None when neither is given
+        if not params.get("domain") and not params.get("where"):
+            return None
+        selection = parse_domain(self.df, params.get("domain"), self.index)
+        if params.get("where"):
+            selection &= self.index.select(params["where"])
+        return selection
+
+    def _subset(self, params):
+        selection = self._selection(params)
+        return self.df if selection is None else selection.take(self.df)
+
+    def variables(self, params):
+        return {"rows": len(self.df), "themes": {theme: [col for col in cols if col in self.df.columns]
+                                                 for theme, cols in theme_dict.items()},
+                "variables": analysis_columns(self.df.columns)}
+
+    def frequencies(self, params):
+        names = params["var"].split(',')
+        self._check_vars(names)
+        subset = self._subset(params)
+        label = '; '.join(params[key] for key in ("domain", "where") if params.get(key))
+        return _analyze_question_group(subset, names, label or "All respondents")
+
+    def estimate(self, params):
+        # samplics_analysis with the domain flag, so the ses keep every psu
+        var = params["var"]
+        self._check_vars([var])
+        frame = self.df[[var] + [col for col in design_cols if col in self.df.columns]]
+        return samplics_analysis(frame, domain=self._selection(params)).get(var, {"error": f"Too few valid responses for '{var}'"})
+
+    def crosstab(self, params):
+        row, col = params["row"], params["col"]
+        self._check_vars([row, col])
+        subset = self._subset(params)
+        weights = subset['weight'] if 'weight' in subset.columns else pd.Series(1.0, index=subset.index)
+        valid = subset[row].notna() & subset[col].notna() & weights.notna()
+        table = pd.crosstab(subset.loc[valid, row], subset.loc[valid, col], values=weights[valid], aggfunc='sum').fillna(0)
+        counts = pd.crosstab(subset.loc[valid, row], subset.loc[valid, col])
+        total = table.values.sum()
+        return {
+            "row": row, "col": col, "n": int(valid.sum()),
+            "rows": table.index.tolist(), "cols": table.columns.tolist(),
+            "row_labels": [value_label(row, value) for value in table.index],
+            "col_labels": [value_label(col, value) for value in table.columns],
+            "weighted_n": table.values.tolist(),
+            "n_cells": counts.reindex(index=table.index, columns=table.columns, fill_value=0).values.tolist(),
+            "cell_percentages": (table / total * 100).values.tolist() if total else [],
+            "row_percentages": table.div(table.sum(axis=1), axis=0).mul(100).values.tolist(),
+            "col_percentages": table.div(table.sum(axis=0), axis=1).mul(100).values.tolist()
+        }
+
+    def subgroups(self, params):
+        var, by = params["var"], params["by"]
+        self._check_vars([var, by])
+        base = self._selection(params)
+        base = self.index.everything() if base is None else base
+        frame = self.df[[var] + [col for col in design_cols if col in self.df.columns]]
+        results = {}
+        for level in self.index.values(by):
+            domain = base & self.index.eq(by, level)
+            if not domain.count():
+                continue
+            estimates = samplics_analysis(frame, domain=domain)
+            if var in estimates:
+                results[level] = estimates[var]
+        return {"var": var, "by": by, "subgroups": results, "labels": {level: value_label(by, level) for level in results}}
+
+    def health(self, params):
+        return {"status": "ok", "rows": len(self.df), "uptime_s": round(time.time() - self.loaded, 1),
+                "cache": self.cache.stats()}
+
+    # endpoint -> (method, required query params, cached)
+    routes = {
+        "/health": ("health", [], False),
+        "/variables": ("variables", [], True),
+        "/frequencies": ("frequencies", ["var"], True),
+        "/mean": ("estimate", ["var"], True),
+        "/proportions": ("estimate", ["var"], True),
+        "/crosstab": ("crosstab", ["row", "col"], True),
+        "/subgroups": ("subgroups", ["var", "by"], True)
+    }
+
+    def handle(self, path, params):
+        if path not in self.routes:
+            raise LookupError(f"Unknown endpoint '{path}', try one of {', '.join(self.routes)}")
+        method, required, cached = self.routes[path]
+        missing = [name for name in required if not params.get(name)]
+        if missing:
+            raise ValueError(f"{path} needs query parameter(s): {', '.join(missing)}")
+        if not cached:
+            return getattr(self, method)(params)
+        # /mean and /proportions share a result, so key on the method not the path
+        key = (method, tuple(sorted(params.items())))
+        result = self.cache.get(key)
+        if result is None:
+            result = _to_json_safe(getattr(self, method)(params))
+            self.cache.put(key, result)
+        return result
+
+def make_handler(service):
+    class AnesHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            start = time.perf_counter()
+            try:
+                code, body = 200, service.handle(url.path.rstrip('/') or '/health', params)
+            except LookupError as e:
+                code, body = 404, {"error": e.args[0] if e.args else str(e)}
+            except ValueError as e:
+                code, body = 400, {"error": str(e)}
+            except Exception as e:
+                code, body = 500, {"error": f"{type(e).__name__}: {e}"}
+            payload = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.send_header("X-Elapsed-Ms", f"{(time.perf_counter() - start) * 1000:.2f}")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            if not self.server.quiet:
+                super().log_message(format, *args)
+    return AnesHandler
+
+def serve(csv_file_path="lgbt_anes.csv", host="127.0.0.1", port=8765, cache_size=default_cache_size, quiet=False):
+    service = AnesService(csv_file_path, cache_size)
+    # samplics is slow to import, pay for it before the first request rather than during it
+    import samplics.estimation  # noqa: F401
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    server.quiet = quiet
+    print(f"Serving {len(service.df):,} respondents from {csv_file_path} on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local JSON service for weighted ANES estimates')
+    parser.add_argument('csv', nargs='?', default='lgbt_anes.csv')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=default_cache_size)
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+    return serve(args.csv, args.host, args.port, args.cache_size, args.quiet)
+
+if __name__ == "__main__":
+    sys.exit(main())
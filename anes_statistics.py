@@ -1,11 +1,26 @@
 import pandas as pd
 import numpy as np
-from samplics.estimation import TaylorEstimator
-from samplics.utils.types import PopParam
+from anes_profiling import profiled
+from anes_backend import read_csv, read_csv_chunks, read_header
+from data.schema import kind_of, theme_columns, analysis_columns, compact_frame, valid_mask as schema_valid_mask
+from anes_bitmaps import as_mask
+from anes_memory import plan, memory_budget, weighted_moments, estimate_csv_rows, float_bytes
 
-def load_and_prepare_data(csv_file_path, var_dict):
+@profiled
+def load_and_prepare_data(csv_file_path, var_dict, columns=None, filters=None, backend=None):
+    # columns/filters use the file's own column names and are pushed into the scan when the backend can.
+    # over the memory budget the file is read in row chunks, each downcast to the codebook's compact
+    # dtypes before the next one is parsed, so no full float64 frame ever exists
     column_mapping = var_dict
-    df = pd.read_csv(csv_file_path)
+    decision = {'strategy': 'in_memory'}
+    if memory_budget() is not None:
+        n_columns = len(columns) if columns is not None else len(read_header(csv_file_path))
+        decision = plan('load_and_prepare_data', estimate_csv_rows(csv_file_path), 2 * float_bytes * n_columns)
+    if decision['strategy'] == 'chunked':
+        chunks = read_csv_chunks(csv_file_path, columns=columns, filters=filters, chunk_rows=decision['chunk_rows'])
+        df = pd.concat([compact_frame(chunk.rename(columns=column_mapping)) for chunk in chunks], ignore_index=True)
+        return df, column_mapping
+    df = read_csv(csv_file_path, columns=columns, filters=filters, backend=backend)
     existing_cols = {old: new for old, new in column_mapping.items() if old in df.columns}
     df_renamed = df.rename(columns=existing_cols)
     return df_renamed, column_mapping
@@ -16,7 +31,7 @@ def basic_descriptive_stats(df, theme_dict):
     
     trans_cols = [col for col in trans_questions if col in df.columns]
     gay_cols = [col for col in gay_questions if col in df.columns]
-    demo_cols = [col for col in df.columns if col.startswith('resp_')]
+    demo_cols = theme_columns(df.columns, 'demographics')
 
     for group_name, cols in [("Transgender Questions", trans_cols), 
                              ("Gay/LGB Questions", gay_cols), 
@@ -27,45 +42,76 @@ def basic_descriptive_stats(df, theme_dict):
                 missing_count = df[col].isna().sum()
     return trans_cols, gay_cols, demo_cols
 
-def samplics_analysis(df): # using samplics taylorestimator + fallback
+def _taylor_estimate(estimator, y, weights, design, domain=None):
+    # samplics >= 0.4 stores results on the estimator and estimate() returns None
+    kwargs = {"y": y, "samp_weight": weights, "remove_nan": True}
+    if design is not None:
+        kwargs.update(design)
+    if domain is not None:
+        # out-of-domain rows only count towards the psu totals; a constant 1 keeps samplics' cv from dividing by 0
+        kwargs["y"] = y.where(domain, 1.0)
+        kwargs["domain"] = domain
+    result = estimator.estimate(**kwargs)
+    source = result if result is not None and hasattr(result, 'point_est') else estimator
+    point, se = source.point_est, getattr(source, 'stderror', None)
+    if domain is not None:
+        point = point.get(True) if isinstance(point, dict) else None
+        se = se.get(True) if isinstance(se, dict) else None
+    return point, se
+
+@profiled
+def samplics_analysis(df, domain=None): # using samplics taylorestimator + fallback
+    # samplics takes ~2s to import, so only pay for it when estimating
+    # domain: bool mask, bitmap Selection or where-expression; rows outside still count towards the psus
+    from samplics.estimation import TaylorEstimator
+    from samplics.utils.types import PopParam, SinglePSUEst
+
     weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
+    # strata/psu give design-based (taylor linearized) ses; domain keeps every psu in the variance
+    has_design = 'psu' in df.columns and 'stratum' in df.columns
+    design_mask = df['psu'].notna() & df['stratum'].notna() if has_design else pd.Series(True, index=df.index)
+    domain = as_mask(domain, df)
+    in_domain = pd.Series(True, index=df.index) if domain is None else domain
 
-    analysis_vars = []
-    for col in df.columns:
-        if col in ['weight', 'case_id', 'int_mode', 'prepost_status', 'sample_type', 'psu', 'stratum', 'sample_mode']:
-            continue
-        if df[col].dtype in ['object', 'string']:
-            continue
-        analysis_vars.append(col)
+    analysis_vars = [col for col in analysis_columns(df.columns) if df[col].dtype not in ['object', 'string']]
     
     results = {}
 
     for var in analysis_vars:
-        valid_mask = df[var].notna() & weights.notna()
+        valid_mask = df[var].notna() & weights.notna() & in_domain
         if valid_mask.sum() <= 10:
             continue
+        kind = kind_of(var)
         
         try:
             if not pd.api.types.is_numeric_dtype(df[var]):
                 continue
+
+            base_mask = weights.notna() & design_mask if domain is not None else valid_mask & design_mask
+            design = {"stratum": df.loc[base_mask, 'stratum'], "psu": df.loc[base_mask, 'psu'],
+                      "single_psu": SinglePSUEst.skip} if has_design else None
                 
-            if "therm" in var:
-                therm_mask = valid_mask & (df[var] >= 0) & (df[var] <= 100)
+            if kind in ('thermometer', 'continuous'):
+                therm_mask = valid_mask & schema_valid_mask(df[var], var)
                 if therm_mask.sum() <= 10:
                     continue
                     
                 taylor_est = TaylorEstimator(PopParam.mean)
-                mean_est = taylor_est.estimate(
-                    y=df.loc[therm_mask, var].astype(float),
-                    samp_weight=weights.loc[therm_mask].astype(float),
-                    remove_nan=True
-                )
+                if domain is not None:
+                    point, se = _taylor_estimate(taylor_est, df.loc[base_mask, var].astype(float),
+                                                 weights.loc[base_mask].astype(float), design, therm_mask.loc[base_mask])
+                else:
+                    base_mask = therm_mask & design_mask
+                    design = {"stratum": df.loc[base_mask, 'stratum'], "psu": df.loc[base_mask, 'psu'],
+                              "single_psu": SinglePSUEst.skip} if has_design else None
+                    point, se = _taylor_estimate(taylor_est, df.loc[base_mask, var].astype(float),
+                                                 weights.loc[base_mask].astype(float), design)
                 
-                if mean_est is not None and hasattr(mean_est, 'point_est'):
+                if point is not None:
                     results[var] = {
                         "type": "continuous",
-                        "mean": float(mean_est.point_est),
-                        "se": float(mean_est.stderror) if hasattr(mean_est, 'stderror') else None,
+                        "mean": float(point),
+                        "se": float(se) if se is not None else None,
                         "n": int(therm_mask.sum())
                     }
                 else:
@@ -85,23 +131,21 @@ def samplics_analysis(df): # using samplics taylorestimator + fallback
                     continue
                     
                 cat_results = {}
-                for cat in numeric_categories:
+                for cat in sorted(numeric_categories):
                     cat_mask = valid_mask & (df[var] == cat)
                     if cat_mask.sum() < 5:
                         continue
                         
-                    y_binary = cat_mask.astype(int)
-                    taylor_est = TaylorEstimator(PopParam.ratio)
-                    prop_est = taylor_est.estimate(
-                        y=y_binary.astype(float),
-                        samp_weight=weights.astype(float),
-                        remove_nan=True
-                    )
+                    # share of valid responses in this category
+                    y_binary = cat_mask.loc[base_mask].astype(float)
+                    taylor_est = TaylorEstimator(PopParam.mean)
+                    point, se = _taylor_estimate(taylor_est, y_binary, weights.loc[base_mask].astype(float), design,
+                                                 valid_mask.loc[base_mask] if domain is not None else None)
                     
-                    if prop_est is not None and hasattr(prop_est, 'point_est'):
+                    if point is not None:
                         cat_results[float(cat)] = {
-                            "proportion": float(prop_est.point_est),
-                            "se": float(prop_est.stderror) if hasattr(prop_est, 'stderror') else None
+                            "proportion": float(point),
+                            "se": float(se) if se is not None else None
                         }
                 
                 if cat_results:
@@ -113,8 +157,8 @@ def samplics_analysis(df): # using samplics taylorestimator + fallback
                     
         except Exception as e:
             try:
-                if "therm" in var:
-                    therm_data = df.loc[valid_mask & (df[var] >= 0) & (df[var] <= 100), var]
+                if kind in ('thermometer', 'continuous'):
+                    therm_data = df.loc[valid_mask & schema_valid_mask(df[var], var), var]
                     if len(therm_data) > 0:
                         results[var] = {
                             "type": "continuous",
@@ -138,17 +182,15 @@ def samplics_analysis(df): # using samplics taylorestimator + fallback
 
     return results
 
+@profiled
 def calculate_weighted_mean(series, weights):
-    valid_mask = series.notna() & weights.notna()
-    if valid_mask.sum() == 0:
-        return np.nan
-    return np.average(series[valid_mask], weights=weights[valid_mask])
+    # streamed in chunks when the float copies would not fit the memory budget
+    decision = plan('calculate_weighted_mean', len(series), 4 * float_bytes)
+    count, total, mean, _ = weighted_moments(series, weights, decision['chunk_rows'])
+    return mean if count else np.nan
 
+@profiled
 def calculate_weighted_std(series, weights):
-    valid_mask = series.notna() & weights.notna()
-    if valid_mask.sum() <= 1:
-        return np.nan
-    
-    weighted_mean = calculate_weighted_mean(series, weights)
-    variance = np.average((series[valid_mask] - weighted_mean)**2, weights=weights[valid_mask])
-    return np.sqrt(variance)
\ No newline at end of file
+    decision = plan('calculate_weighted_std', len(series), 4 * float_bytes)
+    count, total, mean, variance = weighted_moments(series, weights, decision['chunk_rows'])
+    return np.sqrt(variance) if count > 1 else np.nan
@@ -0,0 +1,74 @@
+# plain-python summary text so quick cli commands don't pay for pandas
+
+def format_results_summary(descriptive_stats):
+    lines = []
+    metadata = descriptive_stats['metadata']
+    lines.append(f"Analysis Date: {metadata['analysis_date']}")
+    lines.append(f"Total Respondents: {metadata['total_respondents']:,}")
+    if metadata.get('selection'):
+        lines.append(f"Selection: {metadata['selection']}")
+    lines.append(f"Total Variables: {metadata['total_variables']}")
+    lines.append("")
+    
+    for group_name in ['transgender_questions', 'gay_lgb_questions']:
+        group_data = descriptive_stats[group_name]
+        lines.append(f"{group_data['group_info']['name']} Questions:")
+        lines.append(f"  Total questions: {group_data['group_info']['total_questions']}")
+        lines.append(f"  Questions with data: {group_data['group_info']['questions_with_data']}")
+        
+        if group_data['questions']:
+            response_rates = {q: stats['response_rate'] 
+                            for q, stats in group_data['questions'].items()}
+            highest = max(response_rates, key=response_rates.get)
+            lowest = min(response_rates, key=response_rates.get)
+            
+            lines.append(f"  Highest response rate: {highest} ({response_rates[highest]:.1f}%)")
+            lines.append(f"  Lowest response rate: {lowest} ({response_rates[lowest]:.1f}%)")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+def print_summary_report(stats_dict): 
+    print("Summary Report:")   
+    # metadata
+    metadata = stats_dict["metadata"]
+    print(f"\nAnalysis Date: {metadata['analysis_date']}")
+    print(f"Total Respondents: {metadata['total_respondents']:,}")
+    if metadata.get('selection'):
+        print(f"Selection: {metadata['selection']}")
+    print(f"Total Variables: {metadata['total_variables']}")
+    
+    # data quality
+    quality = stats_dict["summary_statistics"]["data_quality"]
+    print(f"\nData Quality:")
+    print(f"  Complete cases: {quality['complete_cases']:,} ({quality['complete_cases']/metadata['total_respondents']*100:.1f}%)")
+    print(f"  Partially complete: {quality['partially_complete_cases']:,} ({quality['partially_complete_cases']/metadata['total_respondents']*100:.1f}%)")
+    print(f"  Completely missing: {quality['completely_missing_cases']:,} ({quality['completely_missing_cases']/metadata['total_respondents']*100:.1f}%)")
+    
+    # question groups
+    print(f"\nQuestion Groups:")
+    for group_name, group_data in stats_dict["summary_statistics"]["question_group_summary"].items():
+        print(f"  {group_name.title()}:")
+        print(f"    Questions: {group_data['total_questions']}")
+        print(f"    Avg response rate: {group_data['avg_response_rate']:.1f}%")
+        print(f"    High missingness (>50%): {group_data['questions_with_high_missingness']}")
+    
+    # weights
+    weights_info = stats_dict["summary_statistics"]["weights_info"]
+    print(f"\nWeights:")
+    if weights_info["has_weights"]:
+        weight_stats = weights_info["weight_statistics"]
+        print(f"  Available: Yes")
+        print(f"  Mean weight: {weight_stats['mean']:.3f}")
+        print(f"  Weight range: {weight_stats['min']:.3f} - {weight_stats['max']:.3f}")
+        print(f"  Total weighted N: {weight_stats['total_weighted_n']:,.0f}")
+    else:
+        print(f"  Available: No")
+
+    # design effects (older json files don't have them)
+    design_effects = stats_dict.get("design_effects")
+    if design_effects:
+        print(f"\nDesign Effects:")
+        for label, section in design_effects["domains"].items():
+            print(f"  {label}: kish deff {section['kish_deff']}, effective n {section['kish_effective_n']:,} "
+                  f"of {section['respondents']:,}")
+        print(f"  Estimates with effective n < {design_effects['threshold']:g}: {len(design_effects['flagged'])}")
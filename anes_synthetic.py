@@ -0,0 +1,205 @@
+"""
+synthetic anes-like respondents for load testing
+writes the raw anes_2024.csv layout or the processed lgbt_anes.csv layout in chunks
+"""
+import sys
+import argparse
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from data.dicts import var_dict, ans_dict, direction_dict
+from data.weights import weights_dict, priority_order
+from data.schema import is_thermometer
+
+# respondent mix, roughly the 2024 release
+sample_type_shares = {1: 0.39, 2: 0.42, 3: 0.19}  # 3 = panel re-interviews
+int_mode_shares = {1: 0.17, 2: 0.77, 3: 0.045, 4: 0.015}  # ftf, web, papi, phone
+post_complete_rate = 0.9
+fresh_strata, panel_strata = 84, 50  # fresh strata 1-84, panel strata 85-134, two psus each
+weight_cap = 5.0
+# fixed per-stratum weight multipliers so every chunk shares the same design
+stratum_effects = np.exp(np.random.default_rng(2024).normal(0, 0.3, fresh_strata + panel_strata + 1))
+
+# which respondents each weights_dict design covers (post-complete only)
+design_rules = {
+    'ftf': {'modes': (1,), 'panel': False},
+    'web': {'modes': (2,), 'panel': False},
+    'ftf_web': {'modes': (1, 2), 'panel': False},
+    'web_papi': {'modes': (2, 3), 'panel': False},
+    'ftf_web_papi': {'modes': (1, 2, 3), 'panel': False},
+    'panel': {'modes': (), 'panel': True},
+    'panel_ftf_web_papi': {'modes': (1, 2, 3), 'panel': True},
+    'ftf_web_panel': {'modes': (1, 2), 'panel': True}
+}
+
+# share of respondents routed past an item (split samples / skip patterns)
+inapplicable_rates = {
+    'trans_sports_post': 0.96,
+    'gay_marriage': 0.5,
+    'trans_military': 0.02,
+    'trans_sports_prepost': 0.01
+}
+
+# non-attitude items: probabilities over the positive codes
+item_shares = {
+    'trans_id': [0.01, 0.99],
+    'trans_contact': [0.19, 0.81],
+    'gay_id': [0.9, 0.03, 0.05, 0.02],
+    'gay_contact': [0.67, 0.33],
+    'gay_elect': [0.08, 0.12, 0.3, 0.17, 0.33],
+    'resp_race': [0.64, 0.11, 0.13, 0.05, 0.03, 0.04],
+    'resp_partyid': [0.2, 0.12, 0.12, 0.12, 0.1, 0.11, 0.23]
+}
+
+refusal_rate = 0.015
+partial_rate = 0.005
+sentinel_rates = {998: 0.01, 999: 0.005}
+
+def _draw(rng, codes, shares, size):
+    shares = np.asarray(shares, dtype=float)
+    return np.asarray(codes)[rng.choice(len(codes), size=size, p=shares / shares.sum())]
+
+def _ordinal_from_latent(score, codes):
+    # equal-probability cut points of a standard normal, so marginals stay spread across the scale
+    cuts = [NormalDist(0, 1.25).inv_cdf(k / len(codes)) for k in range(1, len(codes))]
+    return np.asarray(codes)[np.searchsorted(cuts, score)]
+
+def _apply_missing(rng, values, col, post_complete):
+    codes = ans_dict.get(col, {})
+    n = len(values)
+    refusals = [c for c in (-9, -8, -2) if c in codes]
+    if refusals:
+        mask = rng.random(n) < refusal_rate
+        values[mask] = rng.choice(refusals, size=mask.sum())
+    if col in inapplicable_rates and -1 in codes:
+        values[rng.random(n) < inapplicable_rates[col]] = -1
+    if -6 in codes:
+        partials = [c for c in (-5, -7) if c in codes]
+        if partials:
+            mask = post_complete & (rng.random(n) < partial_rate)
+            values[mask] = rng.choice(partials, size=mask.sum())
+        values[~post_complete] = -6
+    return values
+
+def generate_chunk(n, seed=None, start_id=200001):
+    # respondent-level raw codes for one chunk; every column is a numpy array
+    rng = np.random.default_rng(seed)
+    chunk = {'case_id': np.arange(start_id, start_id + n)}
+
+    sample_type = _draw(rng, list(sample_type_shares), list(sample_type_shares.values()), n)
+    int_mode = _draw(rng, list(int_mode_shares), list(int_mode_shares.values()), n)
+    is_panel = sample_type == 3
+    post_complete = rng.random(n) < post_complete_rate
+    chunk['int_mode'] = int_mode
+    chunk['prepost_status'] = np.where(post_complete, 2, 1)
+    chunk['sample_type'] = sample_type
+
+    # design: strata nested in fresh/panel samples, two psus per stratum, weights skewed by stratum
+    stratum = np.where(is_panel, fresh_strata + rng.integers(1, panel_strata + 1, n), rng.integers(1, fresh_strata + 1, n))
+    psu = rng.integers(1, 3, n)
+    base_weight = rng.lognormal(-0.45, 0.8, n) * stratum_effects[stratum]
+    for design, rule in design_rules.items():
+        eligible = post_complete & ((~is_panel & np.isin(int_mode, rule['modes'])) | (is_panel & rule['panel']))
+        spec_weight = np.minimum(base_weight * rng.lognormal(0, 0.1, n), weight_cap)
+        chunk[f'{design}_weight'] = np.where(eligible, spec_weight, np.nan)
+        chunk[f'{design}_psu'] = np.where(eligible, psu, np.nan)
+        chunk[f'{design}_stratum'] = np.where(eligible, stratum, np.nan)
+
+    # one latent support dimension, pulled by party id, drives all attitude items
+    partyid = _draw(rng, range(1, 8), item_shares['resp_partyid'], n)
+    support = -0.35 * (partyid - 4) + rng.normal(0, 1, n)
+
+    for col in var_dict.values():
+        if col in chunk:
+            continue
+        codes = [code for code in ans_dict.get(col, {}) if code > 0 and code < 900]
+        direction = direction_dict.get(col, 0)
+        if col == 'resp_partyid':
+            values = partyid
+        elif col == 'resp_age':
+            values = np.minimum(rng.gamma(9, 5.5, n).astype(int) + 18, 80)
+        elif col == 'resp_edu':
+            values = _draw(rng, list(range(1, 17)) + [95],
+                           [.002, .003, .005, .01, .01, .015, .02, .025, .25, .2, .06, .06, .2, .1, .02, .015, .005], n)
+        elif is_thermometer(col):
+            score = np.clip(50 + 22 * support + rng.normal(0, 15, n), 0, 100)
+            heaped = rng.random(n) < 0.7
+            values = np.where(heaped, np.round(score / 5) * 5, np.round(score)).astype(int)
+            for sentinel, rate in sentinel_rates.items():
+                values[rng.random(n) < rate] = sentinel
+        elif direction != 0 and codes:
+            values = _ordinal_from_latent(direction * support + rng.normal(0, 0.75, n), codes)
+        elif col in item_shares:
+            values = _draw(rng, codes, item_shares[col], n)
+        else:
+            values = rng.choice(codes, size=n) if codes else rng.integers(1, 4, n)
+        chunk[col] = _apply_missing(rng, np.asarray(values, dtype=np.int64), col, post_complete)
+
+    return chunk
+
+def to_raw_frame(chunk):
+    raw_names = {new: old for old, new in var_dict.items()}
+    frame = {raw_names[col]: chunk[col] for col in var_dict.values()}
+    for design, cols in weights_dict.items():
+        frame[cols['weight']] = chunk[f'{design}_weight']
+        frame[cols['psu']] = chunk[f'{design}_psu']
+        frame[cols['stratum']] = chunk[f'{design}_stratum']
+    return pd.DataFrame(frame)
+
+def to_processed_frame(chunk):
+    # what anes_lgbt_fixed produces: negative codes to nan, first eligible design in priority order.
+    # columns without missing codes (case_id, mode, ...) are never nan and stay integers, as the ingest reads them
+    frame = {}
+    for col in var_dict.values():
+        if not any(code < 0 for code in ans_dict.get(col, {})):
+            frame[col] = chunk[col]
+            continue
+        values = chunk[col].astype(float)
+        values[values < 0] = np.nan
+        frame[col] = values
+    n = len(chunk['case_id'])
+    weight, psu, stratum = np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan)
+    sample_mode = np.full(n, 'no_design', dtype=object)
+    for design in priority_order:
+        take = np.isnan(weight) & ~np.isnan(chunk[f'{design}_weight']) & (chunk[f'{design}_weight'] > 0)
+        weight[take] = chunk[f'{design}_weight'][take]
+        psu[take] = chunk[f'{design}_psu'][take]
+        stratum[take] = chunk[f'{design}_stratum'][take]
+        sample_mode[take] = design
+    frame['weight'], frame['psu'], frame['stratum'], frame['sample_mode'] = weight, psu, stratum, sample_mode
+    return pd.DataFrame(frame)
+
+def iter_synthetic(n_rows, layout='processed', chunk_size=250_000, seed=0):
+    to_frame = to_raw_frame if layout == 'raw' else to_processed_frame
+    seeds = np.random.SeedSequence(seed)
+    start = 0
+    while start < n_rows:
+        size = min(chunk_size, n_rows - start)
+        yield to_frame(generate_chunk(size, seed=seeds.spawn(1)[0], start_id=200001 + start))
+        start += size
+
+def synthetic_frame(n_rows, layout='processed', chunk_size=250_000, seed=0):
+    return pd.concat(iter_synthetic(n_rows, layout, chunk_size, seed), ignore_index=True)
+
+def write_synthetic(output_file, n_rows, layout='processed', chunk_size=250_000, seed=0):
+    # only one chunk is ever held in memory
+    with open(output_file, 'w', newline='') as f:
+        for idx, frame in enumerate(iter_synthetic(n_rows, layout, chunk_size, seed)):
+            frame.to_csv(f, header=(idx == 0), index=False)
+    return output_file
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic ANES-like dataset')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--layout', choices=['raw', 'processed'], default='processed')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--chunk-size', type=int, default=250_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    output = args.output or ('anes_2024_synthetic.csv' if args.layout == 'raw' else 'lgbt_anes_synthetic.csv')
+    write_synthetic(output, args.rows, args.layout, args.chunk_size, args.seed)
+    print(f"Wrote {args.rows:,} synthetic respondents ({args.layout} layout) to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
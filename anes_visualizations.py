@@ -1,35 +1,65 @@
+import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from data.dicts import order_dict
+from anes_descriptives import aggregate_facets, reorder_columns
+from anes_density import weighted_binned_kde
+from anes_profiling import profiled
+from anes_labels import value_label
+from anes_bitmaps import select_rows, selection_label
+from data.schema import get_spec, is_thermometer, axis_label_dict, valid_mask
 
-def get_axis_direction_labels(col_name, data_type):
+# export modes; a run picks any of these by name, or ad hoc as 'format@dpi'
+export_dict = {
+    'preview': {'format': 'png', 'dpi': 72, 'suffix': '_preview'},
+    'publication': {'format': 'png', 'dpi': 300, 'suffix': ''},
+    'svg': {'format': 'svg', 'dpi': None, 'suffix': ''},
+    'pdf': {'format': 'pdf', 'dpi': None, 'suffix': ''}
+}
 
-    col_lower = col_name.lower()
-    
+default_exports = ['publication']
+
+def get_exports(exports=None):
+    # explicit list > ANES_EXPORTS env var (comma separated) > default
+    if exports is None:
+        env_exports = os.environ.get('ANES_EXPORTS', '')
+        exports = [e.strip() for e in env_exports.split(',') if e.strip()] or default_exports
+    elif isinstance(exports, str):
+        exports = [e.strip() for e in exports.split(',') if e.strip()]
+
+    specs = []
+    for name in exports:
+        if name in export_dict:
+            specs.append(export_dict[name])
+        elif '@' in name:
+            fmt, dpi = name.split('@', 1)
+            specs.append({'format': fmt, 'dpi': int(dpi), 'suffix': f'_{dpi}dpi'})
+        else:
+            raise ValueError(f"Unknown export mode '{name}', expected one of {list(export_dict)} or 'format@dpi'")
+    return specs
+
+@profiled
+def save_figure(fig, filename, exports=None):
+    # the figure is drawn once, every export just re-renders the same artists
+    stem = os.path.splitext(filename)[0]
+    saved = []
+    for spec in get_exports(exports):
+        path = f"{stem}{spec['suffix']}.{spec['format']}"
+        fig.savefig(path, format=spec['format'], dpi=spec['dpi'] or 'figure',
+                    bbox_inches='tight', facecolor='white')
+        saved.append(path)
+    return saved
+
+def get_axis_direction_labels(col_name, data_type=None):
+    # end labels live in the schema; data_type is kept for older callers
     if data_type == 'thermometer':
-        return ['Cold', 'Warm']
-    
-    question_mappings = {
-        'trans_id': ['Yes', 'No'],  # 1=Yes, 2=No
-        'trans_contact': ['Yes', 'No'],  # 1=Yes, 2=No
-        'trans_military': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'trans_bathroom': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'trans_sports': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'trans_discrim': ['Great Deal', 'None at All'],  # 1=A great deal, 5=None at all
-        'gay_id': ['Straight', 'Other'],  # 1=Heterosexual, 2-4=Other orientations
-        'gay_contact': ['Yes', 'No'],  # 1=Yes, 2=No
-        'gay_adoption': ['Strongly Permit', 'Strongly Forbid'],  # 1=Very strongly permit, 6=Very strongly not permit
-        'gay_marriage': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'gay_elect': ['Extremely Important', 'Not Important'],  # 1=Extremely important, 5=Not at all important
-        'gay_discrim': ['Favor Strongly', 'Oppose Strongly']  # 1=Favor strongly, 4=Oppose strongly
-    }
-    
-    for question_key, labels in question_mappings.items():
-        if question_key in col_lower:
-            return labels
-    
-    return ['Low', 'High']
+        return axis_label_dict['thermometer']
+    return get_spec(col_name)['axis_labels']
+
+def _selection_title(title, selection):
+    return title if selection is None else f'{title} ({selection_label(selection)})'
 
 def create_subplot_title(col_name):
     title = col_name.replace('_', ' ').title()
@@ -37,8 +67,22 @@ def create_subplot_title(col_name):
     title = title.replace('Therm', 'Feeling Thermometer')
     return title
 
-def create_single_distribution_plot(df, question_cols, title, filename, figsize_per_plot=(6, 5)):
+def add_kde_overlay(ax, df, col, n_boot=0, color='black'):
+    weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
+    kde = weighted_binned_kde(pd.to_numeric(df[col], errors='coerce').values, weights.values, n_boot=n_boot)
+    if kde is None:
+        return None
+    if 'lower' in kde:
+        ax.fill_between(kde['grid'], kde['lower'], kde['upper'], color=color, alpha=0.2, linewidth=0)
+    ax.plot(kde['grid'], kde['density'], color=color, linewidth=1.5, label='Weighted KDE')
+    return kde
+
+@profiled
+def create_single_distribution_plot(df, question_cols, title, filename, figsize_per_plot=(6, 5), exports=None,
+                                    kde=False, kde_boot=0, selection=None):
     plt.style.use('default')
+    df = select_rows(df, selection)
+    title = _selection_title(title, selection)
     sns.set_palette("husl")
     existing_cols = [col for col in question_cols if col in df.columns]
     if not existing_cols:
@@ -61,10 +105,12 @@ def create_single_distribution_plot(df, question_cols, title, filename, figsize_
         subplot_title = create_subplot_title(col)
         
         if len(valid_data) > 0:
-            if 'therm' in col:
+            if is_thermometer(col):
                 therm_data = valid_data[(valid_data >= 0) & (valid_data <= 100)]
                 if len(therm_data) > 0:
                     n, bins, patches = ax.hist(therm_data, bins=25, alpha=0.8, color=color, edgecolor='black', linewidth=0.8, density=True)
+                    if kde:
+                        add_kde_overlay(ax, df, col, n_boot=kde_boot)
                     ax.set_title(f'{subplot_title}\n(n={len(therm_data):,})', fontsize=11, pad=15, fontweight='bold')
                     
                     yticks = ax.get_yticks()
@@ -80,18 +126,15 @@ def create_single_distribution_plot(df, question_cols, title, filename, figsize_
                     ax.set_title(f'{subplot_title}', fontsize=11, pad=15, fontweight='bold')
             else:
                 value_counts = valid_data.value_counts().sort_index()
-                labels = [f'Value {int(val)}' for val in value_counts.index]
+                labels = [value_label(col, val) for val in value_counts.index]
                 percentages = (value_counts.values / len(valid_data)) * 100
                 bars = ax.bar(range(len(percentages)), percentages, alpha=0.8, color=color, edgecolor='black', linewidth=0.8)
                 ax.set_title(f'{subplot_title}\n(n={len(valid_data):,})', fontsize=11, pad=15, fontweight='bold')
                 ax.set_ylabel('Percentage (%)', fontsize=9)
                 
-                if 'gay_id' in col.lower():
-                    orientation_labels = ['Heterosexual', 'Gay/Lesbian', 'Bisexual', 'Other']
-                    actual_labels = [orientation_labels[int(val)-1] if int(val) <= len(orientation_labels) else f'Value {int(val)}'
-                                     for val in value_counts.index]
+                if col == 'gay_id':
                     ax.set_xticks(range(len(percentages)))
-                    ax.set_xticklabels(actual_labels, fontsize=9)
+                    ax.set_xticklabels(labels, fontsize=9)
                     ax.set_xlabel('Sexual Orientation', fontsize=9, labelpad=5)
                 elif len(percentages) >= 2:
                     direction_labels = get_axis_direction_labels(col, 'categorical')
@@ -113,14 +156,24 @@ def create_single_distribution_plot(df, question_cols, title, filename, figsize_
         axes[idx].set_visible(False)
     
     plt.tight_layout(rect=[0, 0.02, 1, 0.94], pad=3.0, h_pad=4.0, w_pad=3.0)
-    plt.savefig(filename, dpi=300, bbox_inches='tight', facecolor='white')
+    saved = save_figure(fig, filename, exports)
+    plt.close(fig)
+    return saved
 
-def create_comparison_plot(df, col1, col2, title="Comparison Plot", filename="comparison.png"):
+@profiled
+def create_comparison_plot(df, col1, col2, title="Comparison Plot", filename="comparison.png", exports=None,
+                           kde=False, kde_boot=0, selection=None):
+    df = select_rows(df, selection)
+    title = _selection_title(title, selection)
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
     
     valid_data1 = df[col1].dropna()
-    if 'therm' in col1:
-        ax1.hist(valid_data1, bins=20, alpha=0.7, color='blue', edgecolor='black', density=True)
+    if is_thermometer(col1):
+        # 998/999 sentinels off the 0-100 axis, as in the distribution plot and the kde
+        therm_data1 = valid_data1[valid_mask(valid_data1, col1)]
+        ax1.hist(therm_data1, bins=20, range=(0, 100), alpha=0.7, color='blue', edgecolor='black', density=True)
+        if kde:
+            add_kde_overlay(ax1, df, col1, n_boot=kde_boot)
         yticks1 = ax1.get_yticks()
         ax1.set_yticklabels([f'{tick*100:.1f}%' for tick in yticks1])
         ax1.set_xlabel('Thermometer Score')
@@ -133,8 +186,12 @@ def create_comparison_plot(df, col1, col2, title="Comparison Plot", filename="co
     ax1.set_ylabel('Percentage (%)')
     
     valid_data2 = df[col2].dropna()
-    if 'therm' in col2:
-        ax2.hist(valid_data2, bins=20, alpha=0.7, color='red', edgecolor='black', density=True)
+    if is_thermometer(col2):
+        # 998/999 sentinels off the 0-100 axis, as in the distribution plot and the kde
+        therm_data2 = valid_data2[valid_mask(valid_data2, col2)]
+        ax2.hist(therm_data2, bins=20, range=(0, 100), alpha=0.7, color='red', edgecolor='black', density=True)
+        if kde:
+            add_kde_overlay(ax2, df, col2, n_boot=kde_boot)
         yticks2 = ax2.get_yticks()
         ax2.set_yticklabels([f'{tick*100:.1f}%' for tick in yticks2])
         ax2.set_xlabel('Thermometer Score')
@@ -148,32 +205,84 @@ def create_comparison_plot(df, col1, col2, title="Comparison Plot", filename="co
     
     plt.suptitle(title, fontsize=16, fontweight='bold')
     plt.tight_layout()
+    saved = save_figure(fig, filename, exports)
     plt.show()
-    plt.savefig(filename, dpi=300, bbox_inches='tight', facecolor='white')
-
-def order_visualizations(df, trans_cols, gay_cols):
-    trans_order = [
-        'trans_id', 'trans_therm', 'trans_contact', 
-        'trans_military', 'trans_bathroom', 'trans_discrim',
-        'trans_sports_pre', 'trans_sports_post', 'trans_sports'
-    ]
-    
-    gay_order = [
-        'gay_id', 'gay_therm', 'gay_contact', 
-        'gay_marriage', 'gay_adoption', 'gay_elect', 'gay_discrim'
-    ]
-    
-    def reorder_columns(available_cols, desired_order):
-        ordered = [col for col in desired_order if col in available_cols]
-        remaining = [col for col in available_cols if col not in desired_order]
-        return ordered + remaining
-    
+    return saved
+
+@profiled
+def create_faceted_distribution_plot(df, question_cols, facet_col, title, filename, figsize_per_plot=(3, 2.2),
+                                     therm_bins=25, exports=None, selection=None):
+    plt.style.use('default')
+    df = select_rows(df, selection)
+    title = _selection_title(title, selection)
+    existing_cols = [col for col in question_cols if col in df.columns]
+    if not existing_cols or facet_col not in df.columns:
+        return
+
+    agg = aggregate_facets(df, existing_cols, facet_col, therm_bins=therm_bins)
+    facets = sorted(agg['facet'].unique())
+    if not facets:
+        return
+    colors = ['firebrick', 'orange', 'gold', 'green', 'lightseagreen', 'cornflowerblue', 'rebeccapurple', 'orchid', 'saddlebrown']
+
+    n_rows, n_cols = len(facets), len(existing_cols)
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=(figsize_per_plot[0] * n_cols + 2, figsize_per_plot[1] * n_rows + 2),
+                             sharex='col', sharey=True, squeeze=False)
+    fig.suptitle(f'{title} - Weighted Distribution by {create_subplot_title(facet_col)}', fontsize=16, fontweight='bold')
+    panels = {key: group for key, group in agg.groupby(['facet', 'question'], sort=False)}
+    bar_width = 100 / therm_bins
+
+    for col_idx, col in enumerate(existing_cols):
+        is_therm = is_thermometer(col)
+        color = colors[col_idx % len(colors)]
+        codes = sorted(agg.loc[agg['question'] == col, 'value'].unique())
+        positions = {code: i for i, code in enumerate(codes)}
+
+        for row_idx, facet in enumerate(facets):
+            ax = axes[row_idx, col_idx]
+            panel = panels.get((facet, col))
+            if panel is not None:
+                if is_therm:
+                    ax.bar(panel['value'], panel['weighted_percentage'], width=bar_width, color=color,
+                           edgecolor='black', linewidth=0.3, alpha=0.8)
+                else:
+                    ax.bar(panel['value'].map(positions), panel['weighted_percentage'], color=color,
+                           edgecolor='black', linewidth=0.5, alpha=0.8)
+                ax.text(0.98, 0.95, f"n={int(panel['n'].sum()):,}", ha='right', va='top', transform=ax.transAxes, fontsize=7)
+
+            ax.grid(True, alpha=0.3, linestyle='--')
+            ax.spines['top'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+            if row_idx == 0:
+                ax.set_title(create_subplot_title(col), fontsize=10, fontweight='bold')
+            if col_idx == 0:
+                ax.set_ylabel(f"{value_label(facet_col, facet)}\n(%)", fontsize=8)
+
+        bottom = axes[-1, col_idx]
+        if is_therm:
+            bottom.set_xticks([0, 100])
+            bottom.set_xticklabels(get_axis_direction_labels(col, 'thermometer'), fontsize=8)
+        elif len(codes) >= 2:
+            bottom.set_xticks([0, len(codes) - 1])
+            bottom.set_xticklabels(get_axis_direction_labels(col, 'categorical'), fontsize=8)
+        else:
+            bottom.set_xticks(range(len(codes)))
+            bottom.set_xticklabels([value_label(col, val) for val in codes], fontsize=8)
+
+    fig.subplots_adjust(left=0.08, right=0.98, bottom=0.06, top=0.92, wspace=0.15, hspace=0.25)
+    saved = save_figure(fig, filename, exports)
+    plt.close(fig)
+    return saved
+
+def order_visualizations(df, trans_cols, gay_cols, exports=None, kde=False, kde_boot=0, selection=None):
     if trans_cols:
-        ordered_trans = reorder_columns(trans_cols, trans_order)
+        ordered_trans = reorder_columns(trans_cols, order_dict['trans_qs'])
         create_single_distribution_plot(df, ordered_trans, 'Transgender Questions', 
-                                       'transgender_questions_distribution.png')
+                                       'transgender_questions_distribution.png', exports=exports,
+                                       kde=kde, kde_boot=kde_boot, selection=selection)
     
     if gay_cols:
-        ordered_gay = reorder_columns(gay_cols, gay_order)
+        ordered_gay = reorder_columns(gay_cols, order_dict['gay_qs'])
         create_single_distribution_plot(df, ordered_gay, 'Gay/LGB Questions', 
-                                       'gay_lgb_questions_distribution.png')
\ No newline at end of file
+                                       'gay_lgb_questions_distribution.png', exports=exports,
+                                       kde=kde, kde_boot=kde_boot, selection=selection)
\ No newline at end of file
@@ -154,4 +154,28 @@ theme_dict = {
     'gay_qs': {
         'gay_id', 'gay_contact', 'gay_therm', 'gay_adoption', 'gay_marriage', 'gay_elect', 'gay_discrim',
     }
-}
\ No newline at end of file
+}
+
+# display order for plots and reports; unlisted columns go last
+order_dict = {
+    'trans_qs': [
+        'trans_id', 'trans_therm', 'trans_contact',
+        'trans_military', 'trans_bathroom', 'trans_discrim',
+        'trans_sports_pre', 'trans_sports_post', 'trans_sports_prepost'],
+    'gay_qs': [
+        'gay_id', 'gay_therm', 'gay_contact',
+        'gay_marriage', 'gay_adoption', 'gay_elect', 'gay_discrim']
+}
+
+# which end of each attitude scale is more supportive of lgbtq+ people:
+# 1 = higher codes are more supportive, -1 = lower codes are, 0 = not an attitude item
+direction_dict = {
+    'trans_id': 0, 'trans_contact': 0, 'trans_therm': 1,
+    'trans_military': -1,  # 1=favor allowing transgender people to serve
+    'trans_bathroom': -1,  # 1=favor allowing bathrooms that match gender identity
+    'trans_sports_pre': 1, 'trans_sports_post': 1, 'trans_sports_prepost': 1,  # 1=favor a ban
+    'trans_discrim': -1,  # 1=a great deal of discrimination
+    'gay_id': 0, 'gay_contact': 0, 'gay_therm': 1,
+    'gay_adoption': -1, 'gay_marriage': -1, 'gay_discrim': -1,  # 1=permit/favor
+    'gay_elect': 0
+}
@@ -1,17 +1,23 @@
 import pandas as pd
 import numpy as np
-from aneslgbtq.data.dicts import var_dict, ans_dict
-from aneslgbtq.data.weights import weights_dict
+from data.dicts import var_dict, ans_dict
+from data.weights import weights_dict, priority_order as weights_priority
+from anes_profiling import profiled
+from anes_backend import get_backend, read_header, load_with_design, stream_with_design, missing_codes
+from anes_memory import plan, estimate_csv_rows, float_bytes
 
-def anes_lgbt_fixed(input_file='anes_2024.csv', output_file='lgbt_anes.csv'):
+validation_rows = 10
+
+@profiled
+def anes_lgbt_fixed(input_file='anes_2024.csv', output_file='lgbt_anes.csv', backend=None):
     print(f"Loading data from {input_file}...")
-    df = pd.read_csv(input_file)
-    print(f"Original dataset shape: {df.shape}")
+    header = read_header(input_file)
+    print(f"Original dataset columns: {len(header)}")
 
     column_mapping = var_dict
     columns_to_keep = list(column_mapping.keys())
-    existing_columns = [col for col in columns_to_keep if col in df.columns]
-    missing_columns = [col for col in columns_to_keep if col not in df.columns]
+    existing_columns = [col for col in columns_to_keep if col in header]
+    missing_columns = [col for col in columns_to_keep if col not in header]
 
     if missing_columns:
         print(f"\nWarning: {len(missing_columns)} columns not found in dataset:")
@@ -20,145 +26,134 @@ def anes_lgbt_fixed(input_file='anes_2024.csv', output_file='lgbt_anes.csv'):
         if len(missing_columns) > 5:
             print(f"  ... and {len(missing_columns) - 5} more")
 
-    print(f"\nFiltering dataset to keep {len(existing_columns)} columns...")
-    filtered_df = df[existing_columns].copy()
-
-    print(f"\nRenaming {len(existing_columns)} columns based on mapping...")
-    filtered_df = filtered_df.rename(columns=column_mapping)
-
-    missing_codes = [-9, -8, -7, -6, -5, -4, -3, -2, -1]
-    print(f"\nCleaning missing codes {missing_codes}...")
-    
-    for col in filtered_df.columns:
-        if col not in ['weight_post', 'psu', 'stratum']:
-            filtered_df[col] = filtered_df[col].replace(missing_codes, np.nan)
-
-    # weight psu stratum
-    print("\nInitializing survey design variables...")
-    filtered_df['weight'] = np.nan
-    filtered_df['psu'] = np.nan
-    filtered_df['stratum'] = np.nan
-
     print("\nChecking available weight columns...")
-    available_weights = {}
+    available_weights = available_designs(header)
     
     for sample_type, info in weights_dict.items():
-        weight_col = info.get('weight')
-        psu_col = info.get('psu')
-        stratum_col = info.get('stratum')
-        
-        if all(col in df.columns for col in [weight_col, psu_col, stratum_col]):
-            available_weights[sample_type] = {
-                'weight': weight_col,
-                'psu': psu_col,
-                'stratum': stratum_col
-            }
-            print(f"  ✓ {sample_type}: {weight_col}, {psu_col}, {stratum_col}")
+        if sample_type in available_weights:
+            print(f"  ✓ {sample_type}: {info['weight']}, {info['psu']}, {info['stratum']}")
         else:
             print(f"  ✗ {sample_type}: Missing columns")
 
+    # checked before either path reads or writes anything, so streamed and in-memory runs stop alike
     if not available_weights:
         print("ERROR: No complete weight/PSU/stratum combinations found!")
-        return filtered_df
-
-    print(f"\nAssigning weights row-by-row for {len(filtered_df)} respondents...")
-    
-    weight_cols = []
-    psu_cols = []
-    stratum_cols = []
-    
-    for sample_type, cols in available_weights.items():
-        weight_cols.append(cols['weight'])
-        psu_cols.append(cols['psu'])
-        stratum_cols.append(cols['stratum'])
-    
-    print("Converting weight columns to numeric...")
-    for col in weight_cols + psu_cols + stratum_cols:
-        df[col] = df[col].replace([' ', '', '  ', '   '], np.nan)
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        df[col] = df[col].replace(missing_codes, np.nan)
-    
-    # priority order for weight assignment (i did most comprehensive to least)
-    priority_order = ['ftf_web_papi', 'panel_ftf_web_papi', 'ftf_web_panel', 
-                     'ftf_web', 'web_papi', 'panel', 'web', 'ftf']
-    
-    priority_order = [wt for wt in priority_order if wt in available_weights]
-    
+        return None
+
+    priority_order = [wt for wt in weights_priority if wt in available_weights]
+
+    # only the codebook and design columns are read; the backend cleans missing codes and
+    # takes weight/psu/stratum from the first usable design in priority order
+    backend = get_backend(backend)
+    var_cols = {col: column_mapping[col] for col in existing_columns}
+    design_cols = {col for cols in available_weights.values() for col in cols.values()}
+    # raw columns, cleaned columns and the reader's own buffers all hold a float per cell at once
+    decision = plan('anes_lgbt_fixed', estimate_csv_rows(input_file),
+                    3 * float_bytes * (len(existing_columns) + len(design_cols)))
+    print(f"\nReading {len(existing_columns)} columns and cleaning missing codes {missing_codes} ({backend})...")
     print(f"Using priority order: {priority_order}")
-    
-    weights_assigned = 0
-    assignment_counts = {}
-    
-    for idx in filtered_df.index:
-        assigned = False
-        
-        for sample_type in priority_order:
-            cols = available_weights[sample_type]
-            
-            weight_val = df.loc[idx, cols['weight']]
-            psu_val = df.loc[idx, cols['psu']]
-            stratum_val = df.loc[idx, cols['stratum']]
-            
-            if (pd.notna(weight_val) and pd.notna(psu_val) and pd.notna(stratum_val) and 
-                weight_val > 0):
-                
-                filtered_df.loc[idx, 'weight'] = weight_val
-                filtered_df.loc[idx, 'psu'] = psu_val
-                filtered_df.loc[idx, 'stratum'] = stratum_val
-                
-                assignment_counts[sample_type] = assignment_counts.get(sample_type, 0) + 1
-                weights_assigned += 1
-                assigned = True
-                break
-        
-        if not assigned:
-            pass
+    if decision['strategy'] == 'chunked':
+        # over the memory budget: stream row chunks straight to the output file, keep only running totals
+        print(f"Memory budget {decision['budget_mb']:,.0f} MB < estimated {decision['estimate_mb']:,.0f} MB, "
+              f"streaming {decision['chunk_rows']:,} rows at a time")
+        filtered_df, stats = None, None
+        for idx, (chunk, source) in enumerate(stream_with_design(input_file, var_cols, available_weights,
+                                                                 priority_order, decision['chunk_rows'])):
+            chunk = _with_sample_mode(chunk, source)
+            chunk.to_csv(output_file, index=False, mode='w' if idx == 0 else 'a', header=idx == 0)
+            stats = _merge_stats(stats, _ingest_stats(chunk, source))
+    else:
+        filtered_df, source = load_with_design(input_file, var_cols, available_weights, priority_order, backend=backend)
+        filtered_df = _with_sample_mode(filtered_df, source)
+        stats = _ingest_stats(filtered_df, source)
+
+    assignment_counts = {name: stats['sources'][name] for name in priority_order if name in stats['sources']}
+    weights_assigned = sum(assignment_counts.values())
     
     print(f"\nWeight assignment results:")
-    print(f"  Total respondents: {len(filtered_df):,}")
+    print(f"  Total respondents: {stats['rows']:,}")
     print(f"  Weights assigned: {weights_assigned:,}")
-    print(f"  No weights: {len(filtered_df) - weights_assigned:,}")
+    print(f"  No weights: {stats['rows'] - weights_assigned:,}")
     
     print(f"\nBreakdown by survey type:")
     for sample_type, count in assignment_counts.items():
-        percentage = (count / len(filtered_df)) * 100
+        percentage = (count / stats['rows']) * 100
         print(f"  {sample_type}: {count:,} ({percentage:.1f}%)")
     
     print(f"\nFinal weight statistics:")
-    valid_weights = filtered_df['weight'].notna().sum()
+    valid_weights = stats['valid_weights']
     if valid_weights > 0:
-        print(f"  Valid weights: {valid_weights:,}/{len(filtered_df):,}")
-        print(f"  Weight range: {filtered_df['weight'].min():.4f} to {filtered_df['weight'].max():.4f}")
-        print(f"  Mean weight: {filtered_df['weight'].mean():.4f}")
-        print(f"  Unique PSUs: {filtered_df['psu'].nunique()}")
-        print(f"  Unique Strata: {filtered_df['stratum'].nunique()}")
+        print(f"  Valid weights: {valid_weights:,}/{stats['rows']:,}")
+        print(f"  Weight range: {stats['weight_min']:.4f} to {stats['weight_max']:.4f}")
+        print(f"  Mean weight: {stats['weight_sum'] / valid_weights:.4f}")
+        print(f"  Unique PSUs: {len(stats['psus'])}")
+        print(f"  Unique Strata: {len(stats['strata'])}")
     else:
         print("  ERROR: No valid weights assigned!")
     
-    print(f"\nFiltered dataset shape: {filtered_df.shape}")
+    print(f"\nFiltered dataset shape: {(stats['rows'], len(stats['columns']))}")
     print(f"\nFinal column names:")
-    for i, col in enumerate(filtered_df.columns):
+    for i, col in enumerate(stats['columns']):
         print(f"  {i+1:2d}. {col}")
 
-    filtered_df.to_csv(output_file, index=False)
+    if filtered_df is not None:
+        filtered_df.to_csv(output_file, index=False)
     print(f"\nFiltered dataset saved as '{output_file}'")
 
     print(f"\nData quality summary:")
-    print(f"Number of rows: {len(filtered_df):,}")
-    print(f"Number of columns: {len(filtered_df.columns)}")
+    print(f"Number of rows: {stats['rows']:,}")
+    print(f"Number of columns: {len(stats['columns'])}")
     
-    weight_issues = filtered_df['weight'].isna().sum()
+    weight_issues = stats['rows'] - valid_weights
     if weight_issues > 0:
         print(f"{weight_issues:,} respondents without weights")
     else:
         print("All respondents have valid weights")
 
+    # the streamed run never holds the whole frame, so there is nothing to hand back
     return filtered_df
 
+def available_designs(header):
+    # the weights_dict designs whose weight, psu and stratum columns are all in the raw file
+    return {sample_type: {part: info.get(part) for part in ('weight', 'psu', 'stratum')}
+            for sample_type, info in weights_dict.items()
+            if all(info.get(part) in header for part in ('weight', 'psu', 'stratum'))}
+
+def _with_sample_mode(frame, source):
+    # which weights_dict design each respondent's weight/psu/stratum came from, 'no_design' when none applied
+    mode = pd.Series(source.to_numpy(dtype=object), index=frame.index)
+    return frame.assign(sample_mode=mode.where(mode.notna(), 'no_design'))
+
+def _ingest_stats(frame, source):
+    # what the ingest report needs, in a form row chunks can be merged into
+    weights = frame['weight'].dropna()
+    return {
+        'rows': len(frame), 'columns': list(frame.columns),
+        'sources': {name: int(count) for name, count in source.value_counts().items()},
+        'valid_weights': int(len(weights)), 'weight_sum': float(weights.sum()),
+        'weight_min': float(weights.min()) if len(weights) else np.inf,
+        'weight_max': float(weights.max()) if len(weights) else -np.inf,
+        'psus': set(frame['psu'].dropna().unique()), 'strata': set(frame['stratum'].dropna().unique())
+    }
+
+def _merge_stats(total, part):
+    if total is None:
+        return part
+    return {
+        'rows': total['rows'] + part['rows'], 'columns': total['columns'],
+        'sources': {name: total['sources'].get(name, 0) + part['sources'].get(name, 0)
+                    for name in {**total['sources'], **part['sources']}},
+        'valid_weights': total['valid_weights'] + part['valid_weights'],
+        'weight_sum': total['weight_sum'] + part['weight_sum'],
+        'weight_min': min(total['weight_min'], part['weight_min']),
+        'weight_max': max(total['weight_max'], part['weight_max']),
+        'psus': total['psus'] | part['psus'], 'strata': total['strata'] | part['strata']
+    }
+
 def validate_weights(df, original_df, weights_dict):
     print("Weight Validation")
     
-    sample_indices = df.index[:10]
+    sample_indices = df.index[:validation_rows]
     
     for idx in sample_indices:
         assigned_weight = df.loc[idx, 'weight']
@@ -190,9 +185,16 @@ if __name__ == "__main__":
     print("ANES 2024 LGBTQ Data Analysis")
 
     try:
-        original_df = pd.read_csv('anes_2024.csv')
+        # validate_weights only looks at the first rows, so the raw file isn't read whole
+        original_df = pd.read_csv('anes_2024.csv', nrows=validation_rows)
         filtered_data = anes_lgbt_fixed()
-        validate_weights(filtered_data, original_df, weights_dict)
+        if filtered_data is None and available_designs(original_df.columns):
+            # streamed under the memory budget: the output file is the only copy of the result
+            filtered_data = pd.read_csv('lgbt_anes.csv', nrows=validation_rows)
+        if filtered_data is None:
+            print("No weights assigned, skipping weight validation")
+        else:
+            validate_weights(filtered_data, original_df, weights_dict)
         
     except FileNotFoundError:
         print("Error: 'anes_2024.csv' file not found. Please make sure the file is in the current directory.")
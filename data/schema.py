@@ -0,0 +1,158 @@
+"""
+compiled variable schema, built once at import from var_dict, ans_dict, theme_dict and direction_dict
+modules look a column up here instead of guessing its type from the name
+"""
+
+from data.dicts import var_dict, ans_dict, theme_dict, direction_dict
+
+# columns that describe the interview or the design rather than a respondent answer
+admin_cols = ('case_id', 'int_mode', 'prepost_status', 'sample_type', 'sample_mode')
+design_cols = ('weight', 'psu', 'stratum')
+non_analysis_cols = frozenset(admin_cols + design_cols)
+
+sentinel_floor = 900  # 998/999 style "don't know"/"don't recognize" codes
+
+# feeling thermometers are recognized from the codebook: no labelled answer codes, only 998/999 style sentinels
+thermometer_range = (0, 100)
+
+# range variables the codebook pattern can't tell apart from coded items
+range_dict = {
+    'resp_age': ('continuous', 18, 80)  # 80 = 80 or older
+}
+
+# unordered categories; every other labelled item with 3+ codes is an ordinal scale
+nominal_vars = {'gay_id', 'resp_race'}
+
+# real answers that have no place on the item's ordered scale ('Other' education is not above a doctorate);
+# they keep their label for tables but are not valid codes, so numeric and ordinal uses treat them as missing
+nonsubstantive_dict = {
+    'resp_edu': (95,)
+}
+
+# end labels for the response axis, low code first
+axis_label_dict = {
+    'thermometer': ['Cold', 'Warm'],
+    'trans_id': ['Yes', 'No'],
+    'trans_contact': ['Yes', 'No'],
+    'trans_military': ['Favor Greatly', 'Oppose Greatly'],
+    'trans_bathroom': ['Favor Greatly', 'Oppose Greatly'],
+    'trans_sports_pre': ['Favor Greatly', 'Oppose Greatly'],
+    'trans_sports_post': ['Favor Greatly', 'Oppose Greatly'],
+    'trans_sports_prepost': ['Favor Greatly', 'Oppose Greatly'],
+    'trans_discrim': ['Great Deal', 'None at All'],
+    'gay_id': ['Straight', 'Other'],
+    'gay_contact': ['Yes', 'No'],
+    'gay_adoption': ['Strongly Permit', 'Strongly Forbid'],
+    'gay_marriage': ['Favor Greatly', 'Oppose Greatly'],
+    'gay_elect': ['Extremely Important', 'Not Important'],
+    'gay_discrim': ['Favor Strongly', 'Oppose Strongly']
+}
+default_axis_labels = ['Low', 'High']
+
+def _theme(col):
+    for theme, cols in theme_dict.items():
+        if col in cols:
+            return theme
+    if col.startswith('resp_'):
+        return 'demographics'
+    if col in admin_cols:
+        return 'admin'
+    if col in design_cols:
+        return 'design'
+    return None
+
+# anes variable numbers: V240xxx admin, V241xxx pre-election wave, V242xxx post-election wave
+wave_prefix_dict = {'V240': 'admin', 'V241': 'pre', 'V242': 'post'}
+raw_names = {new: old for old, new in var_dict.items()}
+
+def _compile(col):
+    codes = ans_dict.get(col, {})
+    missing_codes = tuple(sorted(code for code in codes if code < 0))
+    sentinels = tuple(sorted(code for code in codes if code >= sentinel_floor))
+    labels = {code: label for code, label in codes.items() if 0 <= code < sentinel_floor}
+    nonsubstantive = nonsubstantive_dict.get(col, ())
+
+    if col in range_dict:
+        kind, valid_min, valid_max = range_dict[col]
+        valid_codes = None
+    elif sentinels and not labels:
+        kind, (valid_min, valid_max), valid_codes = 'thermometer', thermometer_range, None
+    elif col in admin_cols or col in design_cols:
+        kind, valid_min, valid_max, valid_codes = 'admin' if col in admin_cols else 'design', None, None, None
+    else:
+        valid_codes = tuple(sorted(code for code in labels if code not in nonsubstantive))
+        valid_min, valid_max = (valid_codes[0], valid_codes[-1]) if valid_codes else (None, None)
+        if len(valid_codes) == 2:
+            kind = 'binary'
+        elif col in nominal_vars:
+            kind = 'nominal'
+        else:
+            kind = 'ordinal'
+
+    # smallest dtype that holds every code once missing codes are nan (nullable so nan survives)
+    top = max([abs(c) for c in codes] + [valid_max or 0])
+    dtype = None if kind in ('admin', 'design') else ('Int8' if top < 128 else 'Int16')
+    return {
+        'name': col,
+        'kind': kind,
+        'theme': _theme(col),
+        'valid_min': valid_min,
+        'valid_max': valid_max,
+        'valid_codes': valid_codes,
+        'missing_codes': missing_codes,
+        'sentinels': sentinels,
+        'nonsubstantive': nonsubstantive,
+        'labels': labels,
+        'axis_labels': axis_label_dict.get(kind if kind == 'thermometer' else col, default_axis_labels),
+        'direction': direction_dict.get(col, 0),
+        'wave': wave_prefix_dict.get(raw_names.get(col, '')[:4]),
+        'dtype': dtype
+    }
+
+schema_dict = {col: _compile(col) for col in list(var_dict.values()) + [col for col in admin_cols + design_cols
+                                                                     if col not in var_dict.values()]}
+
+def get_spec(col):
+    # columns outside the codebook (derived or synthetic) get an empty spec rather than a guess
+    return schema_dict.get(col) or {'name': col, 'kind': 'unknown', 'theme': None, 'valid_min': None,
+                                    'valid_max': None, 'valid_codes': None, 'missing_codes': (), 'sentinels': (),
+                                    'nonsubstantive': (), 'labels': {}, 'axis_labels': default_axis_labels, 'direction': 0, 'wave': None,
+                                    'dtype': None}
+
+def kind_of(col):
+    spec = schema_dict.get(col)
+    return spec['kind'] if spec else 'unknown'
+
+def is_thermometer(col):
+    return kind_of(col) == 'thermometer'
+
+def is_range(col):
+    return kind_of(col) in ('thermometer', 'continuous')
+
+def columns_of_kind(columns, *kinds):
+    return [col for col in columns if kind_of(col) in kinds]
+
+def theme_columns(columns, theme):
+    return [col for col in columns if col in schema_dict and schema_dict[col]['theme'] == theme]
+
+def analysis_columns(columns):
+    return [col for col in columns if col not in non_analysis_cols]
+
+def valid_mask(series, col=None):
+    # range variables must fall inside their range (drops 998/999 sentinels); coded variables need a value
+    # that is not a non-substantive code
+    spec = schema_dict.get(col or series.name)
+    if spec and spec['kind'] in ('thermometer', 'continuous'):
+        return series.between(spec['valid_min'], spec['valid_max'])
+    if spec and spec['nonsubstantive']:
+        return series.notna() & ~series.isin(spec['nonsubstantive'])
+    return series.notna()
+
+def kind_map(columns):
+    return {col: kind_of(col) for col in columns}
+
+def compact_frame(df):
+    # opt-in downcast of codebook columns for long-lived frames; nan-only handling stays with the caller
+    dtypes = {col: schema_dict[col]['dtype'] for col in df.columns
+              if col in schema_dict and schema_dict[col]['dtype'] and df[col].dropna().mod(1).eq(0).all()}
+    return df.astype(dtypes)
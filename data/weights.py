@@ -44,4 +44,43 @@ weights_dict = {
         "psu": "V240108c",
         "stratum": "V240108d"
     }
-}
\ No newline at end of file
+}
+
+# priority order for weight assignment (i did most comprehensive to least)
+priority_order = ['ftf_web_papi', 'panel_ftf_web_papi', 'ftf_web_panel',
+                  'ftf_web', 'web_papi', 'panel', 'web', 'ftf']
+
+# groupings of the demographics used as calibration margins; ages are [low, high) bins,
+# coded items map group -> codes. codes outside every group (edu 95 'Other') count as missing
+calibration_dict = {
+    "age": {
+        "column": "resp_age",
+        "bins": [18, 30, 45, 65, 81],
+        "labels": ["18-29", "30-44", "45-64", "65+"]
+    },
+    "race": {
+        "column": "resp_race",
+        "groups": {
+            "White": [1],
+            "Black": [2],
+            "Hispanic": [3],
+            "Other": [4, 5, 6]
+        }
+    },
+    "edu": {
+        "column": "resp_edu",
+        "groups": {
+            "High school or less": [1, 2, 3, 4, 5, 6, 7, 8, 9],
+            "Some college": [10, 11, 12],
+            "Bachelor's": [13],
+            "Postgraduate": [14, 15, 16]
+        }
+    }
+}
+
+# named margin sets; 'age*race*edu' style names cross dimensions into joint cells
+margin_sets = {
+    "oneway": ["age", "race", "edu"],
+    "joint": ["age*race*edu"]
+}
+default_margins = margin_sets["oneway"]
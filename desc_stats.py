@@ -5,6 +5,7 @@ import seaborn as sns
 from samplics.estimation import TaylorEstimator
 from samplics.utils.types import PopParam
 from aneslgbtq.data.dicts import var_dict, ans_dict, theme_dict
+from aneslgbtq.data.schema import get_spec, is_thermometer, theme_columns, analysis_columns
 
 value_meanings = ans_dict
 trans_questions = list(theme_dict['trans_qs'])
@@ -22,7 +23,7 @@ def load_and_prepare_data(csv_file_path):
 def basic_descriptive_stats(df):
     trans_cols = [col for col in trans_questions if col in df.columns]
     gay_cols = [col for col in gay_questions if col in df.columns]
-    demo_cols = [col for col in df.columns if col.startswith('resp_')]
+    demo_cols = theme_columns(df.columns, 'demographics')
 
     for group_name, cols in [("Transgender Questions", trans_cols), 
                              ("Gay/LGB Questions", gay_cols), 
@@ -40,7 +41,7 @@ def samplics_analysis(df):
     weights = df['weight'] if 'weight' in df.columns else pd.Series(1.0, index=df.index)
     print("Using weight column from dataframe")
 
-    analysis_vars = [col for col in df.columns if col != 'weight']
+    analysis_vars = analysis_columns(df.columns)
     results = {}
 
     for var in analysis_vars:
@@ -48,7 +49,7 @@ def samplics_analysis(df):
         if valid_mask.sum() <= 10:
             continue
         try:
-            if "therm" in var:
+            if is_thermometer(var):
                 taylor_est = TaylorEstimator(PopParam.mean)
                 mean_est = taylor_est.estimate(
                     y=df.loc[valid_mask, var],
@@ -92,31 +93,9 @@ def get_axis_direction_labels(col_name, data_type):
     """
     Generate directional labels for x-axis endpoints based on specific ANES LGBTQ+ questions
     """
-    col_lower = col_name.lower()
-    
     if data_type == 'thermometer':
         return ['Cold', 'Warm']
-    
-    question_mappings = {
-        'trans_id': ['Yes', 'No'],  # 1=Yes, 2=No
-        'trans_contact': ['Yes', 'No'],  # 1=Yes, 2=No
-        'trans_military': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'trans_bathroom': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'trans_sports': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'trans_discrim': ['Great Deal', 'None at All'],  # 1=A great deal, 5=None at all
-        'gay_id': ['Straight', 'Other'],  # 1=Heterosexual, 2-4=Other orientations
-        'gay_contact': ['Yes', 'No'],  # 1=Yes, 2=No
-        'gay_adoption': ['Strongly Permit', 'Strongly Forbid'],  # 1=Very strongly permit, 6=Very strongly not permit
-        'gay_marriage': ['Favor Greatly', 'Oppose Greatly'],  # 1=Favor a great deal, 7=Oppose a great deal
-        'gay_elect': ['Extremely Important', 'Not Important'],  # 1=Extremely important, 5=Not at all important
-        'gay_discrim': ['Favor Strongly', 'Oppose Strongly']  # 1=Favor strongly, 4=Oppose strongly
-    }
-    
-    for question_key, labels in question_mappings.items():
-        if question_key in col_lower:
-            return labels
-    
-    return ['Low', 'High']
+    return get_spec(col_name)['axis_labels']
 
 def create_subplot_title(col_name):
     title = col_name.replace('_', ' ').title()
@@ -149,7 +128,7 @@ def create_single_distribution_plot(df, question_cols, title, filename, figsize_
         subplot_title = create_subplot_title(col)
         
         if len(valid_data) > 0:
-            if 'therm' in col:
+            if is_thermometer(col):
                 therm_data = valid_data[(valid_data >= 0) & (valid_data <= 100)]
                 if len(therm_data) > 0:
                     ax.hist(therm_data, bins=25, alpha=0.8, color=color, edgecolor='black', linewidth=0.8)
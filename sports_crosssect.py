@@ -1,10 +1,13 @@
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import stats
+from anes_backend import read_csv
 
-def main():
-    df = pd.read_csv("lgbt_anes.csv")
+sports_cols = ['trans_sports_pre', 'trans_sports_post']
+
+def main(csv_file_path="lgbt_anes.csv", backend=None):
+    # only the two sports items are read
+    df = read_csv(csv_file_path, columns=sports_cols, backend=backend)
     print(f"Total respondents: {len(df):,}")
     
     print(f"\nData Structure:")
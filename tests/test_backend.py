@@ -0,0 +1,11 @@
+import os
+import pytest
+from anes_backend import available_backends, check_parity
+
+bundled_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lgbt_anes.csv')
+
+@pytest.mark.skipif(available_backends() == ['pandas'], reason='only pandas installed, nothing to compare')
+def test_backends_match_pandas_on_bundled_data():
+    problems = check_parity(bundled_csv, raw_rows=5000)
+    assert set(problems) == set(available_backends()) - {'pandas'}
+    assert problems == {backend: [] for backend in problems}
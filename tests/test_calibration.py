@@ -0,0 +1,25 @@
+import os
+import pandas as pd
+from anes_calibration import calibrate, margins_from_weights
+from data.weights import margin_sets
+
+bundled_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lgbt_anes.csv')
+
+def _equal_base():
+    df = pd.read_csv(bundled_csv)
+    df['_base'] = df['weight'].notna().astype(float).where(df['weight'].notna())
+    return df
+
+def test_trimmed_raking_converges_inside_the_limits():
+    df = _equal_base()
+    weights, diagnostics = calibrate(df, margins_from_weights(df), base_col='_base', trim=(0.5, 2))
+    w = weights.dropna()
+    assert diagnostics['converged'] and diagnostics['infeasible_cells'] == []
+    assert w.min() >= 0.5 * w.mean() * (1 - 1e-9) and w.max() <= 2 * w.mean() * (1 + 1e-9)
+
+def test_unreachable_trim_is_reported():
+    df = _equal_base()
+    weights, diagnostics = calibrate(df, margins_from_weights(df, margin_sets['joint']), base_col='_base', trim=(0.5, 2))
+    assert not diagnostics['converged']
+    assert diagnostics['infeasible_cells'] and all(cell.startswith('age*race*edu=') for cell in diagnostics['infeasible_cells'])
+    assert diagnostics['iterations'] < 100
@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from anes_correlations import default_items, pearson_table, polychoric_table
+
+bundled_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lgbt_anes.csv')
+
+def _discretized(rho, n=200000, seed=0):
+    z = np.random.default_rng(seed).multivariate_normal([0, 0], [[1, rho], [rho, 1]], n)
+    a, b = np.searchsorted([-1, -0.3, 0.4, 1.2], z[:, 0]), np.searchsorted([-0.5, 0.6], z[:, 1])
+    table = np.zeros((1, 5, 3))
+    np.add.at(table, (0, a, b), 1)
+    return table
+
+def test_polychoric_recovers_a_strong_correlation_from_any_start():
+    tables = np.concatenate([_discretized(0.95), _discretized(0.93, seed=1), _discretized(-0.9, seed=2)])
+    pearson = pearson_table(tables, np.arange(5.0), np.arange(3.0))
+    for start in (None, pearson, 0.8):
+        assert np.allclose(polychoric_table(tables, start=start), [0.95, 0.93, -0.9], atol=0.01)
+
+def test_polychoric_is_nan_when_it_runs_out_of_iterations():
+    assert np.isnan(polychoric_table(_discretized(0.95), max_iter=1)).all()
+
+def test_default_items_drop_the_combined_sports_item():
+    from data.dicts import var_dict
+    from anes_statistics import load_and_prepare_data
+    df, _ = load_and_prepare_data(bundled_csv, var_dict)
+    items = default_items(df)
+    assert 'trans_sports_prepost' not in items and {'trans_sports_pre', 'trans_sports_post'} <= set(items)
@@ -0,0 +1,16 @@
+import os
+import pandas as pd
+from anes_labels import frequency_tables
+
+bundled_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lgbt_anes.csv')
+
+def test_range_items_are_binned_and_sentinels_labelled_outside_the_base():
+    df = pd.read_csv(bundled_csv)
+    table = frequency_tables(df, ['trans_therm', 'resp_age', 'resp_edu'])
+    therm = table[table['question'] == 'trans_therm']
+    assert list(therm['label']) == [f'{low}-{low + 9}' for low in range(0, 90, 10)] + ['90-100', "Don't know rating"]
+    assert therm['percentage'].iloc[-1] != therm['percentage'].iloc[-1]  # 998 has no percentage
+    assert abs(therm['percentage'].sum() - 100) < 1e-9
+    assert abs(therm['weighted_percentage'].sum() - 100) < 1e-9
+    assert len(table[table['question'] == 'resp_age']) == 7
+    assert 'Other' in set(table.loc[table['question'] == 'resp_edu', 'label'])
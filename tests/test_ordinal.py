@@ -0,0 +1,16 @@
+import os
+import numpy as np
+import pandas as pd
+from anes_ordinal import covariate_matrix, default_covariates
+
+bundled_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'lgbt_anes.csv')
+
+def test_covariates_stay_on_their_scales():
+    df = pd.read_csv(bundled_csv)
+    X, names, complete = covariate_matrix(df, default_covariates)
+    edu = X[complete, names.index('resp_edu')]
+    assert edu.max() <= 16
+    assert not complete[(df['resp_edu'] == 95).to_numpy()].any()
+    age = X[complete, names.index('resp_age')]
+    assert age.min() >= 18 and age.max() <= 80
+    assert np.isin(X[complete, names.index('resp_partyid')], np.arange(1, 8)).all()
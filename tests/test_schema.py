@@ -0,0 +1,13 @@
+from data import dicts
+from data.schema import _compile, schema_dict
+
+def test_thermometers_come_from_the_codebook_pattern(monkeypatch):
+    assert schema_dict['trans_therm']['kind'] == schema_dict['gay_therm']['kind'] == 'thermometer'
+    monkeypatch.setitem(dicts.ans_dict, 'new_therm', {-9: 'Refused', 998: "Don't know rating", 999: "Don't recognize"})
+    spec = _compile('new_therm')
+    assert (spec['kind'], spec['valid_min'], spec['valid_max'], spec['valid_codes']) == ('thermometer', 0, 100, None)
+
+def test_other_education_is_off_the_scale():
+    spec = schema_dict['resp_edu']
+    assert spec['kind'] == 'ordinal' and 95 not in spec['valid_codes'] and spec['valid_max'] == 16
+    assert spec['nonsubstantive'] == (95,) and spec['labels'][95] == 'Other'